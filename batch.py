@@ -0,0 +1,142 @@
+from cache_simulation import Simulator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+from results import ResultsStore, run_row
+from stats import AccessType
+from os import path
+import argparse
+import glob
+import os
+import sys
+import time
+import traceback
+
+PROTOCOLS = ['msi', 'mesi']
+
+
+def find_traces(patterns):
+    # Every file matched by the globs, directories stand for all the files in them. Duplicates are dropped.
+    traces = []
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+        if not matches:
+            raise Exception('No trace matches \'{}\'.'.format(pattern))
+        for match in sorted(matches):
+            if path.isdir(match):
+                traces.extend(path.join(match, f) for f in sorted(os.listdir(match))
+                              if path.isfile(path.join(match, f)))
+            else:
+                traces.append(match)
+    names = {}
+    for trace in map(path.normpath, traces):
+        name = path.basename(trace)
+        if names.get(name, trace) != trace:
+            raise Exception('Traces {} and {} would both write out_{}.'.format(names[name], trace, name))
+        names[name] = trace
+    return list(names.values())
+
+
+def out_name(trace, protocol):
+    # MSI keeps the usual out_<name>, MESI results go to out_mesi_<name> so both protocols can be run together.
+    name = path.basename(trace)
+    return name if protocol == 'msi' else 'mesi_{}'.format(name)
+
+
+def run_job(trace, protocol, progress_interval=0, per_processor=False, results=False):
+    # Runs in a worker process. The simulator's own output, including 'v' and 'p' lines in the trace, is dropped,
+    # any exception is returned rather than raised so one bad trace does not stop the batch.
+    start = time.perf_counter()
+    result = {'trace': trace, 'protocol': protocol, 'out': 'out_{}'.format(out_name(trace, protocol)),
+              'error': None}
+    try:
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            s = Simulator(optimisation=protocol == 'mesi', per_processor=per_processor,
+                          progress_interval=progress_interval,
+                          progress_label='{} {}'.format(path.basename(trace), protocol))
+            s.run_simulation(path.basename(trace), path.dirname(trace), out_name(trace, protocol))
+        stats = s.stats
+        total_latency = sum(stats.access_cycles)
+        result['accesses'] = stats.accesses
+        result['hit_rate'] = stats.hit_rate() if stats.accesses > 0 else 0
+        result['average_latency'] = total_latency / stats.accesses if stats.accesses > 0 else 0
+        result['total_latency'] = total_latency
+        result['off_chip'] = stats.access_counts[AccessType.OFF_CHIP.value]
+        if results:
+            result['row'] = run_row(s, trace, time.perf_counter() - start)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(traces, protocols, jobs=None, progress_interval=0, per_processor=False, results_file=None):
+    # Largest traces are submitted first so the long ones do not end up alone at the end. Results come back in
+    # the order they finish, and only this process writes to the results store.
+    work = sorted(((trace, protocol) for trace in traces for protocol in protocols),
+                  key=lambda job: -path.getsize(job[0]))
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=get_context('spawn')) as pool:
+        futures = {pool.submit(run_job, trace, protocol, progress_interval, per_processor,
+                               results_file is not None): (trace, protocol)
+                   for trace, protocol in work}
+        for future in as_completed(futures):
+            trace, protocol = futures[future]
+            try:
+                result = future.result()
+            except Exception:
+                # The worker itself died, e.g. it ran out of memory.
+                result = {'trace': trace, 'protocol': protocol, 'out': 'out_{}'.format(out_name(trace, protocol)),
+                          'error': traceback.format_exc(), 'seconds': 0}
+            results.append(result)
+            if results_file is not None and not result['error']:
+                ResultsStore(results_file).append(result['row'])
+            print('[{}/{}] {} {} {} in {:.1f}s'.format(len(results), len(work), path.basename(trace), protocol,
+                                                      'failed' if result['error'] else 'done', result['seconds']),
+                  file=sys.stderr, flush=True)
+    return sorted(results, key=lambda r: (path.basename(r['trace']), PROTOCOLS.index(r['protocol'])))
+
+
+def summary_table(results):
+    st = '{:<32} {:<5} {:>12} {:>9} {:>12} {:>14} {:>10} {:>9}  {}'.format(
+        'Trace', 'Proto', 'Accesses', 'Hit-rate', 'Avg-latency', 'Total-latency', 'Off-chip', 'Seconds', 'Output')
+    for r in results:
+        if r['error']:
+            st += '\n{:<32} {:<5} FAILED: {}'.format(path.basename(r['trace']), r['protocol'],
+                                                     r['error'].strip().splitlines()[-1])
+            continue
+        st += '\n{:<32} {:<5} {:>12} {:>9.4f} {:>12.3f} {:>14} {:>10} {:>9.1f}  {}'.format(
+            path.basename(r['trace']), r['protocol'], r['accesses'], r['hit_rate'], r['average_latency'],
+            r['total_latency'], r['off_chip'], r['seconds'], r['out'])
+    return st
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate many traces in parallel, writing out-files/out_<name> "
+                                                 "for MSI and out-files/out_mesi_<name> for MESI.")
+    parser.add_argument('traces', nargs='+', help="Trace files, globs or directories of traces.")
+    parser.add_argument('--protocol', choices=PROTOCOLS, action='append',
+                        help="Protocol to run, both by default. Can be repeated.")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Worker processes, defaults to the number of CPUs.")
+    parser.add_argument('--progress', type=float, default=0, metavar='SECONDS',
+                        help="Every worker reports its progress on stderr at most this often.")
+    parser.add_argument('--per-processor', action='store_true',
+                        help="Append per-processor stats to every output file.")
+    parser.add_argument('--summary', metavar='FILE', help="Also write the summary table to this file.")
+    parser.add_argument('--results', nargs='?', const=path.join('./out-files', 'results.csv'), metavar='FILE',
+                        help="Append every run to a results store, out-files/results.csv by default.")
+    args = parser.parse_args()
+
+    results = run_batch(find_traces(args.traces), args.protocol or PROTOCOLS, args.jobs, args.progress,
+                        args.per_processor, args.results)
+    table = summary_table(results)
+    print(table)
+    if args.summary is not None:
+        with open(args.summary, 'w') as f:
+            f.write(table + '\n')
+    failures = [r for r in results if r['error']]
+    for r in failures:
+        print('\n{} ({}) failed:\n{}'.format(r['trace'], r['protocol'], r['error']), file=sys.stderr)
+    if failures:
+        exit(1)
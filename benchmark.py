@@ -0,0 +1,183 @@
+from cache_simulation import Simulator
+from itertools import chain
+from multiprocessing import get_context
+from os import path
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+BASELINE = 'benchmark-baseline.json'
+# Lines of a synthetic trace generated at a time.
+CHUNK = 10000
+
+
+def host_key():
+    # Throughput is only comparable on the same kind of machine and Python, so baselines are recorded per host.
+    # The host name is left out, containers get a new one every run.
+    cpu = platform.processor() or platform.machine()
+    if path.exists('/proc/cpuinfo'):
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    cpu = line.split(':', 1)[1].strip()
+                    break
+    return '{}, {} CPUs, {} {}'.format(cpu, os.cpu_count(), platform.python_implementation(),
+                                       platform.python_version())
+
+
+def synthetic_trace(no_accesses, no_processors=4, no_cache_blocks=512, block_size=4, write_ratio=0.3, seed=0):
+    # Random accesses over a working set of twice the cache size, with runs of sequential words so that hits,
+    # conflict misses and sharing all show up. Yields the trace CHUNK lines at a time, so its size does not count
+    # towards the peak memory.
+    rng = random.Random(seed)
+    working_set = 2 * no_cache_blocks * block_size
+    lines = []
+    address = 0
+    for i in range(no_accesses):
+        if i % 8 == 0:
+            address = rng.randrange(working_set)
+        else:
+            address = (address + 1) % working_set
+        action = 'W' if rng.random() < write_ratio else 'R'
+        lines.append('P{} {} {}\n'.format(rng.randrange(no_processors), action, address))
+        if len(lines) == CHUNK:
+            yield lines
+            lines = []
+    if lines:
+        yield lines
+
+
+def benchmark_cases():
+    # Each case is (name, simulator arguments, trace). Traces are either a file in cache-traces or a
+    # ('synthetic', accesses) pair.
+    cases = []
+    for optimisation in [False, True]:
+        protocol = 'mesi' if optimisation else 'msi'
+        # The artificial traces are left out, they are mostly 'p' and 'v' output.
+        cases.append(('{}-trace-1'.format(protocol), {'optimisation': optimisation}, 'trace-1.txt'))
+        cases.append(('{}-synthetic-large'.format(protocol), {'optimisation': optimisation}, ('synthetic', 2000000)))
+        for no_processors in [2, 4, 8]:
+            cases.append(('{}-synthetic-p{}'.format(protocol, no_processors),
+                          {'optimisation': optimisation, 'no_processors': no_processors}, ('synthetic', 200000)))
+        for no_cache_blocks in [256, 2048]:
+            cases.append(('{}-synthetic-c{}'.format(protocol, no_cache_blocks),
+                          {'optimisation': optimisation, 'no_cache_blocks': no_cache_blocks}, ('synthetic', 200000)))
+    return cases
+
+
+def load_trace(trace, sim_args):
+    # The trace as chunks of lines, a trace file is a single chunk.
+    if isinstance(trace, tuple):
+        return synthetic_trace(trace[1], sim_args.get('no_processors', 4), sim_args.get('no_cache_blocks', 512))
+    with open(path.join('./cache-traces', trace), 'r') as f:
+        return [f.readlines()]
+
+
+def untimed(chunks, spent):
+    # Passes the chunks on, adding the time taken to read or generate each one to spent[0].
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        lines = next(chunks, None)
+        spent[0] += time.perf_counter() - start
+        if lines is None:
+            return
+        yield lines
+
+
+def run_case(sim_args, trace, repeat):
+    # Runs in a fresh process, so ru_maxrss is the peak memory of this case only. The chunks are fed to a single
+    # run, only simulating them is timed, reading or generating them is not, parsing is timed as part of the
+    # simulator.
+    best = None
+    accesses = 0
+    for i in range(repeat):
+        s = Simulator(**sim_args)
+        spent = [0]
+        chunks = untimed(load_trace(trace, sim_args), spent)
+        start = time.perf_counter()
+        s.run_trace(chain.from_iterable(chunks))
+        elapsed = time.perf_counter() - start - spent[0]
+        accesses = s.stats.accesses
+        if best is None or elapsed < best:
+            best = elapsed
+    peak_memory_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'accesses': accesses, 'seconds': best, 'accesses_per_second': accesses / best,
+            'peak_memory_kb': peak_memory_kb}
+
+
+def run_benchmarks(cases, repeat=3):
+    results = {}
+    ctx = get_context('spawn')
+    for name, sim_args, trace in cases:
+        # One case at a time so cases do not compete for the CPU.
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(run_case, (sim_args, trace, repeat))
+        print('{:<28} {:>12.0f} acc/s {:>10} KB'.format(name, results[name]['accesses_per_second'],
+                                                       results[name]['peak_memory_kb']), flush=True)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Returns a message for every case whose throughput fell more than `tolerance` below the baseline.
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]['accesses_per_second']
+        if result['accesses_per_second'] < expected * (1 - tolerance):
+            regressions.append('{}: {:.0f} acc/s is {:.1f}% below the baseline of {:.0f} acc/s'.format(
+                name, result['accesses_per_second'], 100 * (1 - result['accesses_per_second'] / expected), expected))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure simulator throughput and peak memory and compare it "
+                                                 "against the baseline recorded on this kind of host.")
+    parser.add_argument('--baseline', default=BASELINE, help="Baseline file, defaults to {}.".format(BASELINE))
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="Allowed throughput drop as a fraction of the baseline before the run fails.")
+    parser.add_argument('--update', action='store_true', help="Record these results as this host's new baseline.")
+    parser.add_argument('--case', action='append', help="Only run cases whose name contains this. Can be repeated.")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per case, the fastest one counts.")
+    parser.add_argument('--output', help="Also write the results of this run to a JSON file.")
+    args = parser.parse_args()
+
+    cases = benchmark_cases()
+    if args.case:
+        cases = [c for c in cases if any(pattern in c[0] for pattern in args.case)]
+
+    results = run_benchmarks(cases, args.repeat)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    # Host -> case -> results.
+    baselines = {}
+    if path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baselines = json.load(f)
+    host = host_key()
+    if args.update:
+        baselines.setdefault(host, {}).update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print("Baseline of {} in {} updated.".format(host, args.baseline))
+        exit(0)
+
+    if host not in baselines:
+        print("No baseline for {} in {}, run with --update to record one.".format(host, args.baseline))
+        exit(1)
+
+    regressions = compare(results, baselines[host], args.tolerance)
+    for r in regressions:
+        print("REGRESSION: {}".format(r), file=sys.stderr)
+    if regressions:
+        exit(1)
+    print("No throughput regressions beyond {:.0f}%.".format(100 * args.tolerance))
@@ -1,4 +1,6 @@
 from enum import Enum
+from flight_recorder import EventType
+from replacement import make_policy
 
 class CacheState(Enum):
     # Enumeration of MSI states to be used by each cache-line.
@@ -37,17 +39,53 @@ class CacheLine:
         self.tag = tag
 
 
+def decode_address(address, block_size=4, no_blocks=512):
+    # Splits a word address into its offset, index and tag for a direct-mapped cache. Block size and number of
+    # blocks must be powers of two, with the defaults this is offset = bits 0-1, index = bits 2-10, tag = the rest.
+    offset_bits = (block_size - 1).bit_length()
+    index_bits = (no_blocks - 1).bit_length()
+    offset = address & (block_size - 1)
+    index = (address >> offset_bits) & (no_blocks - 1)
+    tag = address >> (offset_bits + index_bits)
+    return offset, index, tag
+
+
+def select_line(cache_lines, policy, set_index, tag, ways):
+    # Position in cache_lines (set * ways + way) of the line holding tag in the set. On a miss the line to fill
+    # is returned instead: an invalid way if there is one, otherwise the replacement policy's victim.
+    base = set_index * ways
+    for way in range(ways):
+        if cache_lines[base + way].tag == tag:
+            policy.touch(set_index, way)
+            return base + way
+    for way in range(ways):
+        if cache_lines[base + way].state == CacheState.INVALID:
+            break
+    else:
+        way = policy.victim(set_index)
+    policy.fill(set_index, way)
+    return base + way
+
+
 class Cache:
     # Representation of Cache.
-    # Cache is direct-mapped with a write-back policy.
-    def __init__(self, p_num, block_size, no_blocks, directory, stats, verbose=False):
+    # Cache is direct-mapped with a write-back policy. With ways > 1 it is set-associative, line `index` is then
+    # way index % ways of set index // ways, and the replacement policy picks the way to replace.
+    def __init__(self, p_num, block_size, no_blocks, directory, stats, verbose=False, ways=1, replacement='lru'):
         self.p_num = p_num
         self.block_size = block_size
         self.no_blocks = no_blocks
+        self.ways = ways
+        self.no_sets = no_blocks // ways
+        self.policy = make_policy(replacement, self.no_sets, ways, seed=p_num) if ways > 1 else None
         self.cache_lines = [CacheLine() for i in range(no_blocks)]
         self.directory = directory
         self.stats = stats
         self.verbose = verbose
+        # Optional prefetch stage (prefetcher.Prefetcher) and victim cache (victim_cache.VictimCache), attached by
+        # the simulator.
+        self.prefetcher = None
+        self.victim_cache = None
 
     def __str__(self):
         st = ""
@@ -62,11 +100,9 @@ class Cache:
 
     def calculate_cache_line(self, address):
         # This is a cache probe, I.e finding the state and the tag.
-        bin_address = '{0:032b}'.format(address)
-        # TODO: This should be changed so it works for any size
-        offset = int(bin_address[-2:], 2)
-        index = int(bin_address[-11:-2], 2)
-        tag = int(bin_address[:-11], 2)
+        offset, index, tag = decode_address(address, self.block_size, self.no_sets)
+        if self.ways > 1:
+            index = select_line(self.cache_lines, self.policy, index, tag, self.ways)
         self.stats.cache_probe()
         if self.verbose:
             print("P{}. Index: {}. Tag: {}. Local State: {}.".format(self.p_num, index, tag, self.cache_lines[index].state))
@@ -74,6 +110,7 @@ class Cache:
 
     def invalidate_line(self, index):
         # print("Invalidating line {} in processor {}".format(index, self.p_num))
+        self.stats.record(EventType.INVALIDATION, self.p_num, index, self.cache_lines[index].tag, CacheState.INVALID)
         if self.cache_lines[index].state == CacheState.MODIFIED:
             if self.verbose:
                 print("COHERENCE WRITE-BACK: Cache line was in M state, and has been invalidated.")
@@ -86,6 +123,10 @@ class Cache:
         if self.verbose:
             print("P{} write to word {}.".format(self.p_num, address))
         index, tag = self.calculate_cache_line(address)
+        if self.victim_cache is not None and self.cache_lines[index].tag != tag:
+            self.victim_cache.swap(index, tag)
+        if self.prefetcher is not None:
+            self.prefetcher.demand(index, tag)
         cache_line = self.cache_lines[index]
         # If in modified state, you can write freely
         if cache_line.state == CacheState.MODIFIED and cache_line.tag == tag:
@@ -96,21 +137,34 @@ class Cache:
             return
 
         # Replace if tag miss and modified
-        if cache_line.tag != tag and cache_line.state == CacheState.MODIFIED:
+        if cache_line.tag != tag and cache_line.state != CacheState.INVALID and self.victim_cache is not None:
+            # The line moves to the victim cache, it is only written back once it leaves that too.
+            self.victim_cache.insert(index, cache_line.tag, cache_line.state)
+        elif cache_line.tag != tag and cache_line.state == CacheState.MODIFIED:
             # Must write back to memory
             if self.verbose:
                 print("REPLACEMENT WRITE-BACK: Tag miss and cache state was M, and is therefore being replaced.")
             self.stats.replacement_writebacks += 1
+            self.stats.record(EventType.REPLACEMENT_WRITEBACK, self.p_num, index, cache_line.tag)
+            self.directory.replaced(index, cache_line.tag, self.p_num, cache_line.state)
+        elif cache_line.tag != tag and cache_line.state != CacheState.INVALID:
+            # A clean line is replaced without a write-back
+            self.stats.record(EventType.EVICTION, self.p_num, index, cache_line.tag)
+            self.directory.replaced(index, cache_line.tag, self.p_num, cache_line.state)
 
         # If State is INVALID or if state is SHARED or is a tag miss
         if self.verbose:
             print("Write miss! Must contact the directory.")
+        self.stats.record(EventType.WRITE_MISS, self.p_num, index, tag)
         self.write_miss(index, tag, address)
 
     def read(self, address):
         if self.verbose:
             print("P{} reading to word {}.".format(self.p_num, address))
         index, tag = self.calculate_cache_line(address)
+        if self.victim_cache is not None and self.cache_lines[index].tag != tag:
+            self.victim_cache.swap(index, tag)
+        prefetch_hit = self.prefetcher is not None and self.prefetcher.demand(index, tag)
         cache_line = self.cache_lines[index]
 
         # If in shared or modified state, you can read freely TODO: (?)
@@ -119,15 +173,25 @@ class Cache:
                 print("Cache state is {}, cache is free to read.".format(cache_line.state))
             # You can just read, state stays the same
             self.stats.cache_access()
+            if prefetch_hit:
+                # First use of a prefetched line, the stream it belongs to goes on.
+                self.prefetcher.trigger(address)
             return
 
         if cache_line.tag != tag:
             # Tag miss on any state
-            if cache_line.state == CacheState.MODIFIED:
+            if cache_line.state != CacheState.INVALID and self.victim_cache is not None:
+                self.victim_cache.insert(index, cache_line.tag, cache_line.state)
+            elif cache_line.state == CacheState.MODIFIED:
                 # Must write back to memory
                 if self.verbose:
                     print("REPLACEMENT WRITE-BACK: Tag miss and cache state was M, and is therefore being replaced.")
                 self.stats.replacement_writebacks += 1
+                self.stats.record(EventType.REPLACEMENT_WRITEBACK, self.p_num, index, cache_line.tag)
+                self.directory.replaced(index, cache_line.tag, self.p_num, cache_line.state)
+            elif cache_line.state != CacheState.INVALID:
+                self.stats.record(EventType.EVICTION, self.p_num, index, cache_line.tag)
+                self.directory.replaced(index, cache_line.tag, self.p_num, cache_line.state)
 
             # If state is shared, we don't need to write-back we can just write over
 
@@ -137,6 +201,7 @@ class Cache:
         # If State is INVALID or (State is SHARED AND tag miss)
         if self.verbose:
             print("Read miss! Must contact the directory.")
+        self.stats.record(EventType.READ_MISS, self.p_num, index, tag)
         self.read_miss(index, tag, address)
 
     def write_miss(self, index, tag, address):
@@ -152,6 +217,7 @@ class Cache:
         cache_line.tag = tag
 
         self.cache_lines[index] = cache_line
+        self.stats.record(EventType.STATE_TRANSITION, self.p_num, index, tag, CacheState.MODIFIED)
 
         # Write to cache.
         self.write(address)
@@ -169,6 +235,10 @@ class Cache:
         cache_line.tag = tag
 
         self.cache_lines[index] = cache_line
+        self.stats.record(EventType.STATE_TRANSITION, self.p_num, index, tag, CacheState.SHARED)
 
         # Read from cache.
         self.read(address)
+
+        if self.prefetcher is not None:
+            self.prefetcher.trigger(address)
@@ -1,9 +1,31 @@
 from cache import Cache
+from crosscheck import CrossCheck
 from stats import Stats
 from directory import Directory
 from mesi_directory import MESIDirectory
 from mesi_cache import MESICache
+from home_node import HomeMap, HOME_POLICIES
+from llc import SharedCache
+from prefetcher import Prefetcher, PREDICTORS, make_predictor
+from victim_cache import VictimCache
+from hotspots import HotspotProfiler
+from profiler import HotPathProfiler
+from progress import ProgressReporter
+from replacement import POLICIES
+from results import ResultsStore, run_row
+from snapshot import SnapshotWriter
+from sparse_directory import SparseDirectory
+from timeseries import WindowReporter
+from timing import TimingEngine, TraceSplitter
+from traffic import Traffic
+from trace_index import build_index, load_index
+from trace_filter import TraceFilter, parse_range, parse_event_type
 from os import path
+import os
+import argparse
+import cProfile
+import pstats
+import time
 import sys
 
 
@@ -20,6 +42,20 @@ def parse_line(l):
     return l[0], l[1], int(l[2])
 
 
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError('{} is not a positive number.'.format(text))
+    return value
+
+
+def power_of_two(text):
+    value = positive_int(text)
+    if value & (value - 1):
+        raise argparse.ArgumentTypeError('{} is not a power of two.'.format(text))
+    return value
+
+
 def print_caches(cs):
     # print('Idx, Tag, State')
     for k, c in cs.items():
@@ -29,85 +65,447 @@ def print_caches(cs):
 
 
 class Simulator:
-    def __init__(self, no_processors=4, block_size=4, no_cache_blocks=512, optimisation=False):
+    def __init__(self, no_processors=4, block_size=4, no_cache_blocks=512, optimisation=False, recorder_size=256,
+                 dump_addresses=(), trace_filter=None, hotspots=False, per_processor=False,
+                 window_interval=0, window_file=None, window_binary=False, progress_interval=0, progress_label=None,
+                 profile=False, cprofile=False, ways=1, replacement='lru', prefetcher=None, prefetch_degree=1,
+                 llc_blocks=0, llc_ways=8, llc_banks=4, llc_inclusive=True, llc_replacement='lru',
+                 victim_entries=0, victim_latency=1, migratory=False, home=None, page_blocks=64,
+                 directory_entries=0, directory_ways=8, directory_replacement='lru',
+                 timing=False, directory_occupancy=2, link_occupancy=2, snapshot_file=None, snapshot_diff=False,
+                 results_file=None, cross_check=0, cross_check_seed=0, traffic=False, link_width=16,
+                 eviction_notifications=False):
+        # What the results store records about the simulated machine.
+        self.config = {'protocol': 'mesi' if optimisation else 'msi', 'processors': no_processors,
+                       'block_size': block_size, 'cache_blocks': no_cache_blocks, 'ways': ways,
+                       'replacement': replacement, 'prefetcher': prefetcher, 'prefetch_degree': prefetch_degree,
+                       'llc_blocks': llc_blocks, 'llc_ways': llc_ways, 'llc_banks': llc_banks,
+                       'llc_inclusive': llc_inclusive, 'llc_replacement': llc_replacement,
+                       'victim_entries': victim_entries, 'victim_latency': victim_latency, 'migratory': migratory,
+                       'home': home, 'page_blocks': page_blocks, 'directory_entries': directory_entries,
+                       'directory_ways': directory_ways, 'directory_replacement': directory_replacement,
+                       'timing': timing, 'directory_occupancy': directory_occupancy,
+                       'link_occupancy': link_occupancy, 'traffic': traffic, 'link_width': link_width,
+                       'eviction_notifications': eviction_notifications}
+        # Results store every run_simulation appends a row to.
+        self.results_file = results_file
         self.optimisation = optimisation
         self.no_processors = no_processors
         self.block_size = block_size
         self.no_cache_blocks = no_cache_blocks
-        self.stats = Stats()
+        # Addresses are decoded by masking, so the number of sets must be a power of two.
+        no_sets = no_cache_blocks // ways if ways > 0 else 0
+        if no_sets < 1 or no_cache_blocks % ways or no_sets & (no_sets - 1):
+            raise Exception('{} ways do not divide {} cache blocks into a power of two sets.'.format(
+                ways, no_cache_blocks))
+        self.ways = ways
+        self.replacement = replacement
+        # Number of cache indexes, with set-associative caches an index selects a set of `ways` lines.
+        self.no_sets = no_sets
+        # Name of the prefetcher attached to every cache, see prefetcher.PREDICTORS.
+        self.prefetcher = prefetcher
+        self.prefetch_degree = prefetch_degree
+        # Timing runs are meant for long traces, so they keep totals per access type instead of every latency.
+        self.stats = Stats(recorder_size=recorder_size, keep_latencies=not timing)
+        self.stats.prefetching = prefetcher is not None
+        # Entries of the victim cache next to every cache, 0 for none, and cycles a victim hit takes.
+        self.victim_entries = victim_entries
+        self.victim_latency = victim_latency
+        self.stats.victim_caching = victim_entries > 0
+        if migratory and not optimisation:
+            raise Exception('Migratory sharing detection needs the MESI optimisation.')
+        self.stats.migratory = migratory
+        # Accessing any of these addresses dumps the flight recorder.
+        self.dump_addresses = set(dump_addresses)
+        # Verbose mode as toggled by the 'v' command, a trace filter can switch it on for single accesses.
+        self.verbose = False
+        self.trace_filter = trace_filter
+        self.per_processor = per_processor
+        self.window = None
+        if window_interval > 0:
+            self.window = WindowReporter(self.stats, window_interval, window_file, window_binary)
+        # Seconds between progress lines on stderr, 0 disables progress reporting.
+        self.progress_interval = progress_interval
+        self.progress_label = progress_label
+        self.progress = None
+        self.parse_line = parse_line
+        self.cprofile = cprofile
+        self.profiler = None
+        self.hotspots = None
+        if hotspots:
+            self.hotspots = HotspotProfiler(self.no_cache_blocks, self.ways)
+            self.stats.listeners.append(self.hotspots)
+        # Shared LLC of llc_blocks blocks in front of memory, 0 for none.
+        self.llc = None
+        if llc_blocks > 0:
+            self.llc = SharedCache(self.stats, llc_blocks, llc_ways, llc_banks, llc_inclusive, llc_replacement)
+        # Home node policy of a directory sliced across the processors (see home_node.HOME_POLICIES), None for
+        # the centralised directory.
+        home_map = None
+        if home is not None:
+            home_map = HomeMap(home, self.no_processors, page_blocks)
+            self.stats.home_requests = [0] * self.no_processors
+        # Sparse directory of directory_entries entries, 0 to track every block.
+        sparse = None
+        if directory_entries > 0:
+            sparse = SparseDirectory(self.stats, directory_entries, directory_ways, directory_replacement)
+            self.stats.sparse_directory = True
+        self.stats.eviction_notifications = eviction_notifications
+        # Message and link traffic accounting.
+        traffic_counter = None
+        if traffic:
+            traffic_counter = Traffic(self.stats, self.no_processors, self.block_size, home is None, link_width)
         if self.optimisation:
-            self.directory = MESIDirectory(self.no_cache_blocks, self.no_processors, self.stats)
+            self.directory = MESIDirectory(self.no_cache_blocks, self.no_processors, self.stats, ways=self.ways,
+                                           llc=self.llc, home_map=home_map, sparse=sparse, migratory=migratory,
+                                           traffic=traffic_counter, notify_evictions=eviction_notifications)
         else:
-            self.directory = Directory(self.no_cache_blocks, self.no_processors, self.stats)
+            self.directory = Directory(self.no_cache_blocks, self.no_processors, self.stats, ways=self.ways,
+                                       llc=self.llc, home_map=home_map, sparse=sparse, traffic=traffic_counter,
+                                       notify_evictions=eviction_notifications)
         self.caches = {}
         self.setup_caches()
+        # Discrete-event timing engine, runs every processor from its own stream of the trace.
+        self.engine = None
+        if timing:
+            self.engine = TimingEngine(self, directory_occupancy, link_occupancy)
+        # With a snapshot file the 'p' command writes binary snapshots of the cache tables there instead of text.
+        self.snapshots = None
+        if snapshot_file is not None:
+            self.snapshots = SnapshotWriter(self.caches, snapshot_file, snapshot_diff)
+        # Reference model replaying the accesses to a cross_check share of the cache indexes, 0 for none.
+        self.cross_check = None
+        if cross_check > 0:
+            self.cross_check = CrossCheck(self, cross_check, cross_check_seed)
+        if profile:
+            self.profiler = HotPathProfiler()
+            self.profiler.instrument(self)
 
     def setup_caches(self):
         for p in range(self.no_processors):
             if self.optimisation:
-                cache = MESICache(p, self.block_size, self.no_cache_blocks, self.directory, self.stats)
+                cache = MESICache(p, self.block_size, self.no_cache_blocks, self.directory, self.stats,
+                                  ways=self.ways, replacement=self.replacement)
             else:
-                cache = Cache(p, self.block_size, self.no_cache_blocks, self.directory, self.stats)
+                cache = Cache(p, self.block_size, self.no_cache_blocks, self.directory, self.stats,
+                              ways=self.ways, replacement=self.replacement)
+            if self.prefetcher is not None:
+                cache.prefetcher = Prefetcher(cache, make_predictor(self.prefetcher, self.prefetch_degree))
+            if self.victim_entries > 0:
+                cache.victim_cache = VictimCache(cache, self.victim_entries, self.victim_latency)
+                self.directory.victim_caches.append(cache.victim_cache)
             self.caches['P{}'.format(p)] = cache
             self.directory.connect_cache(cache)
 
-    def run_simulation(self, file):
-        pth = path.join('./cache-traces', file)
+    def set_verbose(self, verbose):
+        self.stats.verbose = verbose
+        self.directory.verbose = verbose
+        for k, c in self.caches.items():
+            c.verbose = verbose
+
+    def apply_trace_filter(self, p, mem):
+        match = self.trace_filter.matches(self.caches[p].p_num, mem)
+        if self.trace_filter.events is None:
+            verbose = self.verbose or match
+            if verbose != self.stats.verbose:
+                self.set_verbose(verbose)
+        else:
+            self.stats.trace_events = self.trace_filter.events if match else None
+
+    def run_simulation(self, file, trace_dir='./cache-traces', out_name=None):
+        # The stats go to out-files/out_<file>, or out_<out_name> if given.
+        pth = path.join(trace_dir, file)
+        profile = cProfile.Profile() if self.cprofile else None
+        start = time.perf_counter()
         with open(pth, 'r') as f:
-            for line in f:
-                p, action, mem = parse_line(line)
-                if action == 'R':
-                    self.caches[p].read(mem)
-                elif action == 'W':
-                    self.caches[p].write(mem)
-                elif action == 'v':
-                    # Full line by line explanation should be toggled
-                    self.stats.verbose = not self.stats.verbose
-                    self.directory.verbose = not self.directory.verbose
-                    for k, c in self.caches.items():
-                        c.verbose = not c.verbose
-                elif action == 'p':
-                    # Complete content of cache should be output in some suitable format
-                    print("\nCACHE TABLES:\n")
-                    print_caches(self.caches)
-                elif action == 'h':
-                    print("HIT RATE: {}".format(self.stats.hit_rate()))
-                else:
-                    raise Exception('Invalid line in trace file.')
-                if action in ['R', 'W']:
-                    self.stats.save_stats()
-                    self.stats.reset()
-
-        print(self.stats.final_stats(file, to_file=True))
+            if self.progress_interval > 0:
+                # The buffered reader's position runs slightly ahead of the lines handed out, which is close
+                # enough for a percentage.
+                self.progress = ProgressReporter(self.stats, self.progress_interval, os.fstat(f.fileno()).st_size,
+                                                 f.buffer.tell, self.progress_label)
+            if profile is not None:
+                profile.enable()
+            self.run_trace(f)
+            if profile is not None:
+                profile.disable()
+        runtime = time.perf_counter() - start
+        if self.profiler is not None:
+            self.profiler.wall_time = runtime
+
+        print(self.stats.final_stats(file if out_name is None else out_name, to_file=True,
+                                     per_processor=self.per_processor))
+        if self.results_file is not None:
+            run = ResultsStore(self.results_file).append(run_row(self, pth, runtime))
+            print("\nRun {} added to {}.".format(run, self.results_file))
+
+        if profile is not None:
+            # Written next to the stats file, e.g. out-files/out_trace-1.prof
+            outpath = path.join('./out-files', 'out_{}.prof'.format(path.splitext(file)[0]))
+            profile.dump_stats(outpath)
+            print("\nProfile written to {}, slowest functions:".format(outpath))
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(15)
+        if self.profiler is not None:
+            print(self.profiler.report())
+
+    def cross_index_option(self):
+        # The first option that lets the accesses to one cache index change what happens at another, None if
+        # there is none: prefetches and LLC, victim cache or sparse directory evictions reach other indexes, random
+        # replacement draws from one generator for all sets and first-touch homes depend on which block came first.
+        config = self.config
+        for name, off in [('prefetcher', None), ('llc_blocks', 0), ('victim_entries', 0), ('directory_entries', 0)]:
+            if config[name] != off:
+                return name
+        if config['replacement'] == 'random':
+            return 'random replacement'
+        if config['home'] == 'first-touch':
+            return 'first-touch homes'
+        return None
+
+    def run_subset(self, file, indexes=(), addresses=(), line_range=None):
+        # Replays part of a trace using its index (built on first use). Without options that cross indexes
+        # (cross_index_option), cache indexes never interact, so replaying every access to the selected indexes, or
+        # to the indexes the selected addresses map to, gives exactly the cycles and states of the full run for
+        # those indexes; with them it is refused. A line range (1-based, inclusive) starts from cold caches instead.
+        if line_range is None:
+            option = self.cross_index_option()
+            if option is not None:
+                raise Exception('Replaying selected indexes needs independent cache indexes, which {} breaks.'.format(
+                    option))
+        index = load_index(path.join('./cache-traces', file), self.block_size, self.no_sets)
+        if line_range is not None:
+            lines = index.read_line_range(line_range[0] - 1, line_range[1])
+        else:
+            selected = set(indexes) | index.indexes_for_addresses(addresses)
+            lines = index.read_lines(index.offsets_for('index', selected))
+        self.run_trace(lines)
+
+        print(self.stats.final_stats(file, per_processor=self.per_processor))
+
+    def run_trace(self, lines):
+        # The timing engine takes one stream of lines per processor instead, cut from lines.
+        try:
+            if self.engine is not None:
+                self.engine.run(TraceSplitter(lines, self.no_processors).streams())
+            else:
+                for line in lines:
+                    self.run_line(line)
+            if self.window is not None:
+                self.window.finish()
+            if self.snapshots is not None:
+                self.snapshots.close()
+            if self.progress is not None:
+                self.progress.finish()
+        except AssertionError:
+            # Post-mortem: show the events leading up to the failed check.
+            print(self.stats.recorder.dump('assertion failed'), file=sys.stderr)
+            raise
+
+    def run_line(self, line):
+        p, action, mem = self.parse_line(line)
+        if self.trace_filter is not None and mem != -1:
+            self.apply_trace_filter(p, mem)
+        if action == 'R':
+            self.caches[p].read(mem)
+        elif action == 'W':
+            self.caches[p].write(mem)
+        elif action == 'v':
+            # Full line by line explanation should be toggled
+            self.verbose = not self.verbose
+            self.set_verbose(self.verbose)
+        elif action == 'p':
+            # Complete content of cache should be output in some suitable format
+            if self.snapshots is not None:
+                self.snapshots.write(self.stats.accesses)
+            else:
+                print("\nCACHE TABLES:\n")
+                print_caches(self.caches)
+                print(self.stats.recorder.dump())
+        elif action == 'h':
+            print("HIT RATE: {}".format(self.stats.hit_rate()))
+        else:
+            raise Exception('Invalid line in trace file.')
+        if action in ['R', 'W']:
+            if self.cross_check is not None and mem // self.block_size % self.no_sets in self.cross_check.sampled:
+                self.cross_check.check(p, action, mem)
+            if self.engine is not None:
+                self.engine.complete(self.caches[p].p_num, mem)
+            self.stats.save_stats(self.caches[p].p_num)
+            self.stats.reset()
+            if self.progress is not None and self.stats.accesses == self.progress.next_check:
+                self.progress.check()
+            if self.window is not None and self.stats.accesses == self.window.next_row:
+                self.window.write_row()
+            if mem in self.dump_addresses:
+                print(self.stats.recorder.dump('access to address {}'.format(mem)))
 
 
 if __name__ == "__main__":
-    args = sys.argv[1:]
-
-    optimisation = False
-
-    if len(args) < 1:
-        print("You must input a file name for the trace as the first argument.")
-        exit(1)
-    elif len(args) == 1 and args[0].strip('-') == 'h':
-        print("./run_script.sh <FILENAME> <Optimisation Toggle>(optional)")
-        print("Use the filename placed in the 'cache-traces' directory that you would like to run, then use ONLY the "
-              "filename as the first argument. Optionally, you can enable the optimisation by passing 'o' as the second"
-              " argument.")
-    elif len(args) == 2:
-        if args[1] is not None and args[1].strip("\'-") == 'o':
+    parser = argparse.ArgumentParser(
+        description="Use the filename placed in the 'cache-traces' directory that you would like to run, then use "
+                    "ONLY the filename as the first argument. Optionally, you can enable the optimisation by passing "
+                    "'o' as the second argument.")
+    parser.add_argument('file', help="Trace file name inside the 'cache-traces' directory.")
+    parser.add_argument('mode', nargs='?', default=None, help="Pass 'o' to enable the MESI optimisation.")
+    parser.add_argument('-o', dest='optimisation', action='store_true', help="Enable the MESI optimisation.")
+    parser.add_argument('--recorder-size', type=positive_int, default=256,
+                        help="Number of recent coherence events kept by the flight recorder.")
+    parser.add_argument('--dump-address', type=int, action='append', default=[],
+                        help="Dump the flight recorder whenever this address is accessed. Can be repeated.")
+    parser.add_argument('--trace-processor', type=int, action='append',
+                        help="Only trace accesses from this processor. Can be repeated.")
+    parser.add_argument('--trace-address', type=parse_range, action='append',
+                        help="Only trace accesses to this address or LOW-HIGH address range. Can be repeated.")
+    parser.add_argument('--trace-index', type=parse_range, action='append',
+                        help="Only trace accesses to this cache index or LOW-HIGH index range. Can be repeated.")
+    parser.add_argument('--trace-event', type=parse_event_type, action='append',
+                        help="Only print these coherence events for traced accesses, e.g. invalidation or "
+                             "replacement_writeback. Can be repeated.")
+    parser.add_argument('--hotspots', type=int, default=0, metavar='K',
+                        help="Report the K cache indexes and blocks with the most conflict misses, writebacks, "
+                             "invalidations and ping-pong.")
+    parser.add_argument('--hotspots-export', metavar='FILE',
+                        help="Save the hotspot counters as NumPy arrays to FILE (.npz). Requires NumPy.")
+    parser.add_argument('--per-processor', action='store_true',
+                        help="Add per-processor access counts, average latencies and p50/p99/max latency to the stats.")
+    parser.add_argument('--window', type=int, default=0, metavar='N',
+                        help="Write hit rate, average latency, writebacks and invalidations for every N accesses "
+                             "while the trace runs.")
+    parser.add_argument('--window-file', metavar='FILE',
+                        help="Where to write the windowed stats, defaults to out-files/windows_<trace>.csv "
+                             "(or .bin with --window-binary).")
+    parser.add_argument('--window-binary', action='store_true', help="Write the windowed stats as packed binary rows.")
+    parser.add_argument('--progress', type=float, default=0, metavar='SECONDS',
+                        help="Report throughput, share of the trace consumed, ETA and hit rate to stderr every "
+                             "SECONDS seconds.")
+    parser.add_argument('--profile', action='store_true',
+                        help="Report call counts and cumulative time of parsing, address decode, directory misses, "
+                             "sharer search and stats bookkeeping.")
+    parser.add_argument('--cprofile', action='store_true',
+                        help="Run the trace under cProfile and write out-files/out_<trace>.prof.")
+    parser.add_argument('--build-index', action='store_true',
+                        help="Build the seekable index of the trace (cache-traces/<trace>.idx) and exit.")
+    parser.add_argument('--replay-index', type=parse_range, action='append', default=[],
+                        help="Only replay the accesses to this cache index or LOW-HIGH index range, using the trace "
+                             "index. Can be repeated.")
+    parser.add_argument('--replay-address', type=int, action='append', default=[],
+                        help="Only replay the accesses to the cache index of this address. Can be repeated.")
+    parser.add_argument('--replay-lines', type=parse_range,
+                        help="Only replay trace lines LOW-HIGH (1-based, inclusive), starting from cold caches.")
+    parser.add_argument('--ways', type=power_of_two, default=1,
+                        help="Associativity of the private caches, 1 (the default) is direct-mapped.")
+    parser.add_argument('--replacement', choices=POLICIES, default='lru',
+                        help="Replacement policy of set-associative caches.")
+    parser.add_argument('--prefetcher', choices=PREDICTORS,
+                        help="Prefetch into every cache after read misses and report prefetches issued, useful and "
+                             "harmful, and their latency separately.")
+    parser.add_argument('--prefetch-degree', type=int, default=1, metavar='N',
+                        help="Blocks fetched ahead by the prefetcher.")
+    parser.add_argument('--llc-blocks', type=int, default=0, metavar='N',
+                        help="Add a shared last-level cache of N blocks in front of memory.")
+    parser.add_argument('--llc-ways', type=int, default=8, help="Associativity of the LLC.")
+    parser.add_argument('--llc-banks', type=int, default=4, help="Number of LLC banks, blocks are interleaved.")
+    parser.add_argument('--llc-non-inclusive', action='store_true',
+                        help="Let private caches keep blocks the LLC evicts instead of back-invalidating them.")
+    parser.add_argument('--llc-replacement', choices=POLICIES, default='lru', help="Replacement policy of the LLC.")
+    parser.add_argument('--victim-entries', type=int, default=0, metavar='N',
+                        help="Add an N entry fully-associative victim cache next to every cache.")
+    parser.add_argument('--victim-latency', type=int, default=1, metavar='CYCLES',
+                        help="Extra cycles of an access that finds its block in the victim cache.")
+    parser.add_argument('--migratory', action='store_true',
+                        help="With the MESI optimisation, detect migratory blocks and answer read misses to them in M.")
+    parser.add_argument('--home', choices=HOME_POLICIES,
+                        help="Slice the directory across the processors, placing each block at a home node by this "
+                             "policy.")
+    parser.add_argument('--page-blocks', type=positive_int, default=64, metavar='N',
+                        help="Blocks per page for the 'page' and 'first-touch' home policies.")
+    parser.add_argument('--directory-entries', type=int, default=0, metavar='N',
+                        help="Give the directory N entries, evicting one invalidates its block everywhere. "
+                             "0 tracks every block.")
+    parser.add_argument('--directory-ways', type=int, default=8, help="Associativity of the sparse directory.")
+    parser.add_argument('--directory-replacement', choices=POLICIES, default='lru',
+                        help="Replacement policy of the sparse directory.")
+    parser.add_argument('--snapshots', action='store_true',
+                        help="Write the cache tables of every 'p' command as binary snapshots instead of text, "
+                             "render them with snapshot.py.")
+    parser.add_argument('--snapshot-file', metavar='FILE',
+                        help="Where to write the snapshots, defaults to out-files/snapshots_<trace>.bin.")
+    parser.add_argument('--snapshot-diff', action='store_true',
+                        help="After the first snapshot, only write the lines changed since the previous one.")
+    parser.add_argument('--results', nargs='?', const=path.join('./out-files', 'results.csv'), metavar='FILE',
+                        help="Append the configuration and metrics of the run to a results store, "
+                             "out-files/results.csv by default. Query it with results.py.")
+    parser.add_argument('--timing', action='store_true',
+                        help="Run every processor from its own stream of the trace on the discrete-event timing "
+                             "engine and report execution and stall times. Command lines (v, p, h) run in P0's "
+                             "stream, when P0 reaches them.")
+    parser.add_argument('--directory-occupancy', type=int, default=2, metavar='CYCLES',
+                        help="Cycles the directory (or a home slice) is busy with each request, with --timing.")
+    parser.add_argument('--link-occupancy', type=int, default=2, metavar='CYCLES',
+                        help="Cycles a processor's network link is busy with each request, with --timing.")
+    parser.add_argument('--eviction-notifications', action='store_true',
+                        help="Caches tell the directory about every line they replace, clean ones with a hint, so "
+                             "no sharer is left stale.")
+    parser.add_argument('--traffic', action='store_true',
+                        help="Count the protocol's messages by type, processor and link, with their bytes and the "
+                             "utilisation of every link.")
+    parser.add_argument('--link-width', type=positive_int, default=16, metavar='BYTES',
+                        help="Bytes a link carries a cycle, with --traffic.")
+    parser.add_argument('--cross-check', type=float, nargs='?', const=0.01, default=0, metavar='FRACTION',
+                        help="Replay the accesses to a random FRACTION (0.01 by default) of the cache indexes on a "
+                             "reference model and stop at the first access whose cycles or states differ.")
+    parser.add_argument('--cross-check-seed', type=int, default=0, help="Seed picking the cross-checked indexes.")
+    args = parser.parse_args()
+
+    optimisation = args.optimisation
+
+    if args.mode is not None:
+        if args.mode.strip("\'-") == 'o':
             optimisation = True
         else:
             print("If you would like to enable the optimisation, pass 'o' as the second argument.")
             exit(1)
-    elif len(args) > 2:
-        print("Too many arguments.")
-        exit(1)
 
-    file = args[0]
+    trace_filter = None
+    if args.trace_processor or args.trace_address or args.trace_index or args.trace_event:
+        trace_filter = TraceFilter(args.trace_processor, args.trace_address, args.trace_index, args.trace_event,
+                                   no_blocks=512 // args.ways)
+
+    window_file = args.window_file
+    if args.window > 0 and window_file is None:
+        window_file = path.join('./out-files', 'windows_{}.{}'.format(path.splitext(args.file)[0],
+                                                                     'bin' if args.window_binary else 'csv'))
+
+    snapshot_file = args.snapshot_file
+    if args.snapshots and snapshot_file is None:
+        snapshot_file = path.join('./out-files', 'snapshots_{}.bin'.format(path.splitext(args.file)[0]))
 
-    cache_type = Cache
-    dir_type = Directory
+    s = Simulator(optimisation=optimisation, recorder_size=args.recorder_size, dump_addresses=args.dump_address,
+                  trace_filter=trace_filter, hotspots=args.hotspots > 0 or args.hotspots_export is not None,
+                  per_processor=args.per_processor, window_interval=args.window, window_file=window_file,
+                  window_binary=args.window_binary, progress_interval=args.progress, progress_label=args.file,
+                  profile=args.profile, cprofile=args.cprofile, ways=args.ways, replacement=args.replacement,
+                  prefetcher=args.prefetcher, prefetch_degree=args.prefetch_degree,
+                  llc_blocks=args.llc_blocks, llc_ways=args.llc_ways, llc_banks=args.llc_banks,
+                  llc_inclusive=not args.llc_non_inclusive, llc_replacement=args.llc_replacement,
+                  victim_entries=args.victim_entries, victim_latency=args.victim_latency,
+                  migratory=args.migratory, home=args.home, page_blocks=args.page_blocks,
+                  directory_entries=args.directory_entries, directory_ways=args.directory_ways,
+                  directory_replacement=args.directory_replacement, timing=args.timing,
+                  directory_occupancy=args.directory_occupancy, link_occupancy=args.link_occupancy,
+                  snapshot_file=snapshot_file, snapshot_diff=args.snapshot_diff, results_file=args.results,
+                  cross_check=args.cross_check, cross_check_seed=args.cross_check_seed, traffic=args.traffic,
+                  link_width=args.link_width, eviction_notifications=args.eviction_notifications)
+    if args.build_index:
+        index = build_index(path.join('./cache-traces', args.file))
+        print("Index of {} lines written to {}.".format(index.meta['lines'], index.index_path))
+    elif args.replay_index or args.replay_address or args.replay_lines:
+        indexes = [i for lo, hi in args.replay_index for i in range(lo, hi + 1)]
+        s.run_subset(args.file, indexes, args.replay_address, args.replay_lines)
+    else:
+        s.run_simulation(args.file)
 
-    s = Simulator(optimisation=optimisation)
-    s.run_simulation(file)
+    if s.hotspots is not None:
+        if args.hotspots > 0:
+            print(s.hotspots.report(args.hotspots))
+        if args.hotspots_export is not None:
+            s.hotspots.save(args.hotspots_export)
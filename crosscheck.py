@@ -0,0 +1,71 @@
+from collections import deque
+from stats import AccessType
+import random
+
+
+class CrossCheck:
+    # Shadows a simulator with a reference model (plain Cache/Directory or MESICache/MESIDirectory) that only sees
+    # the accesses to a random sample of the cache indexes. Indexes never interact, so the reference must charge
+    # every sampled access the same cycles and access type and leave the set in the same states as the simulator
+    # being checked; the first access where it does not stops the run with a report. Options that share state
+    # across indexes (prefetching, the LLC, victim caches, a sparse directory, random replacement, first-touch
+    # homes) would make the sample diverge legitimately and are refused.
+    def __init__(self, sim, fraction=0.02, seed=0, context=8):
+        config = sim.config
+        option = sim.cross_index_option()
+        if option is not None:
+            raise Exception('Cross-checking needs independent cache indexes, which {} breaks.'.format(option))
+        from cache_simulation import Simulator
+        self.sim = sim
+        self.reference = Simulator(no_processors=sim.no_processors, block_size=sim.block_size,
+                                   no_cache_blocks=sim.no_cache_blocks, optimisation=sim.optimisation,
+                                   ways=sim.ways, replacement=sim.replacement, migratory=config['migratory'],
+                                   home=config['home'], page_blocks=config['page_blocks'])
+        rng = random.Random(seed)
+        self.sampled = set(rng.sample(range(sim.no_sets), max(1, round(fraction * sim.no_sets))))
+        # The last sampled accesses, reported with a divergence.
+        self.history = deque(maxlen=context)
+        self.caches = sorted(sim.caches.values(), key=lambda c: c.p_num)
+        self.reference_caches = sorted(self.reference.caches.values(), key=lambda c: c.p_num)
+        sim.stats.cross_check_indexes = len(self.sampled)
+
+    def check(self, p, action, mem):
+        # Called by the simulator once it has simulated an access to one of the sampled indexes, before its stats
+        # are reset.
+        sim = self.sim
+        index = mem // sim.block_size % sim.no_sets
+        reference = self.reference
+        if action == 'R':
+            reference.caches[p].read(mem)
+        else:
+            reference.caches[p].write(mem)
+        stats, expected = sim.stats, reference.stats
+        self.history.append((stats.accesses + 1, p, action, mem, stats.access_type, stats.cycles, expected.access_type,
+                             expected.cycles))
+        stats.cross_checked += 1
+        lines = self.set_lines(self.caches, index)
+        expected_lines = self.set_lines(self.reference_caches, index)
+        if stats.cycles != expected.cycles or stats.access_type != expected.access_type or lines != expected_lines:
+            raise Exception(self.report(index, lines, expected_lines))
+        expected.reset()
+
+    def set_lines(self, caches, index):
+        # (tag, state) of every line of the set in every processor's cache.
+        base = index * self.sim.ways
+        return [[(line.tag, line.state) for line in cache.cache_lines[base:base + self.sim.ways]] for cache in caches]
+
+    def report(self, index, lines, expected_lines):
+        accesses, p, action, mem = self.history[-1][:4]
+        st = 'CROSS-CHECK DIVERGENCE at access {} ({} {} {}), cache index {}.'.format(accesses, p, action, mem, index)
+        st += '\nLast sampled accesses (access, line, simulator type/cycles, reference type/cycles):'
+        for accesses, p, action, mem, access_type, cycles, expected_type, expected_cycles in self.history:
+            st += '\n  {:>10} {:<16} {!s:<8} {:>4}   {!s:<8} {:>4}{}'.format(
+                accesses, '{} {} {}'.format(p, action, mem), AccessType(access_type), cycles,
+                AccessType(expected_type), expected_cycles,
+                '' if (access_type, cycles) == (expected_type, expected_cycles) else '   <--')
+        st += '\nSet {} (tag, state) per processor, simulator vs reference:'.format(index)
+        for p, (ways, expected_ways) in enumerate(zip(lines, expected_lines)):
+            st += '\n  P{}: {} {} {}'.format(p, ['{} {}'.format(t, s) for t, s in ways],
+                                            '==' if ways == expected_ways else '!=',
+                                            ['{} {}'.format(t, s) for t, s in expected_ways])
+        return st + '\n' + self.sim.stats.recorder.dump('cross-check divergence')
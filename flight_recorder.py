@@ -0,0 +1,64 @@
+from enum import Enum
+
+
+class EventType(Enum):
+    # Enumeration of coherence events kept by the flight recorder.
+
+    def __str__(self):
+        return self.name
+
+    READ_MISS = 0
+    WRITE_MISS = 1
+    INVALIDATION = 2
+    REPLACEMENT_WRITEBACK = 3
+    COHERENCE_WRITEBACK = 4
+    STATE_TRANSITION = 5
+    EVICTION = 6
+    PREFETCH = 7
+
+
+class FlightRecorder:
+    # Fixed-size ring buffer holding the most recent coherence events.
+    # Recording an event is a single slot store, so it is cheap enough to leave on for a whole trace and dump the
+    # buffer afterwards instead of re-running with verbose mode.
+    def __init__(self, size=256):
+        self.size = size
+        self.events = [None] * size
+        self.position = 0
+        self.recorded = 0
+
+    def record(self, access, event_type, p_num, index, tag, state, cycles):
+        self.events[self.position] = (access, event_type, p_num, index, tag, state, cycles)
+        self.position += 1
+        if self.position == self.size:
+            self.position = 0
+        self.recorded += 1
+
+    def recent(self):
+        # Events in the order they were recorded, oldest first.
+        if self.recorded < self.size:
+            return self.events[:self.position]
+        return self.events[self.position:] + self.events[:self.position]
+
+    def clear(self):
+        self.events = [None] * self.size
+        self.position = 0
+        self.recorded = 0
+
+    def dump(self, reason=None):
+        events = self.recent()
+        st = "FLIGHT RECORDER: last {} of {} events".format(len(events), self.recorded)
+        if reason is not None:
+            st += " ({})".format(reason)
+        st += "\n"
+        for event in events:
+            st += format_event(event) + "\n"
+        return st
+
+
+def format_event(event):
+    access, event_type, p_num, index, tag, state, cycles = event
+    st = '#{} P{} {} Idx: {} Tag: {}'.format(access, p_num, event_type, index, tag)
+    if state is not None:
+        st += ' -> {}'.format(state)
+    return st + ' ({})'.format(cycles)
@@ -0,0 +1,28 @@
+HOME_POLICIES = ['interleave', 'page', 'first-touch']
+
+
+class HomeMap:
+    # Home node of every block for a distributed directory, the processor whose directory slice (and memory)
+    # holds it:
+    #   interleave   consecutive blocks go to consecutive nodes
+    #   page         consecutive pages of page_blocks blocks go to consecutive nodes
+    #   first-touch  a page belongs to the first processor to miss on it, as NUMA operating systems place pages
+    def __init__(self, policy, no_processors, page_blocks=64):
+        if policy not in HOME_POLICIES:
+            raise Exception('Home node policy \'{}\' is not accepted. Must be one of {}.'.format(
+                policy, ', '.join(HOME_POLICIES)))
+        self.policy = policy
+        self.no_processors = no_processors
+        self.page_blocks = page_blocks
+        self.pages = {}
+
+    def home_of(self, block, p_num):
+        if self.policy == 'interleave':
+            return block % self.no_processors
+        page = block // self.page_blocks
+        if self.policy == 'page':
+            return page % self.no_processors
+        home = self.pages.get(page)
+        if home is None:
+            home = self.pages[page] = p_num
+        return home
@@ -0,0 +1,101 @@
+from array import array
+from flight_recorder import EventType
+
+# Counters kept for every cache index and every block, in column order.
+COUNTERS = ['conflict_misses', 'replacement_writebacks', 'coherence_writebacks', 'invalidations', 'ping_pong']
+
+CONFLICT_MISSES = 0
+REPLACEMENT_WRITEBACKS = 1
+COHERENCE_WRITEBACKS = 2
+INVALIDATIONS = 3
+PING_PONG = 4
+
+
+class HotspotProfiler:
+    # Per cache index and per block counters of the events behind the global totals in final_stats.
+    # It listens to the same events as the flight recorder. A conflict miss is a miss that replaces a valid line
+    # with another tag, ping-pong is a write miss on a block that was last written by a different processor.
+    def __init__(self, no_cache_blocks, ways=1):
+        # Events carry the cache line, with set-associative caches the counters are kept per set.
+        self.ways = ways
+        self.no_sets = no_cache_blocks // ways
+        self.index_bits = (self.no_sets - 1).bit_length()
+        self.index_counters = [array('Q', bytes(8 * self.no_sets)) for c in COUNTERS]
+        # Blocks are only known once touched, so each block gets a row in flat arrays as it first appears.
+        self.block_rows = {}
+        self.blocks = array('Q')
+        self.block_counters = array('Q')
+        self.last_writer = array('b')
+
+    def block_row(self, index, tag):
+        block = (tag << self.index_bits) | index
+        row = self.block_rows.get(block)
+        if row is None:
+            row = len(self.blocks)
+            self.block_rows[block] = row
+            self.blocks.append(block)
+            self.block_counters.extend((0, 0, 0, 0, 0))
+            self.last_writer.append(-1)
+        return row
+
+    def count(self, counter, index, tag):
+        index //= self.ways
+        self.index_counters[counter][index] += 1
+        self.block_counters[self.block_row(index, tag) * len(COUNTERS) + counter] += 1
+
+    def record(self, access, event_type, p_num, index, tag, state, cycles):
+        if event_type == EventType.WRITE_MISS:
+            index //= self.ways
+            row = self.block_row(index, tag)
+            if self.last_writer[row] not in (-1, p_num):
+                self.index_counters[PING_PONG][index] += 1
+                self.block_counters[row * len(COUNTERS) + PING_PONG] += 1
+            self.last_writer[row] = p_num
+        elif event_type == EventType.REPLACEMENT_WRITEBACK:
+            self.count(REPLACEMENT_WRITEBACKS, index, tag)
+            self.count(CONFLICT_MISSES, index, tag)
+        elif event_type == EventType.EVICTION:
+            self.count(CONFLICT_MISSES, index, tag)
+        elif event_type == EventType.INVALIDATION:
+            self.count(INVALIDATIONS, index, tag)
+        elif event_type == EventType.COHERENCE_WRITEBACK:
+            self.count(COHERENCE_WRITEBACKS, index, tag)
+
+    def index_totals(self):
+        return [sum(c[i] for c in self.index_counters) for i in range(self.no_sets)]
+
+    def block_totals(self):
+        n = len(COUNTERS)
+        return [sum(self.block_counters[r * n:(r + 1) * n]) for r in range(len(self.blocks))]
+
+    def report(self, k=10):
+        n = len(COUNTERS)
+        row_fmt = '{:>10} ' + ' '.join('{:>' + str(len(c)) + '}' for c in COUNTERS) + '\n'
+
+        totals = self.index_totals()
+        top = sorted((i for i in range(self.no_sets) if totals[i] > 0), key=lambda i: -totals[i])[:k]
+        st = "TOP {} CACHE INDEXES:\n".format(len(top))
+        st += row_fmt.format('Idx', *COUNTERS)
+        for i in top:
+            st += row_fmt.format(i, *[c[i] for c in self.index_counters])
+
+        totals = self.block_totals()
+        top = sorted((r for r in range(len(self.blocks)) if totals[r] > 0), key=lambda r: -totals[r])[:k]
+        st += "TOP {} BLOCKS:\n".format(len(top))
+        st += row_fmt.format('Block', *COUNTERS)
+        for r in top:
+            st += row_fmt.format(self.blocks[r], *self.block_counters[r * n:(r + 1) * n])
+        return st
+
+    def to_numpy(self):
+        # Returns the counters as NumPy arrays: one array per counter indexed by cache index, 'blocks' with the
+        # block numbers and 'block_counters' with one row per block and one column per counter.
+        import numpy as np
+        arrays = {c: np.frombuffer(self.index_counters[i], dtype=np.uint64).copy() for i, c in enumerate(COUNTERS)}
+        arrays['blocks'] = np.frombuffer(self.blocks, dtype=np.uint64).copy()
+        arrays['block_counters'] = np.frombuffer(self.block_counters, dtype=np.uint64).reshape(-1, len(COUNTERS)).copy()
+        return arrays
+
+    def save(self, filename):
+        import numpy as np
+        np.savez_compressed(filename, **self.to_numpy())
@@ -0,0 +1,64 @@
+from replacement import make_policy
+
+
+class SharedCache:
+    # Shared last-level cache in front of memory. The directory looks it up for data no private cache can forward.
+    # Blocks are interleaved over the banks by block number and every bank is set-associative, using one of the
+    # replacement.py policies. Only block numbers and dirty bits are kept, the data itself is not simulated.
+    # An inclusive LLC must not evict a block a private cache still holds, so the directory invalidates those
+    # copies when it does (back-invalidation). A non-inclusive one lets them stay.
+    def __init__(self, stats, no_blocks=4096, ways=8, banks=4, inclusive=True, replacement='lru'):
+        if no_blocks % (ways * banks) != 0:
+            raise Exception('LLC of {} blocks cannot be split into {} banks of {}-way sets.'.format(
+                no_blocks, banks, ways))
+        self.stats = stats
+        self.ways = ways
+        self.banks = banks
+        self.inclusive = inclusive
+        self.sets_per_bank = no_blocks // (ways * banks)
+        self.blocks = [None] * no_blocks
+        self.dirty = bytearray(no_blocks)
+        self.policy = make_policy(replacement, self.sets_per_bank * banks, ways)
+        stats.llc_bank_lookups = [0] * banks
+
+    def set_of(self, block):
+        bank = block % self.banks
+        return bank, bank * self.sets_per_bank + (block // self.banks) % self.sets_per_bank
+
+    def access(self, block):
+        # Looks the block up and allocates it on a miss. Returns whether it hit and the block replaced to make
+        # room, if any. Replacing a dirty block writes it back to memory.
+        stats = self.stats
+        bank, set_index = self.set_of(block)
+        stats.llc_access()
+        stats.llc_bank_lookups[bank] += 1
+        base = set_index * self.ways
+        for way in range(self.ways):
+            if self.blocks[base + way] == block:
+                self.policy.touch(set_index, way)
+                stats.llc_hits += 1
+                return True, None
+
+        stats.llc_misses += 1
+        for way in range(self.ways):
+            if self.blocks[base + way] is None:
+                break
+        else:
+            way = self.policy.victim(set_index)
+        victim = self.blocks[base + way]
+        if self.dirty[base + way]:
+            stats.llc_writebacks += 1
+        self.blocks[base + way] = block
+        self.dirty[base + way] = 0
+        self.policy.fill(set_index, way)
+        return False, victim
+
+    def mark_dirty(self, block):
+        # A processor was given the block in M. Nothing to do if the (non-inclusive) LLC does not hold it, the
+        # owner then writes it back to memory.
+        bank, set_index = self.set_of(block)
+        base = set_index * self.ways
+        for way in range(self.ways):
+            if self.blocks[base + way] == block:
+                self.dirty[base + way] = 1
+                return
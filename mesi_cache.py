@@ -1,17 +1,28 @@
-from cache import CacheLine, CacheState
+from cache import CacheLine, CacheState, decode_address, select_line
+from flight_recorder import EventType
+from replacement import make_policy
 
 
 class MESICache:
     # Representation of Cache.
-    # Cache is direct-mapped with a write-back policy.
-    def __init__(self, p_num, block_size, no_blocks, directory, stats, verbose=False):
+    # Cache is direct-mapped with a write-back policy, or set-associative with ways > 1 (see Cache).
+    def __init__(self, p_num, block_size, no_blocks, directory, stats, verbose=False, ways=1, replacement='lru'):
         self.p_num = p_num
         self.block_size = block_size
         self.no_blocks = no_blocks
+        self.ways = ways
+        self.no_sets = no_blocks // ways
+        self.policy = make_policy(replacement, self.no_sets, ways, seed=p_num) if ways > 1 else None
         self.cache_lines = [CacheLine() for i in range(no_blocks)]
         self.directory = directory
         self.stats = stats
         self.verbose = verbose
+        # Optional prefetch stage (prefetcher.Prefetcher) and victim cache (victim_cache.VictimCache), attached by
+        # the simulator.
+        self.prefetcher = None
+        self.victim_cache = None
+        # Lines handed over in M on a read miss (migratory sharing) and not written yet, index -> tag.
+        self.migratory_grants = {}
 
     def __str__(self):
         st = ""
@@ -26,11 +37,9 @@ class MESICache:
 
     def calculate_cache_line(self, address):
         # This is a cache probe, I.e finding the state and the tag.
-        bin_address = '{0:032b}'.format(address)
-        # TODO: This should be changed so it works for any size
-        offset = int(bin_address[-2:], 2)
-        index = int(bin_address[-11:-2], 2)
-        tag = int(bin_address[:-11], 2)
+        offset, index, tag = decode_address(address, self.block_size, self.no_sets)
+        if self.ways > 1:
+            index = select_line(self.cache_lines, self.policy, index, tag, self.ways)
         self.stats.cache_probe()
         if self.verbose:
             print("P{}. Index: {}. Tag: {}. Local State: {}.".format(self.p_num, index, tag, self.cache_lines[index].state))
@@ -38,14 +47,22 @@ class MESICache:
 
     def invalidate_line(self, index):
         # print("Invalidating line {} in processor {}".format(index, self.p_num))
+        self.stats.record(EventType.INVALIDATION, self.p_num, index, self.cache_lines[index].tag, CacheState.INVALID)
         if self.cache_lines[index].state == CacheState.MODIFIED:
             self.stats.coherence_writebacks += 1
+            self.stats.record(EventType.COHERENCE_WRITEBACK, self.p_num, index, self.cache_lines[index].tag)
             if self.verbose:
                 print("COHERENCE WRITE-BACK: Cache line was in M state, and has been invalidated.")
         self.cache_lines[index].state = CacheState.INVALID
         self.cache_lines[index].tag = None
         return
 
+    def hand_over_line(self, index):
+        # Migratory sharing: the dirty line moves to the requester in M, so it is dropped without a write-back.
+        self.stats.record(EventType.INVALIDATION, self.p_num, index, self.cache_lines[index].tag, CacheState.INVALID)
+        self.cache_lines[index].state = CacheState.INVALID
+        self.cache_lines[index].tag = None
+
     def write(self, address):
         # If in E state can just change to M
         # if In M just write
@@ -53,12 +70,20 @@ class MESICache:
         if self.verbose:
             print("P{} write to word {}.".format(self.p_num, address))
         index, tag = self.calculate_cache_line(address)
+        if self.victim_cache is not None and self.cache_lines[index].tag != tag:
+            self.victim_cache.swap(index, tag)
+        if self.prefetcher is not None:
+            self.prefetcher.demand(index, tag)
         cache_line = self.cache_lines[index]
         # If in modified state, you can write freely
         if cache_line.state == CacheState.MODIFIED and cache_line.tag == tag:
             # You can just write, state stays the same
             if self.verbose:
                 print("Cache line is in M state and tags match, the cache is free to write.")
+            if self.migratory_grants and self.migratory_grants.get(index) == tag:
+                # First write to a migratory block, the upgrade it would have needed was avoided.
+                del self.migratory_grants[index]
+                self.stats.migratory_upgrades_avoided += 1
             self.stats.cache_access()
             return
 
@@ -69,20 +94,31 @@ class MESICache:
 
             cache_line.state = CacheState.MODIFIED
             self.cache_lines[index] = cache_line
+            self.stats.record(EventType.STATE_TRANSITION, self.p_num, index, tag, CacheState.MODIFIED)
 
             self.stats.cache_access()
             return
 
         # Replace if tag miss and modified
-        if cache_line.tag != tag and cache_line.state == CacheState.MODIFIED:
+        if cache_line.tag != tag and cache_line.state != CacheState.INVALID and self.victim_cache is not None:
+            # The line moves to the victim cache, it is only written back once it leaves that too.
+            self.victim_cache.insert(index, cache_line.tag, cache_line.state)
+        elif cache_line.tag != tag and cache_line.state == CacheState.MODIFIED:
             # Must write back to memory
             if self.verbose:
                 print("REPLACEMENT WRITE-BACK: Tag miss and cache state was M, and is therefore being replaced.")
             self.stats.replacement_writebacks += 1
+            self.stats.record(EventType.REPLACEMENT_WRITEBACK, self.p_num, index, cache_line.tag)
+            self.directory.replaced(index, cache_line.tag, self.p_num, cache_line.state)
+        elif cache_line.tag != tag and cache_line.state != CacheState.INVALID:
+            # A clean line is replaced without a write-back
+            self.stats.record(EventType.EVICTION, self.p_num, index, cache_line.tag)
+            self.directory.replaced(index, cache_line.tag, self.p_num, cache_line.state)
 
         # If State is INVALID or if state is SHARED or is a tag miss
         if self.verbose:
             print("Write miss! Must contact the directory.")
+        self.stats.record(EventType.WRITE_MISS, self.p_num, index, tag)
         self.write_miss(index, tag, address)
         return
 
@@ -91,6 +127,9 @@ class MESICache:
         if self.verbose:
             print("P{} reading to word {}.".format(self.p_num, address))
         index, tag = self.calculate_cache_line(address)
+        if self.victim_cache is not None and self.cache_lines[index].tag != tag:
+            self.victim_cache.swap(index, tag)
+        prefetch_hit = self.prefetcher is not None and self.prefetcher.demand(index, tag)
         cache_line = self.cache_lines[index]
 
         # If in shared or modified or exclusive state, you can read freely.
@@ -100,15 +139,25 @@ class MESICache:
                 print("Cache state is {}, cache is free to read.".format(cache_line.state))
             # You can just read, state stays the same
             self.stats.cache_access()
+            if prefetch_hit:
+                # First use of a prefetched line, the stream it belongs to goes on.
+                self.prefetcher.trigger(address)
             return
 
         if cache_line.tag != tag:
             # Tag miss on any state
-            if cache_line.state == CacheState.MODIFIED:
+            if cache_line.state != CacheState.INVALID and self.victim_cache is not None:
+                self.victim_cache.insert(index, cache_line.tag, cache_line.state)
+            elif cache_line.state == CacheState.MODIFIED:
                 # Must write back to memory
                 if self.verbose:
                     print("REPLACEMENT WRITE-BACK: Tag miss and cache state was M, and is therefore being replaced.")
                 self.stats.replacement_writebacks += 1
+                self.stats.record(EventType.REPLACEMENT_WRITEBACK, self.p_num, index, cache_line.tag)
+                self.directory.replaced(index, cache_line.tag, self.p_num, cache_line.state)
+            elif cache_line.state != CacheState.INVALID:
+                self.stats.record(EventType.EVICTION, self.p_num, index, cache_line.tag)
+                self.directory.replaced(index, cache_line.tag, self.p_num, cache_line.state)
 
             # If state is shared, we don't need to write-back we can just write over
 
@@ -118,6 +167,7 @@ class MESICache:
         # If State is INVALID or (State is SHARED AND tag miss)
         if self.verbose:
             print("Read miss! Must contact the directory.")
+        self.stats.record(EventType.READ_MISS, self.p_num, index, tag)
         self.read_miss(index, tag, address)
 
     def write_miss(self,  index, tag, address):
@@ -125,6 +175,8 @@ class MESICache:
 
         # Contact the directory, we want to invalidate other copies if shared.
         self.directory.write_miss(index, tag, self.p_num)
+        if self.migratory_grants:
+            self.migratory_grants.pop(index, None)
 
         # Change state, will change to MODIFIED this is the same for either I or E.
         if self.verbose:
@@ -133,6 +185,7 @@ class MESICache:
         cache_line.tag = tag
 
         self.cache_lines[index] = cache_line
+        self.stats.record(EventType.STATE_TRANSITION, self.p_num, index, tag, CacheState.MODIFIED)
 
         # Write to cache.
         self.write(address)
@@ -151,6 +204,13 @@ class MESICache:
         cache_line.tag = tag
 
         self.cache_lines[index] = cache_line
+        self.stats.record(EventType.STATE_TRANSITION, self.p_num, index, tag, state)
+        if state == CacheState.MODIFIED:
+            # Only migratory blocks are given in M on a read miss.
+            self.migratory_grants[index] = tag
 
         # Read from cache.
         self.read(address)
+
+        if self.prefetcher is not None:
+            self.prefetcher.trigger(address)
@@ -1,11 +1,39 @@
 from cache import CacheState, CacheLine
 from stats import AccessType
+from flight_recorder import EventType
 
 
 class MESIDirectory:
-    def __init__(self, no_cache_blocks, no_processors, stats, verbose=False):
+    def __init__(self, no_cache_blocks, no_processors, stats, verbose=False, ways=1, llc=None, home_map=None, sparse=None, migratory=False,
+                 traffic=None, notify_evictions=False):
         # Sets up the directory, each line holds the line state and the sharer vector.
         self.lines = [[CacheLine() for i in range(no_processors)] for x in range(no_cache_blocks)]
+        self.no_processors = no_processors
+        # With set-associative caches the directory also tracks which way of the set each processor holds a
+        # block in, slots[p] is that line for the request being handled.
+        self.ways = ways
+        self.slots = None
+        # Optional shared last-level cache (llc.SharedCache) checked before memory.
+        self.llc = llc
+        # Victim caches of the connected caches, snooped on every request.
+        self.victim_caches = []
+        # Optional home_node.HomeMap: the directory is then sliced across the processors, each block's entry
+        # living at its home node, instead of sitting one hop away from all of them.
+        self.home_map = home_map
+        self.home = None
+        # Optional sparse_directory.SparseDirectory: only a limited number of blocks can be tracked at a time,
+        # entry is the one of the request being handled.
+        self.sparse = sparse
+        self.entry = None
+        # Optional traffic.Traffic counting the messages the protocol sends.
+        self.traffic = traffic
+        # Caches tell the directory about every line they replace, a clean hint or with the writeback.
+        self.notify_evictions = notify_evictions
+        # Migratory sharing detection: blocks seen being read then written by one processor after another are
+        # handed over in M on a read miss, so the write that follows is a private hit.
+        self.migratory_detection = migratory
+        self.migratory = set()
+        self.last_writer = {}
         self.stats = stats
         self.connected_caches = []
         self.verbose = verbose
@@ -33,12 +61,26 @@ class MESIDirectory:
         print("Lines {}".format(['P{}: {}'.format(i, str(l)) for i, l in enumerate(self.lines[index]) if l.tag is not None]))
 
     def distance_between_processors(self, requester, forwarder):
-        distance = (4 + (requester - forwarder)) % 4
+        distance = (self.no_processors + (requester - forwarder)) % self.no_processors
         return distance
 
-    def cache_lines_from_index(self, index):
+    def cache_lines_from_index(self, index, tag=None):
         self.stats.directory_access()
-        return self.lines[index]
+        if self.ways == 1:
+            return self.lines[index]
+        # Each processor's entry is the way of the set holding the tag, or the requester's way if it has none.
+        base = index - index % self.ways
+        self.slots = [index] * self.no_processors
+        for p in range(self.no_processors):
+            for slot in range(base, base + self.ways):
+                if self.lines[slot][p].tag == tag:
+                    self.slots[p] = slot
+                    break
+        return [self.lines[self.slots[p]][p] for p in range(self.no_processors)]
+
+    def slot_of(self, p, index):
+        # Line of processor p taking part in the request for line index.
+        return index if self.ways == 1 else self.slots[p]
 
     def get_sharers(self, lines, tag, p_num):
         sharers = []
@@ -48,7 +90,233 @@ class MESIDirectory:
         return sharers
 
     def update_cache_lines(self, index, lines):
-        self.lines[index] == lines
+        if self.ways == 1:
+            self.lines[index] = lines
+            return
+        for p, line in enumerate(lines):
+            self.lines[self.slots[p]][p] = line
+
+    def refill(self, p_num, index, tag, state):
+        # A victim cache swapped a block back into line index of processor p_num.
+        self.lines[index][p_num] = CacheLine(state, tag)
+
+    def snoop_victims(self, index, tag, p_num, write):
+        # The directory's entries only follow the caches, so copies in other processors' victim caches are checked
+        # on every request: a write invalidates them, a read leaves them in S, a modified copy is written back
+        # either way. Returns True if there was a copy.
+        if not self.victim_caches:
+            return False
+        block = self.block_of(index, tag)
+        held = False
+        for victim_cache in self.victim_caches:
+            p = victim_cache.cache.p_num
+            if p == p_num:
+                continue
+            state = victim_cache.snoop(block, write)
+            if state is None:
+                continue
+            held = True
+            if write:
+                self.stats.invalidations_sent += 1
+                self.stats.record(EventType.INVALIDATION, p, index, tag, CacheState.INVALID)
+            if state == CacheState.MODIFIED:
+                # The dirty data is written back whether the copy is invalidated or left shared.
+                new_state = CacheState.INVALID if write else CacheState.SHARED
+                if self.verbose:
+                    print("COHERENCE WRITE-BACK: P{} victim cache line was in M state, now {}.".format(p, new_state))
+                self.stats.coherence_writebacks += 1
+                self.stats.record(EventType.COHERENCE_WRITEBACK, p, index, tag, new_state)
+        return held
+
+    def detect_migratory(self, index, tag, p_num, sharers, upgrade):
+        # A write upgrading the requester's copy while the only other copy is the last writer's is a read then
+        # write passed on from one processor to the next.
+        block = self.block_of(index, tag)
+        if upgrade and len(sharers) == 1 and self.last_writer.get(block) == sharers[0] and block not in self.migratory:
+            if self.verbose:
+                print("Block {} is migratory.".format(block))
+            self.migratory.add(block)
+            self.stats.migratory_detections += 1
+        self.last_writer[block] = p_num
+
+    def migrate(self, index, tag, owner, sharers, victim_copies):
+        # Whether a read miss takes the block over in M. Only for migratory blocks held by a single processor
+        # that has written its copy, an owner that did not write since it was handed the block ends the pattern.
+        if not self.migratory_detection or len(sharers) != 1 or victim_copies:
+            return False
+        block = self.block_of(index, tag)
+        if block not in self.migratory:
+            return False
+        cache = self.connected_caches[owner]
+        slot = self.slot_of(owner, index)
+        if cache.cache_lines[slot].state == CacheState.MODIFIED and cache.migratory_grants.get(slot) != tag:
+            self.stats.migratory_grants += 1
+            return True
+        if self.verbose:
+            print("Block {} is no longer migratory, P{} did not write it.".format(block, owner))
+        self.migratory.discard(block)
+        self.stats.migratory_demotions += 1
+        return False
+
+    def block_of(self, index, tag):
+        no_sets = len(self.lines) // self.ways
+        return tag * no_sets + index // self.ways
+
+    def hop_to_home(self, index, tag, p_num):
+        # Request from p_num to the directory. A centralised directory is one hop away from every processor, a
+        # distributed one keeps the block's entry in the slice at its home node, reached over the ring.
+        if self.home_map is None:
+            self.stats.hop_between_processor_and_directory()
+            return
+        self.home = self.home_map.home_of(self.block_of(index, tag), p_num)
+        self.stats.home_requests[self.home] += 1
+        if self.home == p_num:
+            self.stats.local_home_requests += 1
+        self.hop_into_home(p_num)
+
+    def hop_into_home(self, p):
+        # Message from processor p to the directory (the home node of the request being handled).
+        if self.home_map is None:
+            self.stats.hop_between_processor_and_directory()
+            return
+        for i in range(self.distance_between_processors(self.home, p)):
+            self.stats.hop_between_processors()
+
+    def hop_from_home(self, p):
+        # Message from the directory (the home node of the request being handled) to processor p.
+        if self.home_map is None:
+            self.stats.hop_between_processor_and_directory()
+            return
+        for i in range(self.distance_between_processors(p, self.home)):
+            self.stats.hop_between_processors()
+
+    def fetch_block(self, index, tag, p_num):
+        # Data no cache can forward comes from the LLC if there is one and it holds the block, else from memory.
+        if self.llc is not None:
+            hit, victim = self.llc.access(self.block_of(index, tag))
+            if victim is not None and self.llc.inclusive:
+                self.back_invalidate(victim, index, p_num)
+            if hit:
+                if self.verbose:
+                    print("LLC hit, the data comes from the LLC.")
+                self.stats.access_type = AccessType.LLC
+                self.message('data', None, p_num)
+                self.hop_from_home(p_num)
+                return
+        self.stats.memory_access_latency()
+        self.stats.access_type = AccessType.OFF_CHIP
+        self.message('data', None, p_num)
+        self.hop_from_home(p_num)
+
+    def back_invalidate(self, block, index, p_num):
+        # The inclusive LLC evicted the block, so every private copy goes too. Directory entries are changed in
+        # place as the request being handled may hold them. The requester's copy at index is the line its miss
+        # is replacing, already written back or dropped, so it is left to the fill.
+        no_sets = len(self.lines) // self.ways
+        set_index, tag = block % no_sets, block // no_sets
+        for slot in range(set_index * self.ways, (set_index + 1) * self.ways):
+            for p, line in enumerate(self.lines[slot]):
+                if line.tag == tag and line.state != CacheState.INVALID and not (p == p_num and slot == index):
+                    if self.verbose:
+                        print("LLC BACK-INVALIDATION: P{} loses block {}.".format(p, block))
+                    self.stats.llc_back_invalidations += 1
+                    self.message('invalidation', None, p)
+                    dirty = self.connected_caches[p].cache_lines[slot].state == CacheState.MODIFIED
+                    self.message('writeback' if dirty else 'ack', p, None)
+                    self.connected_caches[p].invalidate_line(slot)
+                    line.state = CacheState.INVALID
+                    line.tag = None
+        for victim_cache in self.victim_caches:
+            if victim_cache.snoop(block, True) is not None:
+                self.stats.llc_back_invalidations += 1
+        if self.sparse is not None:
+            self.sparse.free(block)
+
+    def lookup_entry(self, index, tag, p_num):
+        # Finds the sparse directory entry of the block requested, replacing another block's entry if it has none.
+        if self.sparse is None:
+            return
+        self.entry, victim, sharers = self.sparse.lookup(self.block_of(index, tag))
+        if victim is not None:
+            self.evict_entry(victim, sharers, index, p_num)
+
+    def evict_entry(self, block, sharers, index, p_num):
+        # The block lost its directory entry, so it can no longer be cached: an invalidation goes to every
+        # processor in the sharer vector, whether it still holds the block or not, and the request waits for the
+        # furthest one to acknowledge. Directory entries are changed in place as the request may hold them.
+        stats = self.stats
+        cycles = stats.cycles
+        stats.directory_evictions += 1
+        no_sets = len(self.lines) // self.ways
+        set_index, tag = block % no_sets, block // no_sets
+        targets = [p for p in range(self.no_processors) if sharers >> p & 1]
+        for p in targets:
+            stats.invalidations_sent += 1
+            stats.directory_eviction_invalidations += 1
+            self.message('invalidation', None, p)
+            dirty = False
+            for slot in range(set_index * self.ways, (set_index + 1) * self.ways):
+                line = self.lines[slot][p]
+                # The requester's own copy is being replaced by the block it asked for anyway.
+                if line.tag != tag or line.state == CacheState.INVALID or (p == p_num and slot == index):
+                    continue
+                if self.verbose:
+                    print("DIRECTORY EVICTION: P{} loses block {}.".format(p, block))
+                stats.directory_eviction_lines += 1
+                if self.connected_caches[p].cache_lines[slot].state == CacheState.MODIFIED:
+                    stats.directory_eviction_writebacks += 1
+                    dirty = True
+                self.connected_caches[p].invalidate_line(slot)
+                line.state = CacheState.INVALID
+                line.tag = None
+            self.message('writeback' if dirty else 'ack', p, None)
+        for victim_cache in self.victim_caches:
+            if victim_cache.snoop(block, True) is not None:
+                stats.directory_eviction_lines += 1
+        if targets:
+            furthest = targets[0]
+            if self.home_map is not None:
+                furthest = max(targets, key=lambda p: self.distance_between_processors(p, self.home))
+            self.hop_from_home(furthest)
+            self.hop_into_home(furthest)
+        stats.directory_eviction_cycles += stats.cycles - cycles
+
+    def add_sharer(self, p_num, exclusive=False):
+        if self.sparse is not None:
+            self.sparse.add_sharer(self.entry, p_num, exclusive)
+
+    def message(self, kind, src, dst):
+        # Message of the request being handled from src to dst, processor numbers or None for the directory.
+        if self.traffic is not None:
+            self.traffic.send(kind, src, dst, self.home)
+
+    def replaced(self, index, tag, p_num, state):
+        # Processor p_num replaced its copy of a block, a modified one is written back to the block's home. With
+        # eviction notifications the directory is told either way, a clean copy with a hint, and drops p_num from
+        # the block's sharers. Neither adds to the latency of the access.
+        dirty = state == CacheState.MODIFIED
+        if not self.notify_evictions:
+            if self.traffic is not None and dirty:
+                home = None if self.home_map is None else self.home_map.home_of(self.block_of(index, tag), p_num)
+                self.traffic.send('writeback', p_num, None, home)
+            return
+        block = self.block_of(index, tag)
+        if self.traffic is not None:
+            home = None if self.home_map is None else self.home_map.home_of(block, p_num)
+            self.traffic.send('writeback' if dirty else 'hint', p_num, None, home)
+        if dirty:
+            self.stats.eviction_writeback_notices += 1
+        else:
+            self.stats.eviction_hints += 1
+        # A line leaving a victim cache is no longer in the slot it was replaced from, so the set is searched. The
+        # requester's own entry for the slot is left to the miss refilling it, which reads it the way it would
+        # without notifications, so that they do not change any latency.
+        base = index - index % self.ways
+        for slot in range(base, base + self.ways):
+            if slot != index and self.lines[slot][p_num].tag == tag:
+                self.lines[slot][p_num] = CacheLine()
+        if self.sparse is not None:
+            self.sparse.remove_sharer(block, p_num)
 
     def invalidate_processor(self, p, index):
         self.stats.invalidations_sent += 1
@@ -56,11 +324,14 @@ class MESIDirectory:
 
     def read_miss(self, index, tag, p_num):
         self.stats.access_type = AccessType.REMOTE
-        self.stats.hop_between_processor_and_directory()
+        self.hop_to_home(index, tag, p_num)
+        self.message('request', p_num, None)
+        self.lookup_entry(index, tag, p_num)
 
         update_state = CacheState.SHARED
 
-        lines = self.cache_lines_from_index(index)
+        lines = self.cache_lines_from_index(index, tag)
+        victim_copies = self.snoop_victims(index, tag, p_num, False)
         if self.verbose:
             self.print_lines(index)
 
@@ -81,7 +352,8 @@ class MESIDirectory:
             if self.verbose:
                 print("Send message to closest sharer to forward the data.")
 
-            self.stats.hop_between_processor_and_directory()
+            self.hop_from_home(closest)
+            self.message('forward', None, closest)
 
             # Access cache to forward line
             if self.verbose:
@@ -93,21 +365,35 @@ class MESIDirectory:
             distance = self.distance_between_processors(p_num, closest)
             for i in range(distance):
                 self.stats.hop_between_processors()
+            self.message('data', closest, p_num)
 
-            if lines[closest].state == CacheState.MODIFIED:
+            if self.migrate(index, tag, closest, sharers, victim_copies):
+                # The requester takes the dirty line over, the owner is invalidated instead of writing it back.
+                if self.verbose:
+                    print("Migratory block, P{} is invalidated and the line handed over in M.".format(closest))
+                self.stats.invalidations_sent += 1
+                self.connected_caches[closest].hand_over_line(self.slot_of(closest, index))
+                lines[closest] = CacheLine(CacheState.INVALID, None)
+                update_state = CacheState.MODIFIED
+            elif lines[closest].state == CacheState.MODIFIED:
                 # Must become shared, causes a coherence write-back
                 if self.verbose:
                     print("COHERENCE WRITE-BACK: Cache line was in M state, and has been changed to S state.")
-                self.connected_caches[closest].cache_lines[index].state = CacheState.SHARED
+                self.connected_caches[closest].cache_lines[self.slot_of(closest, index)].state = CacheState.SHARED
                 self.stats.coherence_writebacks += 1
+                self.stats.record(EventType.COHERENCE_WRITEBACK, closest, self.slot_of(closest, index), tag,
+                                  CacheState.SHARED)
+                self.message('writeback', closest, None)
 
                 # Update directory lines for sharer
                 lines[closest] = CacheLine(CacheState.SHARED, tag)
             elif lines[closest].state == CacheState.EXCLUSIVE:
                 # Change to S state, this does not require a write-back as it was clean.
-                self.connected_caches[closest].cache_lines[index].state = CacheState.SHARED
+                self.connected_caches[closest].cache_lines[self.slot_of(closest, index)].state = CacheState.SHARED
                 if self.verbose:
                     print("Shared cache line was in E state, and has been changed to S state.")
+                self.stats.record(EventType.STATE_TRANSITION, closest, self.slot_of(closest, index), tag,
+                                  CacheState.SHARED)
 
                 # Change sharer vector to shared
                 lines[closest].state = CacheState.SHARED
@@ -115,13 +401,14 @@ class MESIDirectory:
         elif len(sharers) == 0:
             if self.verbose:
                 print("There are no sharers, must fetch the data from memory.")
-            self.stats.memory_access_latency()
-            self.stats.access_type = AccessType.OFF_CHIP
-            self.stats.hop_between_processor_and_directory()
-            update_state = CacheState.EXCLUSIVE
+            self.fetch_block(index, tag, p_num)
+            # A copy kept in another processor's victim cache rules out E.
+            update_state = CacheState.SHARED if victim_copies else CacheState.EXCLUSIVE
 
         # Update directory line
         lines[p_num] = CacheLine(update_state, tag)
+        # A migratory grant invalidated the owner.
+        self.add_sharer(p_num, update_state == CacheState.MODIFIED)
 
         if self.verbose:
             self.print_lines(index)
@@ -131,13 +418,18 @@ class MESIDirectory:
 
     def write_miss(self, index, tag, p_num):
         self.stats.access_type = AccessType.REMOTE
-        self.stats.hop_between_processor_and_directory()
+        self.hop_to_home(index, tag, p_num)
+        self.message('request', p_num, None)
+        self.lookup_entry(index, tag, p_num)
 
-        lines = self.cache_lines_from_index(index)
+        lines = self.cache_lines_from_index(index, tag)
+        self.snoop_victims(index, tag, p_num, True)
         local_state = lines[p_num].state
         local_tag = lines[p_num].tag
 
         sharers = self.get_sharers(lines, tag, p_num)
+        if self.migratory_detection:
+            self.detect_migratory(index, tag, p_num, sharers, local_state == CacheState.SHARED and local_tag == tag)
 
         if self.verbose:
             self.print_lines(index)
@@ -158,22 +450,28 @@ class MESIDirectory:
             # Send message to closest sharer to invalidate the line (and forward the data)
             if self.verbose:
                 print("Send message to closest sharer to invalidate the data.")
-            self.stats.hop_between_processor_and_directory()
+            self.hop_from_home(closest)
             self.stats.cache_probe()
             #self.stats.cache_access()
 
+            # Whether the closest sharer forwards the block, both for its latency and for the message it sends.
+            forward = local_state == CacheState.INVALID
             for s in sharers:
                 # TODO: Change to local
-                self.invalidate_processor(s, index)
-                if s == closest and local_state == CacheState.INVALID:
+                self.invalidate_processor(s, self.slot_of(s, index))
+                self.message('invalidation', None, s)
+                # The closest sharer sends the data if the requester's line is invalid, the others just ack.
+                self.message('data' if s == closest and forward else 'ack', s, p_num)
+                if s == closest and forward:
                     if self.verbose:
                         print("Forward data from P{} since local state was I.".format(s))
                     if len(sharers) == 1:
                         self.stats.cache_access()
 
-            # Send requester how many acknowledgements to expect. Currently not simulated.
+            # Send requester how many acknowledgements to expect, it does not add to the latency.
             if self.verbose:
                 print("Send P{} how many acknowledgements to expect.".format(p_num))
+            self.message('ack', None, p_num)
 
             if self.verbose:
                 print("Send acknowledgement from other sharers.")
@@ -187,18 +485,21 @@ class MESIDirectory:
             # There are no sharers, you can just write
             if self.verbose:
                 print("There are no sharers, cache is free to just write.")
-            self.stats.hop_between_processor_and_directory()
+            self.hop_from_home(p_num)
+            self.message('ack', None, p_num)
 
         else:
             # This is if there were no sharers in the first place, and the cache line was invalid
             if self.verbose:
                 print("No sharers, must contact memory.")
-            self.stats.memory_access_latency()
-            self.stats.access_type = AccessType.OFF_CHIP
-            self.stats.hop_between_processor_and_directory()
+            self.fetch_block(index, tag, p_num)
 
         # Update directory sharers
         lines[p_num] = CacheLine(CacheState.MODIFIED, tag)
+        self.add_sharer(p_num, True)
+        if self.llc is not None:
+            # The LLC copy is stale from now on, it is written back when the LLC evicts it.
+            self.llc.mark_dirty(self.block_of(index, tag))
 
         for s in sharers:
             lines[s] = CacheLine(CacheState.INVALID, None)
@@ -0,0 +1,161 @@
+from cache import CacheLine, CacheState, decode_address, select_line
+from flight_recorder import EventType
+from stats import AccessType
+
+PREDICTORS = ['next-line', 'stride', 'stream']
+
+
+class NextLinePredictor:
+    # Predicts the degree blocks following the one missed on.
+    def __init__(self, degree=1):
+        self.degree = degree
+
+    def predict(self, block):
+        return [block + k for k in range(1, self.degree + 1)]
+
+
+class StridePredictor:
+    # Address stream table without PCs: streams are told apart by the region of 2 ** region_bits blocks they fall
+    # in. An entry holds the last block and the stride between the last two blocks of its region, once the same
+    # stride is seen twice in a row the next degree blocks along it are predicted. The table keeps the
+    # table_size most recently used regions.
+    def __init__(self, degree=1, table_size=16, region_bits=6):
+        self.degree = degree
+        self.table_size = table_size
+        self.region_bits = region_bits
+        self.table = {}
+
+    def predict(self, block):
+        region = block >> self.region_bits
+        entry = self.table.pop(region, None)
+        if entry is None:
+            if len(self.table) >= self.table_size:
+                del self.table[next(iter(self.table))]
+            self.table[region] = [block, 0]
+            return []
+        # Re-inserted so the dict stays in least recently used order.
+        self.table[region] = entry
+        stride = block - entry[0]
+        entry[0] = block
+        if stride == 0:
+            return []
+        if stride != entry[1]:
+            entry[1] = stride
+            return []
+        return [block + stride * k for k in range(1, self.degree + 1) if block + stride * k >= 0]
+
+
+class StreamBufferPredictor:
+    # Stream buffers that each run degree blocks ahead of an ascending stream. A block a buffer expects next
+    # advances it by one block, any other block (re)allocates the least recently used buffer to a new stream
+    # starting after it.
+    def __init__(self, degree=4, buffers=4):
+        self.degree = degree
+        self.buffers = buffers
+        # Next expected block -> last block fetched for that stream, oldest stream first.
+        self.streams = {}
+
+    def predict(self, block):
+        end = self.streams.pop(block, None)
+        if end is None:
+            if len(self.streams) >= self.buffers:
+                del self.streams[next(iter(self.streams))]
+            self.streams[block + 1] = block + self.degree
+            return [block + k for k in range(1, self.degree + 1)]
+        self.streams[block + 1] = block + self.degree
+        return list(range(end + 1, block + self.degree + 1))
+
+
+def make_predictor(name, degree=1):
+    if name == 'next-line':
+        return NextLinePredictor(degree)
+    elif name == 'stride':
+        return StridePredictor(degree)
+    elif name == 'stream':
+        return StreamBufferPredictor(degree)
+    raise Exception('Prefetcher \'{}\' is not accepted. Must be one of {}.'.format(name, ', '.join(PREDICTORS)))
+
+
+class Prefetcher:
+    # Prefetch stage of one cache. After a read miss, or the first use of a prefetched line, the predictor is
+    # asked for the blocks to fetch next and each one not already cached is requested from the directory like a
+    # read miss and filled into the cache. Prefetch cycles are counted in the stats' prefetch counters, never
+    # in the latency of the access that triggered them.
+    # A prefetch is useful when the line is used by the processor before it leaves the cache, and harmful when
+    # the line it replaced is missed on (and not found in a victim cache) before the slot is used again.
+    def __init__(self, cache, predictor):
+        self.cache = cache
+        self.predictor = predictor
+        # Slot -> (tag, cycles) of prefetched lines not used yet.
+        self.prefetched = {}
+        # Slot -> tag of the valid line a prefetch replaced.
+        self.replaced = {}
+
+    def demand(self, index, tag):
+        # Called on every access with the line it maps to. Returns True on the first use of a prefetched line.
+        stats = self.cache.stats
+        used = False
+        entry = self.prefetched.pop(index, None)
+        if entry is not None and entry[0] == tag and self.cache.cache_lines[index].tag == tag:
+            stats.prefetches_useful += 1
+            stats.prefetch_hidden_cycles += entry[1]
+            used = True
+        if self.replaced.pop(index, None) == tag and self.cache.cache_lines[index].tag != tag:
+            stats.prefetches_harmful += 1
+        return used
+
+    def trigger(self, address):
+        cache = self.cache
+        offset, demand_set, demand_tag = decode_address(address, cache.block_size, cache.no_sets)
+        for block in self.predictor.predict(address // cache.block_size):
+            self.issue(block, demand_set, demand_tag)
+
+    def issue(self, block, demand_set, demand_tag):
+        cache = self.cache
+        stats = cache.stats
+        offset, set_index, tag = decode_address(block * cache.block_size, cache.block_size, cache.no_sets)
+        base = set_index * cache.ways
+        for slot in range(base, base + cache.ways):
+            if cache.cache_lines[slot].tag == tag:
+                return
+        if cache.victim_cache is not None and block in cache.victim_cache.lines:
+            return
+        if cache.ways > 1:
+            slot = select_line(cache.cache_lines, cache.policy, set_index, tag, cache.ways)
+        else:
+            slot = set_index
+        line = cache.cache_lines[slot]
+        if set_index == demand_set and line.tag == demand_tag:
+            # Never replace the line just fetched for the processor.
+            return
+
+        if line.state != CacheState.INVALID and cache.victim_cache is not None:
+            cache.victim_cache.insert(slot, line.tag, line.state)
+        elif line.state == CacheState.MODIFIED:
+            stats.replacement_writebacks += 1
+            stats.record(EventType.REPLACEMENT_WRITEBACK, cache.p_num, slot, line.tag)
+            cache.directory.replaced(slot, line.tag, cache.p_num, line.state)
+        elif line.state != CacheState.INVALID:
+            stats.record(EventType.EVICTION, cache.p_num, slot, line.tag)
+            cache.directory.replaced(slot, line.tag, cache.p_num, line.state)
+        if line.state != CacheState.INVALID:
+            self.replaced[slot] = line.tag
+
+        # The directory adds to the current access' cycles and access type, so both are put aside meanwhile.
+        cycles, access_type = stats.cycles, stats.access_type
+        stats.cycles = 0
+        state = cache.directory.read_miss(slot, tag, cache.p_num)
+        if state is None:
+            # The MSI directory always grants S.
+            state = CacheState.SHARED
+        elif state == CacheState.MODIFIED:
+            # A migratory block handed over by the MESI directory.
+            cache.migratory_grants[slot] = tag
+        cache.cache_lines[slot] = CacheLine(state, tag)
+        stats.record(EventType.PREFETCH, cache.p_num, slot, tag, state)
+        stats.prefetches_issued += 1
+        stats.prefetch_cycles += stats.cycles
+        if stats.access_type == AccessType.OFF_CHIP:
+            stats.prefetches_off_chip += 1
+        self.prefetched[slot] = (tag, stats.cycles)
+        stats.cycles, stats.access_type = cycles, access_type
@@ -0,0 +1,48 @@
+import time
+
+
+class HotPathProfiler:
+    # Call counts and cumulative time of the simulator's hot paths. Nothing is changed unless instrument() is
+    # called, it then replaces the methods on the simulator's own objects with timing wrappers, so a simulator
+    # without a profiler runs the plain methods. Times are inclusive, read_miss includes its get_sharers calls.
+    def __init__(self):
+        self.calls = {}
+        self.times = {}
+        self.wall_time = 0
+
+    def wrap(self, name, func):
+        self.calls.setdefault(name, 0)
+        self.times.setdefault(name, 0)
+        calls = self.calls
+        times = self.times
+        clock = time.perf_counter
+
+        def timed(*args):
+            start = clock()
+            result = func(*args)
+            times[name] += clock() - start
+            calls[name] += 1
+            return result
+        return timed
+
+    def instrument(self, simulator):
+        simulator.parse_line = self.wrap('parse_line', simulator.parse_line)
+        for k, c in simulator.caches.items():
+            c.calculate_cache_line = self.wrap('calculate_cache_line', c.calculate_cache_line)
+        directory = simulator.directory
+        directory.read_miss = self.wrap('Directory.read_miss', directory.read_miss)
+        directory.write_miss = self.wrap('Directory.write_miss', directory.write_miss)
+        directory.get_sharers = self.wrap('get_sharers', directory.get_sharers)
+        simulator.stats.save_stats = self.wrap('Stats.save_stats', simulator.stats.save_stats)
+
+    def report(self):
+        st = "PROFILE:\n{:<22} {:>10} {:>12} {:>12} {:>8}\n".format('Component', 'Calls', 'Total (s)', 'Per call (us)',
+                                                                   '% run')
+        for name in sorted(self.calls, key=lambda n: -self.times[n]):
+            calls = self.calls[name]
+            total = self.times[name]
+            st += "{:<22} {:>10} {:>12.4f} {:>12.3f} {:>8.1f}\n".format(
+                name, calls, total, 1e6 * total / calls if calls > 0 else 0,
+                100 * total / self.wall_time if self.wall_time > 0 else 0)
+        st += "Run time: {:.4f}s\n".format(self.wall_time)
+        return st
@@ -0,0 +1,51 @@
+import sys
+import time
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class ProgressReporter:
+    # Reports accesses processed, throughput, share of the trace consumed, ETA and hit rate to stderr.
+    # The simulator only compares the access count against next_check, the clock is read every check_every
+    # accesses and a line is printed once `interval` seconds have passed since the previous one.
+    def __init__(self, stats, interval=5, total_bytes=None, position=None, label=None, check_every=10000,
+                 stream=None):
+        self.stats = stats
+        self.interval = interval
+        self.total_bytes = total_bytes
+        self.position = position
+        self.label = label
+        self.check_every = check_every
+        self.stream = stream if stream is not None else sys.stderr
+        self.next_check = check_every
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def check(self):
+        self.next_check = self.stats.accesses + self.check_every
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now, done=False):
+        elapsed = now - self.start
+        accesses = self.stats.accesses
+        st = '' if self.label is None else '[{}] '.format(self.label)
+        st += '{} accesses | {:.0f} acc/s'.format(accesses, accesses / elapsed if elapsed > 0 else 0)
+        if done:
+            st += ' | done in {}'.format(format_duration(elapsed))
+        elif self.total_bytes and self.position is not None:
+            fraction = min(self.position() / self.total_bytes, 1)
+            st += ' | {:.1f}%'.format(100 * fraction)
+            if fraction > 0:
+                st += ' | ETA {}'.format(format_duration(elapsed / fraction - elapsed))
+        if accesses > 0:
+            st += ' | hit rate {:.4f}'.format(self.stats.hit_rate())
+        print(st, file=self.stream, flush=True)
+
+    def finish(self):
+        self.report(time.perf_counter(), done=True)
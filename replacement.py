@@ -0,0 +1,101 @@
+from array import array
+import random
+
+POLICIES = ['lru', 'plru', 'random', 'fifo']
+
+
+class LRUPolicy:
+    # True LRU. Every touch stamps the way with a running counter, the victim is the way with the oldest stamp.
+    def __init__(self, no_sets, ways):
+        self.ways = ways
+        self.stamps = array('Q', bytes(8 * no_sets * ways))
+        self.clock = 0
+
+    def touch(self, set_index, way):
+        self.clock += 1
+        self.stamps[set_index * self.ways + way] = self.clock
+
+    def fill(self, set_index, way):
+        self.touch(set_index, way)
+
+    def victim(self, set_index):
+        base = set_index * self.ways
+        stamps = self.stamps[base:base + self.ways]
+        return stamps.index(min(stamps))
+
+
+class TreePLRUPolicy:
+    # Tree pseudo-LRU: ways - 1 bits per set arranged as a binary tree, each bit points towards the half that
+    # was used less recently. Ways must be a power of two.
+    def __init__(self, no_sets, ways):
+        if ways & (ways - 1):
+            raise Exception('Tree-PLRU needs a power of two number of ways, not {}.'.format(ways))
+        self.ways = ways
+        self.levels = (ways - 1).bit_length()
+        self.bits = bytearray(no_sets * max(ways - 1, 1))
+
+    def touch(self, set_index, way):
+        base = set_index * (self.ways - 1)
+        node = 0
+        for level in range(self.levels - 1, -1, -1):
+            right = (way >> level) & 1
+            # Point away from the half just used.
+            self.bits[base + node] = 1 - right
+            node = 2 * node + 1 + right
+
+    def fill(self, set_index, way):
+        self.touch(set_index, way)
+
+    def victim(self, set_index):
+        base = set_index * (self.ways - 1)
+        node = 0
+        way = 0
+        for level in range(self.levels):
+            right = self.bits[base + node]
+            way = (way << 1) | right
+            node = 2 * node + 1 + right
+        return way
+
+
+class RandomPolicy:
+    def __init__(self, no_sets, ways, seed=0):
+        self.ways = ways
+        self.rng = random.Random(seed)
+
+    def touch(self, set_index, way):
+        pass
+
+    def fill(self, set_index, way):
+        pass
+
+    def victim(self, set_index):
+        return self.rng.randrange(self.ways)
+
+
+class FIFOPolicy:
+    # Round-robin pointer per set, advanced whenever the way it points at is filled.
+    def __init__(self, no_sets, ways):
+        self.ways = ways
+        self.next = array('H', bytes(2 * no_sets))
+
+    def touch(self, set_index, way):
+        pass
+
+    def fill(self, set_index, way):
+        if self.next[set_index] == way:
+            self.next[set_index] = (way + 1) % self.ways
+
+    def victim(self, set_index):
+        return self.next[set_index]
+
+
+def make_policy(name, no_sets, ways, seed=0):
+    if name == 'lru':
+        return LRUPolicy(no_sets, ways)
+    elif name == 'plru':
+        return TreePLRUPolicy(no_sets, ways)
+    elif name == 'random':
+        return RandomPolicy(no_sets, ways, seed)
+    elif name == 'fifo':
+        return FIFOPolicy(no_sets, ways)
+    raise Exception('Replacement policy \'{}\' is not accepted. Must be one of {}.'.format(name, ', '.join(POLICIES)))
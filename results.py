@@ -0,0 +1,211 @@
+from os import path
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+
+
+def trace_hash(filename):
+    # Short content hash, so runs of a trace that was regenerated under the same name are told apart.
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def column_type(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    return 'str'
+
+
+def parse_value(value, kind):
+    if value == '':
+        return None
+    if kind == 'bool':
+        return value == 'True'
+    if kind == 'int':
+        return int(value)
+    if kind == 'float':
+        return float(value)
+    return value
+
+
+class ResultsStore:
+    # One row per run in a CSV file, with the column types in a JSON schema next to it (<file>.schema.json).
+    # Rows are appended; a run with columns the file does not have yet (a feature used for the first time)
+    # rewrites it once with the wider header, older rows leaving the new columns empty.
+    def __init__(self, filename):
+        self.filename = filename
+        self.schema_filename = filename + '.schema.json'
+        self.schema = {}
+        if path.exists(self.schema_filename):
+            with open(self.schema_filename, 'r') as f:
+                self.schema = json.load(f)
+
+    def columns(self):
+        return list(self.schema)
+
+    def read(self):
+        if not path.exists(self.filename):
+            return []
+        with open(self.filename, 'r', newline='') as f:
+            return [{name: parse_value(value, self.schema.get(name, 'str')) for name, value in row.items()}
+                    for row in csv.DictReader(f)]
+
+    def append(self, row):
+        # Numbers the run and adds it, returns the run number.
+        rows = self.read()
+        row = dict(run=len(rows) + 1, **row)
+        widened = False
+        for name, value in row.items():
+            # Unset options (no prefetcher, no home policy) are None, the columns they belong to hold text.
+            kind = 'str' if value is None else column_type(value)
+            if name not in self.schema:
+                self.schema[name] = kind
+                widened = True
+            elif self.schema[name] != kind and {self.schema[name], kind} == {'int', 'float'}:
+                self.schema[name] = 'float'
+                widened = True
+        if widened or not path.exists(self.filename):
+            self.write(rows + [row])
+        else:
+            with open(self.filename, 'a', newline='') as f:
+                csv.DictWriter(f, self.columns()).writerow(row)
+        return row['run']
+
+    def write(self, rows):
+        # The schema and the data are both replaced atomically, the schema first so it always covers the data.
+        with open(self.schema_filename + '.tmp', 'w') as f:
+            json.dump(self.schema, f, indent=1)
+        os.replace(self.schema_filename + '.tmp', self.schema_filename)
+        with open(self.filename + '.tmp', 'w', newline='') as f:
+            writer = csv.DictWriter(f, self.columns())
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(self.filename + '.tmp', self.filename)
+
+
+def run_row(sim, trace, runtime):
+    # The row of one finished simulation of the trace file.
+    accesses = sim.stats.accesses
+    row = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'trace': path.basename(trace),
+           'trace_hash': trace_hash(trace), 'runtime_seconds': runtime,
+           'accesses_per_second': accesses / runtime if runtime > 0 else 0.0}
+    row.update(sim.config)
+    row.update(sim.stats.metrics(sim.per_processor))
+    return row
+
+
+def select(rows, where):
+    # where holds column=value filters, values compared as text.
+    for condition in where:
+        name, value = condition.split('=', 1)
+        rows = [r for r in rows if str(r.get(name)) == value]
+    return rows
+
+
+def find_run(rows, run):
+    for row in rows:
+        if row['run'] == run:
+            return row
+    raise Exception('No run {} in the results.'.format(run))
+
+
+def diff_runs(a, b, all_columns=False):
+    # Lines of the columns whose values differ between runs a and b (every column with all_columns), with the
+    # change for numbers.
+    lines = ['{:<36} {:>20} {:>20} {:>14}'.format('Column', 'Run {}'.format(a['run']), 'Run {}'.format(b['run']),
+                                                   'Change')]
+    names = list(a) + [name for name in b if name not in a]
+    for name in names:
+        if name in ('run', 'timestamp'):
+            continue
+        va, vb = a.get(name), b.get(name)
+        if va == vb and not all_columns:
+            continue
+        change = ''
+        if isinstance(va, (int, float)) and isinstance(vb, (int, float)) and not isinstance(va, bool):
+            change = '{:+.4g}'.format(vb - va)
+            if va != 0:
+                change += ' ({:+.1f}%)'.format(100 * (vb - va) / va)
+        lines.append('{:<36} {:>20} {:>20} {:>14}'.format(name, str(va), str(vb), change))
+    return lines
+
+
+def sweep(rows, x, y):
+    # Average of y for every value of x, sorted by x.
+    groups = {}
+    for row in rows:
+        if row.get(x) is None or row.get(y) is None:
+            continue
+        groups.setdefault(row[x], []).append(row[y])
+    return sorted((value, sum(ys) / len(ys), len(ys)) for value, ys in groups.items())
+
+
+def bar_chart(points):
+    top = max((mean for value, mean, count in points), default=0)
+    return ['{:>12} {:>14.4f} {:>5} {}'.format(str(value), mean, count, '#' * int(40 * mean / top) if top > 0 else '')
+            for value, mean, count in points]
+
+
+def plot_sweep(points, x, y, output):
+    # matplotlib is only needed for plots saved to a file.
+    try:
+        import matplotlib
+    except ImportError:
+        raise Exception('Saving a plot needs matplotlib, leave out --plot for a text chart.')
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.plot([str(value) for value, mean, count in points], [mean for value, mean, count in points], marker='o')
+    plt.xlabel(x)
+    plt.ylabel(y)
+    plt.savefig(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the results store written with --results.")
+    parser.add_argument('file', help="Results CSV file.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    listing = commands.add_parser('list', help="One line per run.")
+    listing.add_argument('--where', action='append', default=[], metavar='COLUMN=VALUE')
+    listing.add_argument('--columns', default='trace,protocol,Average-latency,Total-latency,accesses_per_second',
+                         help="Comma separated columns to show.")
+    diff = commands.add_parser('diff', help="Compare two runs.")
+    diff.add_argument('a', type=int, help="First run number.")
+    diff.add_argument('b', type=int, help="Second run number.")
+    diff.add_argument('--all', action='store_true', help="Also show the columns that are equal.")
+    sweeping = commands.add_parser('sweep', help="A metric across the values of a configuration column.")
+    sweeping.add_argument('x', help="Configuration column, e.g. ways.")
+    sweeping.add_argument('y', help="Metric column, e.g. Average-latency.")
+    sweeping.add_argument('--where', action='append', default=[], metavar='COLUMN=VALUE')
+    sweeping.add_argument('--plot', metavar='FILE', help="Save a plot (needs matplotlib).")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.file)
+    rows = store.read()
+    if args.command == 'list':
+        columns = args.columns.split(',')
+        print(' '.join('{:>20}'.format(c) for c in ['run'] + columns))
+        for row in select(rows, args.where):
+            print(' '.join('{:>20}'.format(str(row.get(c))) for c in ['run'] + columns))
+    elif args.command == 'diff':
+        print('\n'.join(diff_runs(find_run(rows, args.a), find_run(rows, args.b), args.all)))
+    else:
+        points = sweep(select(rows, args.where), args.x, args.y)
+        if not points:
+            print('No runs have both {} and {}.'.format(args.x, args.y), file=sys.stderr)
+            exit(1)
+        print('{:>12} {:>14} {:>5}'.format(args.x, args.y, 'runs'))
+        print('\n'.join(bar_chart(points)))
+        if args.plot is not None:
+            plot_sweep(points, args.x, args.y, args.plot)
+            print('Plot written to {}.'.format(args.plot))
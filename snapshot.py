@@ -0,0 +1,141 @@
+from array import array
+from cache import CacheState
+import argparse
+import struct
+import sys
+
+# File header: magic, format version, number of processors and lines per cache.
+HEADER = struct.Struct('<4sHHI')
+MAGIC = b'CSNP'
+VERSION = 1
+# Every snapshot starts with the access count it was taken at, its kind and, for a diff, the lines changed.
+RECORD = struct.Struct('<QBI')
+FULL = 0
+DIFF = 1
+# A changed line: processor, line, state, tag.
+CHANGE = struct.Struct('<HIBq')
+# Tag stored for lines that never held a block.
+NO_TAG = -1
+
+
+def cache_arrays(cache):
+    # States (CacheState values) and tags of every line of a cache as flat arrays.
+    states = bytes([line.state.value for line in cache.cache_lines])
+    tags = array('q', [NO_TAG if line.tag is None else line.tag for line in cache.cache_lines])
+    return states, tags
+
+
+def tag_bytes(tags):
+    if sys.byteorder != 'little':
+        tags = array('q', tags)
+        tags.byteswap()
+    return tags.tobytes()
+
+
+class SnapshotWriter:
+    # Writes the cache tables at every 'p' command as packed state and tag arrays instead of text. In diff mode
+    # only the first snapshot is complete, every later one lists the lines changed since the previous one.
+    # render_snapshot turns them back into the text 'p' prints.
+    def __init__(self, caches, filename, diff=False):
+        self.caches = sorted(caches.values(), key=lambda c: c.p_num)
+        self.filename = filename
+        self.diff = diff
+        self.file = None
+        self.previous = None
+        self.snapshots = 0
+
+    def write(self, accesses):
+        if self.file is None:
+            self.file = open(self.filename, 'wb')
+            self.file.write(HEADER.pack(MAGIC, VERSION, len(self.caches), len(self.caches[0].cache_lines)))
+        current = [cache_arrays(cache) for cache in self.caches]
+        if not self.diff or self.previous is None:
+            self.file.write(RECORD.pack(accesses, FULL, 0))
+            for states, tags in current:
+                self.file.write(states)
+                self.file.write(tag_bytes(tags))
+        else:
+            changes = []
+            for p, ((states, tags), (old_states, old_tags)) in enumerate(zip(current, self.previous)):
+                if states == old_states and tags == old_tags:
+                    continue
+                for i in range(len(states)):
+                    if states[i] != old_states[i] or tags[i] != old_tags[i]:
+                        changes.append(CHANGE.pack(p, i, states[i], tags[i]))
+            self.file.write(RECORD.pack(accesses, DIFF, len(changes)))
+            self.file.write(b''.join(changes))
+        self.previous = current
+        self.snapshots += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_snapshots(filename):
+    # Yields (accesses, states, tags, changed) for every snapshot, states and tags being the complete tables of
+    # every processor with the diffs applied, changed the (processor, line) pairs a diff listed (None for a full
+    # snapshot). The arrays are reused from one snapshot to the next.
+    with open(filename, 'rb') as f:
+        magic, version, no_processors, no_lines = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise Exception('{} is not a version {} snapshot file.'.format(filename, VERSION))
+        states = [bytearray(no_lines) for p in range(no_processors)]
+        tags = [array('q') for p in range(no_processors)]
+        while True:
+            record = f.read(RECORD.size)
+            if not record:
+                return
+            accesses, kind, count = RECORD.unpack(record)
+            if kind == FULL:
+                for p in range(no_processors):
+                    states[p][:] = f.read(no_lines)
+                    tags[p] = array('q')
+                    tags[p].frombytes(f.read(8 * no_lines))
+                    if sys.byteorder != 'little':
+                        tags[p].byteswap()
+                changed = None
+            else:
+                changed = []
+                for p, i, state, tag in CHANGE.iter_unpack(f.read(CHANGE.size * count)):
+                    states[p][i] = state
+                    tags[p][i] = tag
+                    changed.append((p, i))
+            yield accesses, states, tags, changed
+
+
+def format_line(i, state, tag):
+    return 'Idx: {} Tag: {}. State: {}.\n'.format(i, None if tag == NO_TAG else tag, CacheState(state))
+
+
+def render_snapshot(states, tags):
+    # The text the 'p' command prints for the cache tables.
+    st = '\nCACHE TABLES:\n\n'
+    for p in range(len(states)):
+        st += '----P{}----\n\n'.format(p)
+        st += ''.join(format_line(i, state, tags[p][i]) for i, state in enumerate(states[p])
+                      if state != CacheState.INVALID.value)
+        st += '\n'
+    return st + '==========\n\n'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the cache table snapshots written with --snapshots as the "
+                                                 "text the 'p' command prints.")
+    parser.add_argument('file', help="Snapshot file.")
+    parser.add_argument('--snapshot', type=int, action='append', metavar='K',
+                        help="Only render the K-th snapshot (from 0). Can be repeated.")
+    parser.add_argument('--changes', action='store_true',
+                        help="For diff snapshots, only list the lines that changed.")
+    args = parser.parse_args()
+
+    for k, (accesses, states, tags, changed) in enumerate(read_snapshots(args.file)):
+        if args.snapshot is not None and k not in args.snapshot:
+            continue
+        if args.changes and changed is not None:
+            print('Snapshot {} after {} accesses, {} lines changed:'.format(k, accesses, len(changed)))
+            for p, i in changed:
+                print('P{} {}'.format(p, format_line(i, states[p][i], tags[p][i])), end='')
+        else:
+            print(render_snapshot(states, tags), end='')
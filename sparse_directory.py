@@ -0,0 +1,81 @@
+from replacement import make_policy
+
+
+class SparseDirectory:
+    # Finite set-associative store of directory entries in front of the directory's per-line state, which stays
+    # the full map it always was. A block needs an entry to be tracked, so every request looks its block up and
+    # allocates one on a miss, replacing an entry of the same set with one of the replacement.py policies.
+    # Every entry keeps a sharer bit vector, set when the directory hands the block to a processor and cleared
+    # when it invalidates it. Caches replace lines silently unless eviction notifications are enabled, so the bits
+    # can still be set for processors that dropped the block. Replacing an entry invalidates all processors with
+    # their bit set (see Directory.evict_entry).
+    def __init__(self, stats, entries=1024, ways=8, replacement='lru'):
+        if entries % ways != 0:
+            raise Exception('Directory of {} entries cannot be split into {}-way sets.'.format(entries, ways))
+        self.stats = stats
+        self.ways = ways
+        self.no_sets = entries // ways
+        self.blocks = [None] * entries
+        self.sharers = [0] * entries
+        # Bits cleared by eviction notifications that would still be set without them.
+        self.notified = [0] * entries
+        self.policy = make_policy(replacement, self.no_sets, ways)
+
+    def find(self, block):
+        base = (block % self.no_sets) * self.ways
+        for entry in range(base, base + self.ways):
+            if self.blocks[entry] == block:
+                return entry
+        return None
+
+    def lookup(self, block):
+        # Returns the entry of the block, allocated if it had none, with the block and sharer vector of the entry
+        # replaced to make room (None and 0 if nothing was).
+        set_index = block % self.no_sets
+        base = set_index * self.ways
+        entry = self.find(block)
+        if entry is not None:
+            self.policy.touch(set_index, entry - base)
+            self.stats.directory_entry_hits += 1
+            return entry, None, 0
+
+        self.stats.directory_entry_misses += 1
+        for way in range(self.ways):
+            if self.blocks[base + way] is None:
+                break
+        else:
+            way = self.policy.victim(set_index)
+        entry = base + way
+        victim, sharers = self.blocks[entry], self.sharers[entry]
+        if victim is not None:
+            self.stats.spurious_invalidations_avoided += bin(self.notified[entry]).count('1')
+        self.blocks[entry] = block
+        self.sharers[entry] = 0
+        self.notified[entry] = 0
+        self.policy.fill(set_index, way)
+        return entry, victim, sharers
+
+    def add_sharer(self, entry, p, exclusive=False):
+        # p was given the block, an exclusive grant invalidated every other copy.
+        if exclusive:
+            self.sharers[entry] = 1 << p
+            self.notified[entry] = 0
+        else:
+            self.sharers[entry] |= 1 << p
+            self.notified[entry] &= ~(1 << p)
+
+    def remove_sharer(self, block, p):
+        # p replaced its copy of the block and notified the directory.
+        entry = self.find(block)
+        if entry is not None and self.sharers[entry] >> p & 1:
+            self.sharers[entry] &= ~(1 << p)
+            self.notified[entry] |= 1 << p
+            self.stats.stale_sharers_cleared += 1
+
+    def free(self, block):
+        # No copy of the block is left anywhere.
+        entry = self.find(block)
+        if entry is not None:
+            self.blocks[entry] = None
+            self.sharers[entry] = 0
+            self.notified[entry] = 0
@@ -1,5 +1,7 @@
 from enum import Enum
 from os import path
+import os
+from flight_recorder import FlightRecorder, format_event
 
 
 class AccessType(Enum):
@@ -11,25 +13,139 @@ class AccessType(Enum):
     PRIVATE = 0
     REMOTE = 1
     OFF_CHIP = 2
+    LLC = 3
+
+
+class ProcessorStats:
+    # Access counts and cycle sums of a single processor, split by access type, plus a latency histogram with one
+    # bucket per cycle count. Latencies of max_latency cycles or more share the last bucket.
+    def __init__(self, max_latency=128):
+        self.counts = [0] * len(AccessType)
+        self.cycles = [0] * len(AccessType)
+        self.max_latency = max_latency
+        self.histogram = [0] * (max_latency + 1)
+        self.max_cycles = 0
+
+    def save(self, access_type, cycles):
+        self.counts[access_type.value] += 1
+        self.cycles[access_type.value] += cycles
+        self.histogram[cycles if cycles < self.max_latency else self.max_latency] += 1
+        if cycles > self.max_cycles:
+            self.max_cycles = cycles
+
+    def accesses(self):
+        return sum(self.counts)
+
+    def average_latency(self, access_type=None):
+        if access_type is None:
+            accesses = self.accesses()
+            return sum(self.cycles) / accesses if accesses > 0 else 0
+        count = self.counts[access_type.value]
+        return self.cycles[access_type.value] / count if count > 0 else 0
+
+    def percentile(self, q):
+        # Smallest latency such that at least q percent of the accesses took at most that many cycles.
+        accesses = self.accesses()
+        if accesses == 0:
+            return 0
+        target = q / 100 * accesses
+        seen = 0
+        for cycles, count in enumerate(self.histogram):
+            seen += count
+            if seen >= target and count > 0:
+                return cycles if cycles < self.max_latency else self.max_cycles
+        return self.max_cycles
 
 
 class Stats:
     # Class to track the statistics of the cache simulator.
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, recorder_size=256, keep_latencies=True):
         self.cycles = 0
         self.verbose = verbose
+        self.accesses = 0
+        self.recorder = FlightRecorder(recorder_size)
+        # Event types to print for the current access, set by a trace filter.
+        self.trace_events = None
+        self.processor_stats = {}
+        # Other consumers of coherence events, they share the flight recorder's record() signature.
+        self.listeners = []
+        # Access count and cycle sum per access type, what the reports are computed from.
+        self.access_counts = [0] * len(AccessType)
+        self.access_cycles = [0] * len(AccessType)
+        # The latency of every access by type, only kept with keep_latencies as it grows with the trace.
+        self.keep_latencies = keep_latencies
         self.cycle_dict = {AccessType.PRIVATE: [],
                            AccessType.REMOTE: [],
-                           AccessType.OFF_CHIP: []}
+                           AccessType.OFF_CHIP: [],
+                           AccessType.LLC: []}
         self.invalidations_sent = 0
         self.replacement_writebacks = 0
         self.coherence_writebacks = 0
         self.access_type = AccessType.PRIVATE
+        # Prefetch counters, reported when a prefetcher is attached to the caches.
+        self.prefetching = False
+        self.prefetches_issued = 0
+        self.prefetches_useful = 0
+        self.prefetches_harmful = 0
+        self.prefetches_off_chip = 0
+        self.prefetch_cycles = 0
+        self.prefetch_hidden_cycles = 0
+        # Shared LLC counters, one lookup count per bank once an LLC is attached.
+        self.llc_bank_lookups = []
+        self.llc_hits = 0
+        self.llc_misses = 0
+        self.llc_writebacks = 0
+        self.llc_back_invalidations = 0
+        # Victim cache counters, reported when victim caches are attached.
+        self.victim_caching = False
+        self.victim_hits = 0
+        self.victim_saved_writebacks = 0
+        # Migratory sharing counters (MESI), reported when detection is enabled.
+        self.migratory = False
+        self.migratory_detections = 0
+        self.migratory_grants = 0
+        self.migratory_upgrades_avoided = 0
+        self.migratory_demotions = 0
+        # Distributed directory counters, one request count per home node once the directory is sliced.
+        self.home_requests = []
+        self.local_home_requests = 0
+        # Sparse directory counters, reported when the directory has a finite number of entries.
+        self.sparse_directory = False
+        self.directory_entry_hits = 0
+        self.directory_entry_misses = 0
+        self.directory_evictions = 0
+        self.directory_eviction_invalidations = 0
+        self.directory_eviction_lines = 0
+        self.directory_eviction_writebacks = 0
+        self.directory_eviction_cycles = 0
+        # Discrete-event timing results, one entry per processor once the timing engine is attached.
+        self.finish_times = []
+        self.busy_cycles = []
+        self.stall_cycles = []
+        self.queueing_cycles = []
+        self.execution_time = 0
+        self.timing_events = 0
+        # Eviction notification counters: clean hints are extra messages, dirty notices ride on the writeback.
+        self.eviction_notifications = False
+        self.eviction_hints = 0
+        self.eviction_writeback_notices = 0
+        self.stale_sharers_cleared = 0
+        self.spurious_invalidations_avoided = 0
+        # Interconnect traffic by message type, processor and link, once traffic accounting is attached.
+        self.messages = {}
+        self.message_bytes = {}
+        self.messages_sent = []
+        self.bytes_sent = []
+        self.bytes_received = []
+        self.link_bytes = {}
+        self.link_cycles = {}
+        self.link_width = 0
+        # Cross-check counters, the number of sampled indexes is set once a cross-check is attached.
+        self.cross_check_indexes = 0
+        self.cross_checked = 0
 
     def hit_rate(self):
-        return len(self.cycle_dict[AccessType.PRIVATE]) / len(self.cycle_dict[AccessType.PRIVATE] +
-                                                              self.cycle_dict[AccessType.REMOTE] +
-                                                              self.cycle_dict[AccessType.OFF_CHIP])
+        return self.access_counts[AccessType.PRIVATE.value] / sum(self.access_counts)
 
     def reset(self):
         self.cycles = 0
@@ -37,8 +153,26 @@ class Stats:
         if self.verbose:
             print("\n")
 
-    def save_stats(self):
-        self.cycle_dict[self.access_type].append(self.cycles)
+    def save_stats(self, p_num=None):
+        self.access_counts[self.access_type.value] += 1
+        self.access_cycles[self.access_type.value] += self.cycles
+        if self.keep_latencies:
+            self.cycle_dict[self.access_type].append(self.cycles)
+        self.accesses += 1
+        if p_num is not None:
+            processor = self.processor_stats.get(p_num)
+            if processor is None:
+                processor = self.processor_stats[p_num] = ProcessorStats()
+            processor.save(self.access_type, self.cycles)
+
+    def record(self, event_type, p_num, index, tag, state=None):
+        # Coherence events go to the always-on flight recorder, stamped with the access number and the cycles
+        # spent on the current access so far.
+        self.recorder.record(self.accesses, event_type, p_num, index, tag, state, self.cycles)
+        for listener in self.listeners:
+            listener.record(self.accesses, event_type, p_num, index, tag, state, self.cycles)
+        if self.trace_events is not None and event_type in self.trace_events:
+            print(format_event((self.accesses, event_type, p_num, index, tag, state, self.cycles)))
 
     def cache_probe(self):
         # Tag and state access.
@@ -72,37 +206,205 @@ class Stats:
             print("Hop between processor and directory. (5)")
         self.cycles += 5
 
+    def victim_cache_access(self, cycles):
+        if self.verbose:
+            print("Victim cache access. ({})".format(cycles))
+        self.cycles += cycles
+
+    def llc_access(self):
+        if self.verbose:
+            print("Access LLC. (5)")
+        self.cycles += 5
+
     def memory_access_latency(self):
         if self.verbose:
             print("Access memory. (15)")
         self.cycles += 15
 
-    def final_stats(self, filename, to_file=False):
-        private_accesses = len(self.cycle_dict.get(AccessType.PRIVATE))
-        remote_accesses = len(self.cycle_dict[AccessType.REMOTE])
-        off_chip_accesses = len(self.cycle_dict[AccessType.OFF_CHIP])
-        total_accesses = private_accesses + remote_accesses + off_chip_accesses
-        replacement_writebacks = self.replacement_writebacks
-        coherence_writebacks = self.coherence_writebacks
-        invalidations_sent = self.invalidations_sent
-        private_access_latency = (sum(self.cycle_dict[AccessType.PRIVATE]) / private_accesses) if private_accesses > 0 else 0
-        remote_access_latency = (sum(self.cycle_dict[AccessType.REMOTE]) / remote_accesses) if remote_accesses > 0 else 0
-        off_chip_access_latency = (sum(self.cycle_dict[AccessType.OFF_CHIP]) / off_chip_accesses) if off_chip_accesses > 0 else 0
-        total_latency = sum(self.cycle_dict[AccessType.PRIVATE]) + sum(self.cycle_dict[AccessType.REMOTE]) + sum(self.cycle_dict[AccessType.OFF_CHIP])
-        average_latency = total_latency / total_accesses
-
-        st = "Private-accesses: {}\nRemote-accesses: {}\nOff-chip-accesses: {}\nTotal-accesses: {}" \
-               "\nReplacement-writebacks: {}\nCoherence-writebacks: {}\nInvalidations-sent: {}\nAverage-latency: {}" \
-               "\nPriv-average-latency: {}\nRem-average-latency: {}\nOff-chip-average-latency: {}" \
-               "\nTotal-latency: {}".format(private_accesses, remote_accesses, off_chip_accesses, total_accesses,
-                                            replacement_writebacks, coherence_writebacks, invalidations_sent,
-                                            average_latency, private_access_latency, remote_access_latency,
-                                            off_chip_access_latency, total_latency)
+    def processor_breakdown(self):
+        metrics = {}
+        for p_num in sorted(self.processor_stats):
+            processor = self.processor_stats[p_num]
+            name = 'P{}-'.format(p_num)
+            metrics[name + 'private-accesses'] = processor.counts[AccessType.PRIVATE.value]
+            metrics[name + 'remote-accesses'] = processor.counts[AccessType.REMOTE.value]
+            metrics[name + 'off-chip-accesses'] = processor.counts[AccessType.OFF_CHIP.value]
+            metrics[name + 'average-latency'] = processor.average_latency()
+            metrics[name + 'priv-average-latency'] = processor.average_latency(AccessType.PRIVATE)
+            metrics[name + 'rem-average-latency'] = processor.average_latency(AccessType.REMOTE)
+            metrics[name + 'off-chip-average-latency'] = processor.average_latency(AccessType.OFF_CHIP)
+            metrics[name + 'p50-latency'] = processor.percentile(50)
+            metrics[name + 'p99-latency'] = processor.percentile(99)
+            metrics[name + 'max-latency'] = processor.max_cycles
+        return metrics
+
+    def llc_breakdown(self):
+        # LLC-accesses are the processor accesses served by the LLC, hits and misses count every lookup,
+        # prefetches included.
+        llc_accesses = self.access_counts[AccessType.LLC.value]
+        lookups = self.llc_hits + self.llc_misses
+        metrics = {'LLC-accesses': llc_accesses,
+                   'LLC-average-latency':
+                       self.access_cycles[AccessType.LLC.value] / llc_accesses if llc_accesses > 0 else 0,
+                   'LLC-hits': self.llc_hits,
+                   'LLC-misses': self.llc_misses,
+                   'LLC-hit-rate': self.llc_hits / lookups if lookups > 0 else 0,
+                   'LLC-writebacks': self.llc_writebacks,
+                   'LLC-back-invalidations': self.llc_back_invalidations}
+        for bank, count in enumerate(self.llc_bank_lookups):
+            metrics['LLC-bank-{}-lookups'.format(bank)] = count
+        return metrics
+
+    def migratory_breakdown(self):
+        # Grants are read misses answered in M, an upgrade is avoided when the write that follows hits privately.
+        return {'Migratory-blocks-detected': self.migratory_detections,
+                'Migratory-grants': self.migratory_grants,
+                'Migratory-upgrades-avoided': self.migratory_upgrades_avoided,
+                'Migratory-demotions': self.migratory_demotions}
+
+    def home_breakdown(self):
+        # Requests are directory requests by home node, local ones were made by the home node itself and did not
+        # cross the ring.
+        requests = sum(self.home_requests)
+        metrics = {'Home-requests': requests,
+                   'Local-home-requests': self.local_home_requests,
+                   'Local-home-rate': self.local_home_requests / requests if requests > 0 else 0}
+        for node, count in enumerate(self.home_requests):
+            metrics['Home-P{}-requests'.format(node)] = count
+        return metrics
+
+    def directory_breakdown(self):
+        # Eviction invalidations are the messages sent (also counted in Invalidations-sent), lines lost are the
+        # copies they actually destroyed, cycles are what evictions added to the requests that caused them.
+        lookups = self.directory_entry_hits + self.directory_entry_misses
+        return {'Directory-entry-hits': self.directory_entry_hits,
+                'Directory-entry-misses': self.directory_entry_misses,
+                'Directory-entry-hit-rate': self.directory_entry_hits / lookups if lookups > 0 else 0,
+                'Directory-evictions': self.directory_evictions,
+                'Directory-eviction-invalidations': self.directory_eviction_invalidations,
+                'Directory-eviction-lines-lost': self.directory_eviction_lines,
+                'Directory-eviction-writebacks': self.directory_eviction_writebacks,
+                'Directory-eviction-latency': self.directory_eviction_cycles}
+
+    def notification_breakdown(self):
+        # Stale sharers cleared are sparse directory bits of processors that had dropped the block, invalidations
+        # avoided the ones replacing an entry would have sent them.
+        return {'Eviction-hints': self.eviction_hints,
+                'Eviction-writeback-notices': self.eviction_writeback_notices,
+                'Stale-sharers-cleared': self.stale_sharers_cleared,
+                'Spurious-invalidations-avoided': self.spurious_invalidations_avoided}
+
+    def timing_breakdown(self):
+        # Execution time is when the last processor finished. Stall time is every cycle a processor spent on
+        # accesses that left its cache, queueing delay the part of it spent waiting for a link or the directory.
+        metrics = {'Execution-time': self.execution_time,
+                   'Timing-events': self.timing_events,
+                   'Stall-time': sum(self.stall_cycles),
+                   'Queueing-delay': sum(self.queueing_cycles)}
+        for p in range(len(self.stall_cycles)):
+            metrics['P{}-finish-time'.format(p)] = self.finish_times[p]
+            metrics['P{}-busy-time'.format(p)] = self.busy_cycles[p]
+            metrics['P{}-stall-time'.format(p)] = self.stall_cycles[p]
+            metrics['P{}-queueing-delay'.format(p)] = self.queueing_cycles[p]
+        return metrics
+
+    def traffic_breakdown(self):
+        # A link's utilisation is the cycles it spent moving link_width bytes a cycle over the execution time, the
+        # timing engine's or else every access' latency end to end.
+        elapsed = self.execution_time or sum(self.access_cycles)
+        metrics = {'Messages': sum(self.messages.values()),
+                   'Message-bytes': sum(self.message_bytes.values())}
+        for kind in self.messages:
+            metrics['{}-messages'.format(kind.capitalize())] = self.messages[kind]
+            metrics['{}-bytes'.format(kind.capitalize())] = self.message_bytes[kind]
+        for p in range(len(self.bytes_sent)):
+            metrics['P{}-messages-sent'.format(p)] = self.messages_sent[p]
+            metrics['P{}-bytes-sent'.format(p)] = self.bytes_sent[p]
+            metrics['P{}-bytes-received'.format(p)] = self.bytes_received[p]
+        for link, cycles in self.link_cycles.items():
+            metrics['Link-{}-bytes'.format(link)] = self.link_bytes[link]
+            metrics['Link-{}-utilisation'.format(link)] = cycles / elapsed if elapsed > 0 else 0
+        metrics['Max-link-utilisation'] = max(self.link_cycles.values()) / elapsed if elapsed > 0 else 0
+        return metrics
+
+    def victim_breakdown(self):
+        # Victim hits are counted as private accesses, saved write-backs are modified lines that came back from
+        # the victim cache instead of being written back.
+        return {'Victim-hits': self.victim_hits,
+                'Victim-saved-writebacks': self.victim_saved_writebacks}
+
+    def prefetch_breakdown(self):
+        # Prefetch latency is not part of any access latency above. Hidden latency is what the useful prefetches
+        # took, which the processor would otherwise have waited for.
+        return {'Prefetches-issued': self.prefetches_issued,
+                'Prefetches-useful': self.prefetches_useful,
+                'Prefetches-harmful': self.prefetches_harmful,
+                'Prefetches-off-chip': self.prefetches_off_chip,
+                'Prefetch-average-latency':
+                    self.prefetch_cycles / self.prefetches_issued if self.prefetches_issued > 0 else 0,
+                'Prefetch-hidden-latency': self.prefetch_hidden_cycles}
+
+    def metrics(self, per_processor=False):
+        # Every figure of the run by name, in the order final_stats writes them. Sections of features that are not
+        # enabled are left out.
+        counts, cycles = self.access_counts, self.access_cycles
+        private_accesses = counts[AccessType.PRIVATE.value]
+        remote_accesses = counts[AccessType.REMOTE.value]
+        off_chip_accesses = counts[AccessType.OFF_CHIP.value]
+        llc_accesses = counts[AccessType.LLC.value]
+        total_accesses = private_accesses + remote_accesses + off_chip_accesses + llc_accesses
+        private_access_latency = (cycles[AccessType.PRIVATE.value] / private_accesses) if private_accesses > 0 else 0
+        remote_access_latency = (cycles[AccessType.REMOTE.value] / remote_accesses) if remote_accesses > 0 else 0
+        off_chip_access_latency = (cycles[AccessType.OFF_CHIP.value] / off_chip_accesses) if off_chip_accesses > 0 else 0
+        total_latency = sum(cycles)
+        average_latency = (total_latency / total_accesses) if total_accesses > 0 else 0
+
+        metrics = {'Private-accesses': private_accesses,
+                   'Remote-accesses': remote_accesses,
+                   'Off-chip-accesses': off_chip_accesses,
+                   'Total-accesses': total_accesses,
+                   'Replacement-writebacks': self.replacement_writebacks,
+                   'Coherence-writebacks': self.coherence_writebacks,
+                   'Invalidations-sent': self.invalidations_sent,
+                   'Average-latency': average_latency,
+                   'Priv-average-latency': private_access_latency,
+                   'Rem-average-latency': remote_access_latency,
+                   'Off-chip-average-latency': off_chip_access_latency,
+                   'Total-latency': total_latency}
+        if self.llc_bank_lookups:
+            metrics.update(self.llc_breakdown())
+        if self.home_requests:
+            metrics.update(self.home_breakdown())
+        if self.sparse_directory:
+            metrics.update(self.directory_breakdown())
+        if self.eviction_notifications:
+            metrics.update(self.notification_breakdown())
+        if self.migratory:
+            metrics.update(self.migratory_breakdown())
+        if self.victim_caching:
+            metrics.update(self.victim_breakdown())
+        if self.prefetching:
+            metrics.update(self.prefetch_breakdown())
+        if self.stall_cycles:
+            metrics.update(self.timing_breakdown())
+        if self.messages:
+            metrics.update(self.traffic_breakdown())
+        if self.cross_check_indexes:
+            metrics.update({'Cross-checked-indexes': self.cross_check_indexes,
+                            'Cross-checked-accesses': self.cross_checked})
+        if per_processor:
+            metrics.update(self.processor_breakdown())
+        return metrics
+
+    def final_stats(self, filename, to_file=False, per_processor=False):
+        st = '\n'.join('{}: {}'.format(name, value) for name, value in self.metrics(per_processor).items())
 
         if to_file:
             outname = 'out_{}'.format(filename)
             outpath = path.join('./out-files', outname)
-            with open(outpath, 'w') as f:
+            # Written next to it first, so a reader never sees a partly written file.
+            with open(outpath + '.tmp', 'w') as f:
                 f.write(st)
+            os.replace(outpath + '.tmp', outpath)
             print("File {} written with these stats:\n".format(outpath))
-        return st
\ No newline at end of file
+        return st
@@ -1,6 +1,29 @@
 from cache import Cache, CacheState, CacheLine
-from stats import Stats
+from stats import Stats, AccessType
 from directory import Directory
+from flight_recorder import FlightRecorder, EventType
+from trace_filter import TraceFilter, parse_range
+from cache_simulation import Simulator
+from hotspots import COUNTERS, CONFLICT_MISSES, PING_PONG, INVALIDATIONS
+from timeseries import read_windows
+from progress import ProgressReporter
+from trace_index import build_index
+from cache import decode_address
+from trace_generator import TraceGenerator
+from cache_simulation import parse_line, power_of_two
+from replacement import make_policy
+from timing import TraceSplitter
+from prefetcher import StridePredictor, StreamBufferPredictor
+from snapshot import read_snapshots, render_snapshot
+from results import ResultsStore, run_row, diff_runs, sweep
+import batch
+import trace_index
+import benchmark
+import argparse
+import shutil
+import os
+import io
+import pytest
 
 
 class TestClass:
@@ -171,3 +194,533 @@ class TestClass:
         b.tag = 200
 
         assert(not a.equals(b))
+
+    def test_flight_recorder_keeps_last_events(self):
+        recorder = FlightRecorder(size=3)
+        for i in range(5):
+            recorder.record(i, EventType.READ_MISS, 0, i, 0, None, 0)
+
+        assert [e[0] for e in recorder.recent()] == [2, 3, 4]
+        assert recorder.recorded == 5
+
+    def test_flight_recorder_invalidation(self):
+        # P1 holds the line in S, a write from P0 must show up as an invalidation of P1
+        self.setup()
+        self.caches['P1'].read(1)
+        self.caches['P0'].write(1)
+
+        events = [(e[1], e[2]) for e in self.stats.recorder.recent()]
+        assert (EventType.INVALIDATION, 1) in events
+        assert events[-1] == (EventType.STATE_TRANSITION, 0)
+
+    def test_trace_filter_matches(self):
+        f = TraceFilter(processors=[1], index_ranges=[parse_range('0-1')])
+
+        assert f.matches(1, 4)
+        assert not f.matches(0, 4)
+        # Address 8 maps to index 2
+        assert not f.matches(1, 8)
+
+    def test_trace_filter_events(self, capsys):
+        s = Simulator(trace_filter=TraceFilter(processors=[0], events=[EventType.INVALIDATION]))
+        s.run_trace(['P1 R 1', 'P0 W 1', 'P1 W 1'])
+
+        out = capsys.readouterr().out.splitlines()
+        # Only the invalidation caused by P0's write is printed, the accesses from P1 are not traced
+        assert out == ['#1 P1 INVALIDATION Idx: 0 Tag: 0 -> I (13)']
+
+    def test_hotspots_conflict_and_ping_pong(self):
+        s = Simulator(hotspots=True)
+        # 0 and 2048 both map to index 0, P0 and P1 take turns writing block 0
+        s.run_trace(['P0 W 0', 'P1 W 0', 'P0 W 0', 'P0 R 2048'])
+
+        counters = s.hotspots.index_counters
+        assert counters[PING_PONG][0] == 2
+        assert counters[INVALIDATIONS][0] == 2
+        assert counters[CONFLICT_MISSES][0] == 1
+        assert s.hotspots.block_counters[s.hotspots.block_rows[0] * len(COUNTERS) + PING_PONG] == 2
+
+    def test_hotspots_to_numpy(self):
+        np = pytest.importorskip('numpy')
+        s = Simulator(hotspots=True)
+        s.run_trace(['P0 W 0', 'P1 W 0'])
+
+        arrays = s.hotspots.to_numpy()
+        assert arrays['invalidations'].dtype == np.uint64
+        assert arrays['invalidations'][0] == 1
+        assert arrays['block_counters'].shape == (1, 5)
+
+    def test_per_processor_stats(self):
+        s = Simulator()
+        s.run_trace(['P0 W 1', 'P0 W 1', 'P0 R 1', 'P1 R 1'])
+
+        p0 = s.stats.processor_stats[0]
+        assert p0.counts[AccessType.OFF_CHIP.value] == 1
+        assert p0.counts[AccessType.PRIVATE.value] == 2
+        assert p0.percentile(50) == 2
+        assert p0.percentile(99) == 29
+        assert p0.max_cycles == 29
+        assert s.stats.processor_stats[1].counts[AccessType.REMOTE.value] == 1
+        assert 'P1-rem-average-latency: 19.0' in s.stats.final_stats('test', per_processor=True)
+
+    def test_window_reporter(self, tmp_path):
+        for binary in [False, True]:
+            filename = str(tmp_path / 'windows')
+            s = Simulator(window_interval=2, window_file=filename, window_binary=binary)
+            s.run_trace(['P0 W 1', 'P0 W 1', 'h', 'P1 W 1', 'P1 R 1', 'P2 R 1'])
+
+            rows = read_windows(filename, binary=binary)
+            assert [r[0] for r in rows] == [2, 4, 5]
+            assert rows[0][1] == 0.5
+            assert rows[0][2] == 15.5
+            assert rows[1][5] == 1
+            # P2's read forces P1 out of M
+            assert rows[2][4] == 1
+
+    def test_progress_reporter(self):
+        s = Simulator()
+        stream = io.StringIO()
+        s.progress = ProgressReporter(s.stats, interval=0, total_bytes=100, position=lambda: 50, label='t',
+                                      check_every=2, stream=stream)
+        s.run_trace(['P0 W 1', 'P0 W 1', 'P0 R 1'])
+
+        lines = stream.getvalue().splitlines()
+        assert len(lines) == 2
+        assert lines[0].startswith('[t] 2 accesses')
+        assert '50.0%' in lines[0] and 'hit rate 0.5000' in lines[0]
+        assert 'done in' in lines[1]
+
+    def test_benchmark_compare(self):
+        baseline = {'a': {'accesses_per_second': 1000}, 'b': {'accesses_per_second': 1000}}
+        results = {'a': {'accesses_per_second': 850}, 'b': {'accesses_per_second': 700},
+                   'c': {'accesses_per_second': 1}}
+
+        regressions = benchmark.compare(results, baseline, tolerance=0.2)
+        assert len(regressions) == 1
+        assert regressions[0].startswith('b:')
+
+    def test_directory_distance_scales_with_processors(self):
+        s = Simulator(no_processors=8)
+        s.run_trace(['P7 R 1', 'P0 R 1'])
+
+        assert s.directory.distance_between_processors(0, 7) == 1
+        assert s.directory.distance_between_processors(7, 0) == 7
+
+    def test_profiler_counts_hot_paths(self):
+        s = Simulator(profile=True)
+        s.run_trace(['P0 W 1', 'P0 W 1', 'P1 R 1'])
+
+        calls = s.profiler.calls
+        assert calls['parse_line'] == 3
+        assert calls['Stats.save_stats'] == 3
+        assert calls['Directory.write_miss'] == 1
+        assert calls['Directory.read_miss'] == 1
+        assert calls['get_sharers'] == 2
+        # Misses probe twice, before and after the fill, P0's second write is a hit
+        assert calls['calculate_cache_line'] == 5
+
+    def test_profiler_disabled_leaves_methods(self):
+        s = Simulator()
+
+        assert 'read_miss' not in vars(s.directory)
+        assert 'save_stats' not in vars(s.stats)
+
+    def test_trace_index_replay_is_exact(self, tmp_path, monkeypatch):
+        trace = str(tmp_path / 'trace.txt')
+        shutil.copy('./cache-traces/trace-1-start.txt', trace)
+        index = build_index(trace, checkpoint_every=16)
+        with open(trace, 'r') as f:
+            lines = f.readlines()
+        selected = {decode_address(int(lines[0].split()[2]))[1], 5}
+
+        def latencies(trace_lines):
+            # Latency of every access to the selected indexes
+            s = Simulator()
+            found = []
+            for line in trace_lines:
+                before = {t: len(c) for t, c in s.stats.cycle_dict.items()}
+                s.run_line(line)
+                if decode_address(int(line.split()[2]))[1] in selected:
+                    found += [c[-1] for t, c in s.stats.cycle_dict.items() if len(c) > before[t]]
+            return found
+
+        replay = list(index.read_lines(index.offsets_for('index', selected)))
+        assert len(replay) > 0
+        assert latencies(replay) == latencies(lines)
+        assert list(index.read_line_range(20, 23)) == lines[20:23]
+
+        # Every access of a processor, in trace order
+        assert list(index.read_lines(index.offsets_for('processor', [2]))) == [l for l in lines if l.startswith('P2 ')]
+
+        # Spilling postings to disk while building, and merging the runs a few at a time, gives the same index
+        monkeypatch.setattr(trace_index, 'MERGE_RUNS', 3)
+        spilled = build_index(trace, str(tmp_path / 'spilled.idx'), checkpoint_every=16, flush_every=7)
+        for group, keys in [('processor', range(4)), ('index', range(512))]:
+            assert list(spilled.offsets_for(group, keys)) == list(index.offsets_for(group, keys))
+            assert list(spilled.postings(group, 1)) == list(index.postings(group, 1))
+        assert sorted(os.listdir(str(tmp_path / 'spilled.idx'))) == [
+            'checkpoints.bin', 'index.bin', 'index.starts', 'meta.json', 'processor.bin', 'processor.starts']
+
+        # Options that cross indexes would make the replay differ from the full run
+        for options in [{'victim_entries': 2}, {'llc_blocks': 128}, {'home': 'first-touch'}]:
+            with pytest.raises(Exception, match='independent cache indexes'):
+                Simulator(**options).run_subset('trace-1-start.txt', [5])
+
+    def test_trace_generator_patterns(self):
+        lines = list(TraceGenerator(seed=1, patterns={'uniform': 1, 'conflict': 1}).chunks(1000, chunk_size=300))
+        assert lines == list(TraceGenerator(seed=1, patterns={'uniform': 1, 'conflict': 1}).chunks(1000, chunk_size=300))
+        accesses = [parse_line(l) for l in ''.join(lines).splitlines()]
+        assert len(accesses) == 1000
+        assert {p for p, a, m in accesses} == {'P0', 'P1', 'P2', 'P3'}
+
+        # Every processor writes its own word of the same block
+        accesses = [parse_line(l) for l in TraceGenerator(patterns={'false-sharing': 1}).chunk(64).splitlines()]
+        assert len({decode_address(m)[1:] for p, a, m in accesses}) == 1
+
+        # Read-then-write by one processor after another on the same address
+        accesses = [parse_line(l) for l in TraceGenerator(patterns={'migratory': 1}).chunk(4).splitlines()]
+        assert [a for p, a, m in accesses] == ['R', 'W', 'R', 'W']
+        assert accesses[0][0] == accesses[1][0] != accesses[2][0]
+        assert len({m for p, a, m in accesses}) == 1
+
+    def test_trace_analysis_matches_python(self, tmp_path):
+        pytest.importorskip('numpy')
+        import trace_analysis
+        trace = tmp_path / 'trace.txt'
+        trace.write_bytes(b'P0 R 0\r\nv\nP1 W 2048\nP12 R 4294967295\nh\nP1 R 1')
+        result = trace_analysis.analyse(str(trace), chunk_bytes=7)
+
+        assert result['processor_accesses'] == [1, 2] + [0] * 10 + [1]
+        assert result['writes'] == 1
+        assert result['unique_blocks'] == 3
+        assert result['shared_blocks'] == 1
+        assert result['write_shared_blocks'] == 0
+        assert result['index_blocks'][0] == 2
+
+        with open('./cache-traces/trace-1-start.txt', 'r') as f:
+            accesses = [parse_line(l) for l in f]
+        result = trace_analysis.analyse('./cache-traces/trace-1-start.txt', block_size=4, no_blocks=256)
+        index_accesses = [0] * 256
+        for p, a, m in accesses:
+            index_accesses[decode_address(m, 4, 256)[1]] += 1
+        assert result['index_accesses'] == index_accesses
+        assert result['unique_blocks'] == len({m >> 2 for p, a, m in accesses})
+
+    def test_replacement_policies(self):
+        # One set of 4 ways, filled in order, then way 0 is used again
+        victims = {}
+        for name in ['lru', 'plru', 'fifo']:
+            policy = make_policy(name, 1, 4)
+            for way in range(4):
+                policy.fill(0, way)
+            policy.touch(0, 0)
+            victims[name] = policy.victim(0)
+        assert victims == {'lru': 1, 'plru': 2, 'fifo': 0}
+
+    def test_set_associative_cache(self):
+        # 0 and 2048 map to the same set, with 2 ways both stay cached
+        s = Simulator(ways=2)
+        s.run_trace(['P0 R 0', 'P0 R 2048', 'P0 R 0'])
+        assert len(s.stats.cycle_dict[AccessType.PRIVATE]) == 1
+
+        # P1 holds block 0 in its second way, P0's write must invalidate that way and leave the first one alone
+        s = Simulator(ways=2)
+        s.run_trace(['P1 R 2048', 'P1 R 0', 'P0 W 0'])
+        lines = s.caches['P1'].cache_lines
+        assert (lines[0].tag, lines[0].state) == (2, CacheState.SHARED)
+        assert lines[1].state == CacheState.INVALID
+        assert s.directory.lines[1][1].state == CacheState.INVALID
+
+        # Indexes are masked out of the address, so the sets must be a power of two
+        for ways in [0, 3, 1024]:
+            with pytest.raises(Exception, match='power of two sets'):
+                Simulator(ways=ways)
+        with pytest.raises(argparse.ArgumentTypeError):
+            power_of_two('3')
+
+    def test_prefetcher_useful_and_harmful(self):
+        s = Simulator(prefetcher='next-line')
+        # The miss on block 0 prefetches block 1, using it prefetches block 2
+        s.run_trace(['P0 R 0', 'P0 R 4'])
+        assert s.stats.cycle_dict[AccessType.OFF_CHIP] == [29]
+        assert s.stats.cycle_dict[AccessType.PRIVATE] == [2]
+        assert (s.stats.prefetches_issued, s.stats.prefetches_useful, s.stats.prefetches_harmful) == (2, 1, 0)
+        assert s.stats.prefetch_hidden_cycles == 26
+
+        # Block 1 prefetched after the miss on block 0 replaces address 2052, which is then missed on again
+        s = Simulator(prefetcher='next-line')
+        s.run_trace(['P0 R 2052', 'P0 R 0', 'P0 R 2052'])
+        assert s.stats.prefetches_harmful == 1
+        assert 'Prefetches-harmful: 1' in s.stats.final_stats('test')
+
+    def test_prefetch_predictors(self):
+        stride = StridePredictor(degree=2)
+        assert [stride.predict(b) for b in [10, 13, 16]] == [[], [], [19, 22]]
+
+        stream = StreamBufferPredictor(degree=2)
+        assert stream.predict(5) == [6, 7]
+        assert stream.predict(6) == [8]
+        assert stream.predict(40) == [41, 42]
+
+    def test_llc_hits_and_latency(self):
+        # 0 and 2048 share a private cache line but both fit in the 2-way LLC
+        s = Simulator(llc_blocks=16, llc_ways=2, llc_banks=1)
+        s.run_trace(['P0 R 0', 'P0 R 2048', 'P0 R 0'])
+        assert s.stats.cycle_dict[AccessType.OFF_CHIP] == [34, 34]
+        assert s.stats.cycle_dict[AccessType.LLC] == [19]
+        assert 'LLC-hits: 1' in s.stats.final_stats('test')
+
+    def test_llc_inclusion(self):
+        # Block 8 replaces block 0 in the direct-mapped LLC, the inclusive LLC takes P0's copy with it
+        trace = ['P0 W 0', 'P1 R 32', 'P0 R 0']
+        s = Simulator(llc_blocks=8, llc_ways=1, llc_banks=1)
+        s.run_trace(trace)
+        assert s.stats.llc_back_invalidations == 2
+        assert s.stats.llc_writebacks == 1
+        assert len(s.stats.cycle_dict[AccessType.PRIVATE]) == 0
+
+        s = Simulator(llc_blocks=8, llc_ways=1, llc_banks=1, llc_inclusive=False)
+        s.run_trace(trace)
+        assert s.stats.llc_back_invalidations == 0
+        assert len(s.stats.cycle_dict[AccessType.PRIVATE]) == 1
+
+        # Block 512 evicts block 0 from the LLC while P0 replaces its own copy of it, which is written back once
+        for optimisation in [False, True]:
+            s = Simulator(optimisation=optimisation, llc_blocks=8, llc_ways=1, llc_banks=1)
+            s.run_trace(['P0 W 0', 'P0 R 2048'])
+            assert (s.stats.replacement_writebacks, s.stats.coherence_writebacks) == (1, 0)
+            assert s.stats.llc_back_invalidations == 0
+            assert s.caches['P0'].cache_lines[0].tag == 1
+
+    def test_home_node_hops(self):
+        # Interleaved homes: block 0 lives at P0 and block 1 at P1, so both off-chip reads stay local while P2's
+        # read of block 0 goes two hops to P0, which forwards the data itself
+        trace = ['P0 R 0', 'P1 R 4', 'P2 R 0']
+        s = Simulator(home='interleave')
+        s.run_trace(trace)
+        assert s.stats.cycle_dict[AccessType.OFF_CHIP] == [19, 19]
+        assert s.stats.cycle_dict[AccessType.REMOTE] == [18]
+        assert (s.stats.home_requests, s.stats.local_home_requests) == ([2, 1, 0, 0], 2)
+
+        # Page homes put both blocks at P0, P1 is three hops away from it on the ring and one hop back
+        s = Simulator(home='page')
+        s.run_trace(trace)
+        assert s.stats.cycle_dict[AccessType.OFF_CHIP] == [19, 31]
+        assert 'Home-P0-requests: 3' in s.stats.final_stats('test')
+
+    def test_home_node_first_touch(self):
+        # Page 0 (blocks 0-3) is first touched by P2, page 1 by P0, a round trip to another node goes around the ring
+        s = Simulator(home='first-touch', page_blocks=4)
+        s.run_trace(['P2 R 0', 'P0 R 4', 'P0 R 16'])
+        assert s.stats.home_requests == [1, 0, 2, 0]
+        assert s.stats.cycle_dict[AccessType.OFF_CHIP] == [19, 31, 19]
+
+    def test_sparse_directory_eviction(self):
+        # Blocks 0 and 2 share the entry of a 2 entry direct-mapped directory, P2's read of block 2 invalidates
+        # both copies of block 0 and waits for the acknowledgements, P0 reading block 0 again does the same to P2
+        s = Simulator(directory_entries=2, directory_ways=1)
+        s.run_trace(['P0 R 0', 'P1 R 0', 'P2 R 8', 'P0 R 0'])
+        assert s.stats.cycle_dict[AccessType.OFF_CHIP] == [29, 39, 39]
+        assert (s.stats.directory_evictions, s.stats.directory_eviction_lines, s.stats.invalidations_sent) == (2, 3, 3)
+        assert s.caches['P1'].cache_lines[0].state == CacheState.INVALID
+        assert 'Directory-eviction-latency: 20' in s.stats.final_stats('test')
+
+    def test_sparse_directory_stale_sharer(self):
+        # P0 replaced block 0 without telling the directory, the eviction still sends it an invalidation
+        s = Simulator(directory_entries=2, directory_ways=1)
+        s.run_trace(['P0 R 0', 'P0 R 2048', 'P1 R 2048'])
+        assert (s.stats.directory_eviction_invalidations, s.stats.directory_eviction_lines) == (1, 0)
+        assert s.stats.directory_entry_hits == 1
+
+    def test_eviction_notifications(self):
+        # Told about the replacements, the directory has no sharer left to invalidate when the entries are reused,
+        # and the misses do not wait for acknowledgements
+        s = Simulator(directory_entries=2, directory_ways=1, eviction_notifications=True, traffic=True)
+        s.run_trace(['P0 R 0', 'P0 R 2048', 'P2 W 4', 'P2 W 2052'])
+        assert s.stats.cycle_dict[AccessType.OFF_CHIP] == [29, 29, 29, 29]
+        assert (s.stats.directory_eviction_invalidations, s.stats.spurious_invalidations_avoided) == (0, 2)
+        assert (s.stats.eviction_hints, s.stats.eviction_writeback_notices, s.stats.stale_sharers_cleared) == (1, 1, 2)
+        assert (s.stats.messages['hint'], s.stats.messages['writeback']) == (1, 1)
+        assert s.directory.lines[0][0].tag == 1 and s.directory.lines[1][2].tag == 1
+        assert 'Spurious-invalidations-avoided: 2' in s.stats.final_stats('test')
+
+        # With a full-map directory the messages only keep the sharers precise, no access takes longer or shorter
+        trace = ['P0 R 0', 'P1 R 2048', 'P0 W 2048', 'P2 R 4', 'P3 W 2052', 'P2 W 6', 'P1 R 0']
+        for optimisation in [False, True]:
+            cycles = []
+            for notifications in [False, True]:
+                s = Simulator(optimisation=optimisation, eviction_notifications=notifications)
+                s.run_trace(trace)
+                cycles.append(s.stats.cycle_dict)
+            assert cycles[0] == cycles[1]
+            assert cycles[0][AccessType.REMOTE][0] == 24
+
+    def test_timing_engine(self):
+        # All three processors issue at cycle 0 and queue at the directory, P0 goes on with its hit at cycle 29
+        s = Simulator(timing=True)
+        s.run_trace(['P0 R 0', 'P1 R 0', 'P0 R 0', 'P2 W 4'])
+        assert s.stats.finish_times == [31, 21, 33, 0]
+        assert s.stats.queueing_cycles == [0, 2, 4, 0]
+        assert s.stats.stall_cycles == [29, 21, 33, 0]
+        assert s.stats.busy_cycles == [2, 0, 0, 0]
+        assert 'Execution-time: 33' in s.stats.final_stats('test')
+        # Totals are kept per access type instead of every latency
+        assert (s.stats.access_counts, s.stats.access_cycles) == ([1, 1, 2, 0], [2, 19, 58, 0])
+        assert all(latencies == [] for latencies in s.stats.cycle_dict.values())
+
+        # The trace is read once, a stream only buffers the lines its processor has not reached, commands go to P0
+        read = []
+        lines = iter(['P1 R 0', 'h', 'P0 R 4', 'P1 W 0', '', 'P9 R 0'])
+        streams = TraceSplitter((read.append(line) or line for line in lines), 2).streams()
+        assert next(streams[0]) == 'h'
+        assert read == ['P1 R 0', 'h']
+        assert list(streams[1]) == ['P1 R 0', 'P1 W 0']
+        assert list(streams[0]) == ['P0 R 4']
+
+    def test_batch_runner(self, tmp_path, monkeypatch):
+        # A bad trace fails on its own, MSI and MESI results of the good one are both written
+        (tmp_path / 'traces').mkdir()
+        (tmp_path / 'out-files').mkdir()
+        (tmp_path / 'traces' / 'good.txt').write_text('P0 R 0\nP1 R 0\nP0 W 0\n')
+        (tmp_path / 'traces' / 'bad.txt').write_text('P0 R 0\nP0 X 0\n')
+        monkeypatch.chdir(tmp_path)
+        traces = batch.find_traces(['traces'])
+        assert traces == ['traces/bad.txt', 'traces/good.txt']
+        results = batch.run_batch(traces, batch.PROTOCOLS, jobs=2)
+        assert [(r['trace'], r['protocol'], r['error'] is None) for r in results] == [
+            ('traces/bad.txt', 'msi', False), ('traces/bad.txt', 'mesi', False),
+            ('traces/good.txt', 'msi', True), ('traces/good.txt', 'mesi', True)]
+        assert sorted(p.name for p in (tmp_path / 'out-files').iterdir()) == ['out_good.txt', 'out_mesi_good.txt']
+        assert 'Total-accesses: 3' in (tmp_path / 'out-files' / 'out_mesi_good.txt').read_text()
+        assert 'FAILED: Exception: Invalid line in trace file.' in batch.summary_table(results)
+
+    def test_snapshot_diff_renders_like_p(self, tmp_path, capsys):
+        trace = ['P0 R 0', 'P1 W 4', 'p', 'P2 R 4', 'p', 'p']
+        s = Simulator()
+        s.run_trace(trace)
+        printed = capsys.readouterr().out
+
+        filename = str(tmp_path / 'snapshots.bin')
+        s = Simulator(snapshot_file=filename, snapshot_diff=True)
+        s.run_trace(trace)
+        snapshots = [(accesses, render_snapshot(states, tags), changed)
+                     for accesses, states, tags, changed in read_snapshots(filename)]
+        assert [(accesses, changed) for accesses, text, changed in snapshots] == [
+            (2, None), (3, [(1, 1), (2, 1)]), (3, [])]
+        for accesses, text, changed in snapshots:
+            assert text in printed
+
+    def test_results_store(self, tmp_path):
+        trace = tmp_path / 'trace.txt'
+        trace.write_text('P0 R 0\nP1 R 0\nP0 W 0\nP2 R 2048\n')
+        store = ResultsStore(str(tmp_path / 'results.csv'))
+        for kwargs in [{}, {'ways': 2, 'llc_blocks': 64}]:
+            s = Simulator(**kwargs)
+            s.run_trace(trace.read_text().splitlines())
+            store.append(run_row(s, str(trace), 0.5))
+
+        # The second run added the LLC columns, the first one reads back without them
+        rows = ResultsStore(str(tmp_path / 'results.csv')).read()
+        assert [(r['run'], r['ways'], r['llc_inclusive'], r['LLC-hits']) for r in rows] == [
+            (1, 1, True, None), (2, 2, True, 0)]
+        assert rows[0]['Total-accesses'] == 4 and rows[0]['accesses_per_second'] == 8.0
+        assert rows[0]['trace_hash'] == rows[1]['trace_hash']
+        assert any(line.startswith('ways ') and '+1 (+100.0%)' in line for line in diff_runs(rows[0], rows[1]))
+        assert [(x, count) for x, y, count in sweep(rows, 'ways', 'Average-latency')] == [(1, 1), (2, 1)]
+
+    def test_cross_check_agrees(self):
+        lines = ''.join(TraceGenerator(seed=2, patterns={'uniform': 1, 'conflict': 1, 'migratory': 1}).chunks(
+            2000, chunk_size=500)).splitlines()
+        for kwargs in [{}, {'optimisation': True, 'migratory': True, 'ways': 2, 'replacement': 'plru'},
+                       {'optimisation': True, 'home': 'page', 'timing': True}]:
+            s = Simulator(cross_check=1, **kwargs)
+            s.run_trace(lines)
+            assert s.stats.cross_checked == s.stats.accesses == 2000
+        s = Simulator(cross_check=0.1)
+        assert s.stats.cross_check_indexes == 51
+        assert 'Cross-checked-indexes: 51' in s.stats.final_stats('test')
+
+    def test_cross_check_divergence(self):
+        s = Simulator(cross_check=1)
+        s.run_trace(['P0 R 0', 'P1 R 0', 'P2 R 4'])
+        # P1 loses its copy behind the simulator's back, its next read is remote instead of a hit
+        s.caches['P1'].cache_lines[0].state = CacheState.INVALID
+        with pytest.raises(Exception, match=r'DIVERGENCE at access 4 \(P1 R 0\), cache index 0'):
+            s.run_trace(['P1 R 0'])
+        with pytest.raises(Exception, match='llc_blocks'):
+            Simulator(cross_check=0.1, llc_blocks=64)
+
+    def test_traffic_accounting(self):
+        s = Simulator(traffic=True)
+        # P2's write invalidates P0 and P1, P1 is closest and forwards the data, P0 acks over the ring. P2's read
+        # then replaces its modified line.
+        s.run_trace(['P0 R 0', 'P1 R 0', 'P2 W 0', 'P2 R 2048'])
+        assert s.stats.messages == {'request': 4, 'forward': 1, 'data': 4, 'invalidation': 2, 'ack': 2,
+                                    'writeback': 1, 'hint': 0}
+        # Control messages are 8 bytes, data ones 8 more than the 4 words of a block
+        assert s.stats.message_bytes['data'] == 4 * 24 and s.stats.message_bytes['ack'] == 2 * 8
+        assert s.stats.link_bytes['P0->P1'] == s.stats.link_bytes['P1->P2'] == 24 + 8
+        assert s.stats.link_bytes['D->P0'] == 24 + 8 + 8
+        assert (s.stats.bytes_sent, s.stats.bytes_received) == ([40, 32, 40, 0], [40, 32, 64, 0])
+        metrics = s.stats.metrics()
+        # 16 bytes a cycle, so 2 cycles for the data and 1 for the ack
+        assert metrics['Link-P0->P1-utilisation'] == 3 / metrics['Total-latency']
+
+        # A sliced directory is reached over the ring, local requests stay off it
+        s = Simulator(traffic=True, home='interleave')
+        s.run_trace(['P1 R 4', 'P0 R 8'])
+        assert s.stats.link_bytes == {'P0->P1': 8, 'P1->P2': 8, 'P2->P3': 24, 'P3->P0': 24}
+
+    def test_victim_cache_hit(self):
+        # 0 and 2048 map to the same line, the dirty block 0 waits in the victim cache instead of being written back
+        s = Simulator(victim_entries=2, victim_latency=2)
+        s.run_trace(['P2 W 0', 'P2 R 2048', 'P2 R 0'])
+        assert s.stats.cycle_dict[AccessType.PRIVATE] == [4]
+        assert (s.stats.victim_hits, s.stats.victim_saved_writebacks, s.stats.replacement_writebacks) == (1, 1, 0)
+        assert s.caches['P2'].cache_lines[0].state == CacheState.MODIFIED
+        assert s.directory.lines[0][2].state == CacheState.MODIFIED
+
+    def test_victim_cache_snooped(self):
+        # P1's read finds P2's modified copy in the victim cache and leaves it in S, P0's write invalidates it
+        s = Simulator(optimisation=True, victim_entries=2)
+        s.run_trace(['P2 W 0', 'P2 R 2048', 'P1 R 0'])
+        assert s.stats.coherence_writebacks == 1
+        assert s.caches['P2'].victim_cache.lines == {0: CacheState.SHARED}
+        # No E for P1 while P2 keeps a copy
+        assert s.caches['P1'].cache_lines[0].state == CacheState.SHARED
+
+        s.run_trace(['P0 W 0'])
+        assert s.caches['P2'].victim_cache.lines == {}
+
+        # A write snooping a modified copy writes it back before invalidating it, in MSI and MESI
+        for optimisation in [False, True]:
+            s = Simulator(optimisation=optimisation, victim_entries=2)
+            s.run_trace(['P2 W 0', 'P2 R 2048', 'P0 W 0'])
+            assert (s.stats.coherence_writebacks, s.stats.invalidations_sent) == (1, 1)
+            assert s.caches['P2'].victim_cache.lines == {}
+
+    def test_migratory_detection(self):
+        s = Simulator(optimisation=True, migratory=True)
+        # Detected when P2 upgrades a copy whose only other holder, P1, wrote it last
+        s.run_trace(['P0 R 0', 'P0 W 0', 'P1 R 0', 'P1 W 0', 'P2 R 0', 'P2 W 0'])
+        assert s.stats.migratory_detections == 1
+
+        # P3's read takes the line over in M and its write hits, P0 is handed the line but never writes it
+        writebacks = s.stats.coherence_writebacks
+        s.run_trace(['P3 R 0'])
+        assert s.stats.coherence_writebacks == writebacks
+        assert s.caches['P3'].cache_lines[0].state == CacheState.MODIFIED
+        assert s.caches['P2'].cache_lines[0].state == CacheState.INVALID
+        s.run_trace(['P3 W 0'])
+        assert s.stats.cycle_dict[AccessType.PRIVATE][-1] == 2
+        s.run_trace(['P0 R 0', 'P1 R 0'])
+        assert (s.stats.migratory_grants, s.stats.migratory_upgrades_avoided, s.stats.migratory_demotions) == (2, 1, 1)
+        assert s.caches['P1'].cache_lines[0].state == CacheState.SHARED
+
+        # The grant sends no write-back either
+        s = Simulator(optimisation=True, migratory=True, traffic=True)
+        s.run_trace(['P0 R 0', 'P0 W 0', 'P1 R 0', 'P1 W 0', 'P2 R 0', 'P2 W 0'])
+        writebacks, messages = s.stats.coherence_writebacks, s.stats.messages['writeback']
+        s.run_trace(['P3 R 0'])
+        assert s.stats.migratory_grants == 1
+        assert (s.stats.coherence_writebacks, s.stats.messages['writeback']) == (writebacks, messages)
@@ -0,0 +1,95 @@
+from stats import AccessType
+import struct
+
+COLUMNS = ['accesses', 'hit_rate', 'average_latency', 'replacement_writebacks', 'coherence_writebacks',
+           'invalidations']
+
+# Binary rows: access count at the end of the window, hit rate, average latency and the three event counts.
+ROW = struct.Struct('<QddQQQ')
+
+
+class WindowReporter:
+    # Streams one row of statistics for every window of `interval` accesses while the simulation runs.
+    # Window figures are taken as differences of the running totals in Stats, so nothing is kept per access and
+    # memory stays constant however long the trace is.
+    def __init__(self, stats, interval, filename, binary=False):
+        self.stats = stats
+        self.interval = interval
+        self.filename = filename
+        self.binary = binary
+        self.next_row = interval
+        self.file = None
+        self.last_counts = [0] * len(AccessType)
+        self.last_cycles = [0] * len(AccessType)
+        self.last_replacement_writebacks = 0
+        self.last_coherence_writebacks = 0
+        self.last_invalidations = 0
+        self.rows = 0
+
+    def open(self):
+        if self.binary:
+            self.file = open(self.filename, 'wb')
+        else:
+            self.file = open(self.filename, 'w')
+            self.file.write(','.join(COLUMNS) + '\n')
+
+    def window(self):
+        # Statistics of the accesses since the previous row.
+        accesses = 0
+        hits = 0
+        cycles = 0
+        for t in AccessType:
+            count = self.stats.access_counts[t.value]
+            total = self.stats.access_cycles[t.value]
+            accesses += count - self.last_counts[t.value]
+            cycles += total - self.last_cycles[t.value]
+            if t == AccessType.PRIVATE:
+                hits = count - self.last_counts[t.value]
+            self.last_counts[t.value] = count
+            self.last_cycles[t.value] = total
+
+        row = (self.stats.accesses, hits / accesses if accesses > 0 else 0, cycles / accesses if accesses > 0 else 0,
+               self.stats.replacement_writebacks - self.last_replacement_writebacks,
+               self.stats.coherence_writebacks - self.last_coherence_writebacks,
+               self.stats.invalidations_sent - self.last_invalidations)
+        self.last_replacement_writebacks = self.stats.replacement_writebacks
+        self.last_coherence_writebacks = self.stats.coherence_writebacks
+        self.last_invalidations = self.stats.invalidations_sent
+        return row
+
+    def write_row(self):
+        if self.file is None:
+            self.open()
+        row = self.window()
+        if self.binary:
+            self.file.write(ROW.pack(*row))
+        else:
+            self.file.write(','.join(str(v) for v in row) + '\n')
+        self.rows += 1
+        self.next_row = self.stats.accesses + self.interval
+
+    def finish(self):
+        # Writes the last, possibly partial, window and closes the file.
+        if self.stats.accesses > self.next_row - self.interval:
+            self.write_row()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_windows(filename, binary=False):
+    # Reads the rows written by a WindowReporter back as tuples.
+    rows = []
+    if binary:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        for row in ROW.iter_unpack(data):
+            rows.append(row)
+    else:
+        with open(filename, 'r') as f:
+            f.readline()
+            for line in f:
+                values = line.strip().split(',')
+                rows.append((int(values[0]), float(values[1]), float(values[2]), int(values[3]), int(values[4]),
+                             int(values[5])))
+    return rows
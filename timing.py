@@ -0,0 +1,104 @@
+from collections import deque
+from stats import AccessType
+import heapq
+
+
+class TraceSplitter:
+    # Cuts a single pass over the trace into the per-processor streams the timing engine issues from. A stream
+    # that runs dry reads ahead, leaving the other processors' lines in their buffers, so the trace is read and
+    # parsed once and a buffer only holds the lines its processor has not reached yet, few as long as the trace
+    # interleaves the processors about the way they run. Command lines (v, p, h) go to P0's stream and run when
+    # P0 reaches them. Lines of processors the simulator does not have are dropped.
+    def __init__(self, lines, no_processors):
+        self.lines = iter(lines)
+        self.buffers = [deque() for p in range(no_processors)]
+        self.by_name = {'P{}'.format(p): buffer for p, buffer in enumerate(self.buffers)}
+
+    def read(self):
+        # Moves the next line into its processor's buffer, False at the end of the trace.
+        for line in self.lines:
+            if line.startswith('P'):
+                buffer = self.by_name.get(line.split(None, 1)[0])
+            else:
+                buffer = self.buffers[0] if line.strip() else None
+            if buffer is not None:
+                buffer.append(line)
+                return True
+        return False
+
+    def stream(self, p_num):
+        buffer = self.buffers[p_num]
+        while buffer or self.read():
+            if buffer:
+                yield buffer.popleft()
+
+    def streams(self):
+        return [self.stream(p) for p in range(len(self.buffers))]
+
+
+class TimingEngine:
+    # Discrete-event timing on top of the functional model. Every processor issues from its own stream of the
+    # trace, its next access as soon as the previous one has completed, and the event queue always runs the
+    # access issued earliest next (lower processor number first on a tie), so the caches and directory see the
+    # accesses in issue time order. An access's latency in isolation is what the functional model charges;
+    # one that leaves the private cache also has to wait for the requester's network link and for the directory
+    # (the block's home slice when the directory is distributed), each busy for a fixed number of cycles per
+    # request, and that wait is its queueing delay. A private hit keeps the processor busy, everything else is
+    # stall time. The queue only ever holds one event per processor and the streams are read lazily (through a
+    # TraceSplitter when run by the simulator), so the memory used only grows with how far apart the processors
+    # run compared to the trace order.
+    def __init__(self, sim, directory_occupancy=2, link_occupancy=2):
+        self.sim = sim
+        self.directory_occupancy = directory_occupancy
+        self.link_occupancy = link_occupancy
+        no_processors = sim.no_processors
+        # Time each processor issues its next access at.
+        self.time = [0] * no_processors
+        # Time each processor's link and each directory slice are free again.
+        self.link_free = [0] * no_processors
+        self.directory_free = [0] * no_processors
+        self.now = 0
+        stats = sim.stats
+        stats.finish_times = self.time
+        stats.busy_cycles = [0] * no_processors
+        stats.stall_cycles = [0] * no_processors
+        stats.queueing_cycles = [0] * no_processors
+
+    def run(self, streams):
+        # streams[p] is an iterable of the lines processor p issues.
+        streams = [iter(stream) for stream in streams]
+        queue = []
+        for p, stream in enumerate(streams):
+            line = next(stream, None)
+            if line is not None:
+                queue.append((0, p, line))
+        heapq.heapify(queue)
+        while queue:
+            self.now, p, line = queue[0]
+            self.sim.run_line(line)
+            line = next(streams[p], None)
+            if line is None:
+                heapq.heappop(queue)
+            else:
+                heapq.heapreplace(queue, (self.time[p], p, line))
+            self.sim.stats.timing_events += 1
+        self.sim.stats.execution_time = max(self.time)
+
+    def complete(self, p_num, address):
+        # Called by the simulator once the access processor p_num issued at self.now has been simulated.
+        stats = self.sim.stats
+        issued = self.now
+        if stats.access_type == AccessType.PRIVATE:
+            stats.busy_cycles[p_num] += stats.cycles
+            self.time[p_num] = issued + stats.cycles
+            return
+        # Prefetches may have sent other requests to the directory since, so the home is looked up again.
+        home_map = self.sim.directory.home_map
+        home = home_map.home_of(address // self.sim.block_size, p_num) if home_map is not None else 0
+        start = max(issued, self.link_free[p_num])
+        self.link_free[p_num] = start + self.link_occupancy
+        start = max(start, self.directory_free[home])
+        self.directory_free[home] = start + self.directory_occupancy
+        stats.queueing_cycles[p_num] += start - issued
+        stats.stall_cycles[p_num] += start - issued + stats.cycles
+        self.time[p_num] = start + stats.cycles
@@ -0,0 +1,160 @@
+from os import path
+import argparse
+import json
+import numpy as np
+
+NEWLINE = ord('\n')
+RETURN = ord('\r')
+SPACE = ord(' ')
+ZERO = ord('0')
+POWERS_OF_TEN = 10 ** np.arange(19, dtype=np.int64)
+# Block and processor are packed into one key, the processor in the low bits.
+PROCESSOR_BITS = 16
+
+
+def decode_addresses(addresses, block_size=4, no_blocks=512):
+    # Vectorised cache.decode_address: returns the offset, index and tag arrays.
+    offset_bits = (block_size - 1).bit_length()
+    index_bits = (no_blocks - 1).bit_length()
+    return addresses & (block_size - 1), (addresses >> offset_bits) & (no_blocks - 1), \
+        addresses >> (offset_bits + index_bits)
+
+
+def parse_numbers(data, starts, ends):
+    # Parses the decimal numbers in data[starts[i]:ends[i]] for every i at once: each digit is multiplied by its
+    # power of ten and the products are summed per field.
+    lengths = ends - starts
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.int64)
+    field_starts = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) - np.repeat(field_starts - starts, lengths)
+    digits = data[positions].astype(np.int64) - ZERO
+    if digits.min() < 0 or digits.max() > 9:
+        raise Exception('Trace contains a malformed number.')
+    digits *= POWERS_OF_TEN[np.repeat(ends, lengths) - positions - 1]
+    return np.add.reduceat(digits, field_starts)
+
+
+def parse_chunk(buf):
+    # Parses a block of complete trace lines into processor, write flag and address arrays. Command lines
+    # ('v', 'p', 'h') are skipped. Fields must be separated by single spaces as in the bundled traces.
+    data = np.frombuffer(buf, dtype=np.uint8)
+    ends = np.flatnonzero(data == NEWLINE)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    ends = ends - (data[np.maximum(ends - 1, 0)] == RETURN)
+    accesses = (data[starts] == ord('P')) & (ends > starts)
+    starts, ends = starts[accesses], ends[accesses]
+    spaces = np.flatnonzero(data == SPACE)
+    first = np.searchsorted(spaces, starts)
+    first_space = spaces[first]
+    second_space = spaces[first + 1]
+    processors = parse_numbers(data, starts + 1, first_space)
+    writes = data[first_space + 1] == ord('W')
+    addresses = parse_numbers(data, second_space + 1, ends)
+    return processors, writes, addresses
+
+
+def read_chunks(filename, chunk_bytes=1 << 26):
+    # Yields the trace in blocks of whole lines.
+    with open(filename, 'rb') as f:
+        rest = b''
+        while True:
+            buf = f.read(chunk_bytes)
+            if not buf:
+                break
+            buf = rest + buf
+            cut = buf.rfind(b'\n') + 1
+            rest = buf[cut:]
+            if cut > 0:
+                yield buf[:cut]
+        if rest.strip():
+            yield rest + b'\n'
+
+
+def merge_unique(parts):
+    return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+
+def analyse(filename, block_size=4, no_blocks=512, chunk_bytes=1 << 26):
+    # One pass over the trace. Counts are accumulated per chunk; the distinct (block, processor) pairs, which
+    # everything about sharing is derived from, are merged as they are found so memory follows the number of
+    # distinct blocks rather than the trace length.
+    offset_bits = (block_size - 1).bit_length()
+    reads = np.zeros(0, dtype=np.int64)
+    writes_per_processor = np.zeros(0, dtype=np.int64)
+    index_accesses = np.zeros(no_blocks, dtype=np.int64)
+    keys = []
+    write_keys = []
+    for buf in read_chunks(filename, chunk_bytes):
+        processors, writes, addresses = parse_chunk(buf)
+        if len(processors) == 0:
+            continue
+        size = max(len(reads), processors.max() + 1)
+        reads = np.pad(reads, (0, size - len(reads)))
+        writes_per_processor = np.pad(writes_per_processor, (0, size - len(writes_per_processor)))
+        reads += np.bincount(processors[~writes], minlength=size)
+        writes_per_processor += np.bincount(processors[writes], minlength=size)
+        _, index, _ = decode_addresses(addresses, block_size, no_blocks)
+        index_accesses += np.bincount(index, minlength=no_blocks)
+        chunk_keys = ((addresses >> offset_bits) << PROCESSOR_BITS) | processors
+        keys = [merge_unique(keys + [np.unique(chunk_keys)])]
+        write_keys = [merge_unique(write_keys + [np.unique(chunk_keys[writes])])]
+
+    keys = merge_unique(keys)
+    write_keys = merge_unique(write_keys)
+    blocks, sharers = np.unique(keys >> PROCESSOR_BITS, return_counts=True)
+    shared_blocks = blocks[sharers > 1]
+    written_blocks = np.unique(write_keys >> PROCESSOR_BITS)
+    write_shared_blocks = shared_blocks[np.isin(shared_blocks, written_blocks)]
+    accesses = reads + writes_per_processor
+    return {
+        'accesses': int(accesses.sum()),
+        'reads': int(reads.sum()),
+        'writes': int(writes_per_processor.sum()),
+        'processor_accesses': accesses.tolist(),
+        'processor_writes': writes_per_processor.tolist(),
+        'unique_blocks': int(len(blocks)),
+        'shared_blocks': int(len(shared_blocks)),
+        'write_shared_blocks': int(len(write_shared_blocks)),
+        'sharing_degree_histogram': np.bincount(sharers).tolist() if len(sharers) else [],
+        'index_accesses': index_accesses.tolist(),
+        'index_blocks': np.bincount(blocks & (no_blocks - 1), minlength=no_blocks).tolist(),
+    }
+
+
+def report(result, top=10):
+    st = "Total-accesses: {}\nReads: {}\nWrites: {}\nRead-write-ratio: {}\n".format(
+        result['accesses'], result['reads'], result['writes'],
+        result['reads'] / result['writes'] if result['writes'] > 0 else float('inf'))
+    for p, count in enumerate(result['processor_accesses']):
+        st += "P{}-accesses: {}\nP{}-writes: {}\n".format(p, count, p, result['processor_writes'][p])
+    st += "Unique-blocks: {}\nShared-blocks: {}\nWrite-shared-blocks: {}\n".format(
+        result['unique_blocks'], result['shared_blocks'], result['write_shared_blocks'])
+    for degree, count in enumerate(result['sharing_degree_histogram']):
+        if degree > 0 and count > 0:
+            st += "Blocks-used-by-{}-processors: {}\n".format(degree, count)
+    index_blocks = result['index_blocks']
+    order = sorted(range(len(index_blocks)), key=lambda i: (-index_blocks[i], -result['index_accesses'][i]))[:top]
+    st += "TOP {} INDEXES BY DISTINCT BLOCKS:\n{:>10} {:>10} {:>10}\n".format(len(order), 'Idx', 'Blocks', 'Accesses')
+    for i in order:
+        st += "{:>10} {:>10} {:>10}\n".format(i, index_blocks[i], result['index_accesses'][i])
+    return st
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Characterise a trace before simulating it: accesses per "
+                                                 "processor, read/write ratio, unique, shared and write-shared "
+                                                 "blocks and per-index pressure.")
+    parser.add_argument('file', help="Trace file name inside the 'cache-traces' directory, or a path.")
+    parser.add_argument('--block-size', type=int, default=4)
+    parser.add_argument('--cache-blocks', type=int, default=512)
+    parser.add_argument('--top', type=int, default=10, help="Number of indexes to list.")
+    parser.add_argument('--json', metavar='FILE', help="Also write the full result as JSON.")
+    args = parser.parse_args()
+
+    filename = args.file if path.dirname(args.file) else path.join('./cache-traces', args.file)
+    result = analyse(filename, args.block_size, args.cache_blocks)
+    print(report(result, args.top))
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(result, f)
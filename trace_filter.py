@@ -0,0 +1,57 @@
+from cache import decode_address
+from flight_recorder import EventType
+import argparse
+
+
+def parse_range(text):
+    # '12611' -> (12611, 12611), '12600-12700' -> (12600, 12700). Both ends are inclusive.
+    lo, _, hi = text.partition('-')
+    lo = int(lo)
+    hi = int(hi) if hi else lo
+    if hi < lo:
+        raise argparse.ArgumentTypeError('Range \'{}\' must be given as LOW-HIGH.'.format(text))
+    return lo, hi
+
+
+def parse_event_type(text):
+    name = text.upper().replace('-', '_')
+    if name not in EventType.__members__:
+        raise argparse.ArgumentTypeError('Event type \'{}\' is not accepted. Must be one of {}.'.format(
+            text, ', '.join(e.name.lower() for e in EventType)))
+    return EventType[name]
+
+
+class TraceFilter:
+    # Selects the accesses that get detailed trace output instead of toggling verbose mode for the whole trace.
+    # An access matches when its processor, address and cache index are all selected (None selects everything).
+    # With event types given, only those coherence events are printed for matching accesses; without them a
+    # matching access gets the full verbose explanation.
+    def __init__(self, processors=None, address_ranges=None, index_ranges=None, events=None, block_size=4,
+                 no_blocks=512):
+        self.processors = None if processors is None else frozenset(processors)
+        self.address_ranges = None if not address_ranges else list(address_ranges)
+        self.block_size = block_size
+        self.no_blocks = no_blocks
+        # Index ranges are flattened into a lookup table so the check is a single subscript.
+        self.indexes = None
+        if index_ranges:
+            self.indexes = bytearray(no_blocks)
+            for lo, hi in index_ranges:
+                for i in range(max(lo, 0), min(hi, no_blocks - 1) + 1):
+                    self.indexes[i] = 1
+        self.events = None if not events else frozenset(events)
+
+    def matches(self, p_num, address):
+        if self.processors is not None and p_num not in self.processors:
+            return False
+        if self.address_ranges is not None:
+            for lo, hi in self.address_ranges:
+                if lo <= address <= hi:
+                    break
+            else:
+                return False
+        if self.indexes is not None:
+            _, index, _ = decode_address(address, self.block_size, self.no_blocks)
+            if not self.indexes[index]:
+                return False
+        return True
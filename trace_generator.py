@@ -0,0 +1,161 @@
+from os import path
+import argparse
+import random
+import sys
+
+PATTERNS = ['uniform', 'producer-consumer', 'migratory', 'false-sharing', 'conflict']
+
+
+class TraceGenerator:
+    # Generates synthetic traces in the 'P<n> R|W <addr>' format, chunk by chunk so any length can be streamed
+    # in constant memory. A chunk is made of bursts of accesses, each burst following one of the patterns, picked
+    # by weight:
+    #   uniform            random accesses, shared_fraction of them to shared blocks each used by sharing_degree
+    #                      processors, the rest to a private working set per processor
+    #   producer-consumer  one processor writes a shared block, the next sharing_degree - 1 processors read it
+    #   migratory          a shared block is read then written by one processor after another
+    #   false-sharing      processors write their own word of the same block
+    #   conflict           accesses strided by the cache size, so they all land on the same few indexes
+    def __init__(self, no_processors=4, write_ratio=0.3, working_set=2048, shared_blocks=128, shared_fraction=0.1,
+                 sharing_degree=2, patterns=None, block_size=4, no_cache_blocks=512, conflict_ways=4, burst=64,
+                 seed=0):
+        self.no_processors = no_processors
+        self.write_ratio = write_ratio
+        self.working_set = working_set
+        self.shared_blocks = shared_blocks
+        self.shared_fraction = shared_fraction
+        self.sharing_degree = min(sharing_degree, no_processors)
+        self.block_size = block_size
+        self.no_cache_blocks = no_cache_blocks
+        self.conflict_ways = conflict_ways
+        self.burst = burst
+        self.rng = random.Random(seed)
+        if patterns is None:
+            patterns = {'uniform': 1}
+        for name in patterns:
+            if name not in PATTERNS:
+                raise Exception('Pattern \'{}\' is not accepted. Must be one of {}.'.format(name, ', '.join(PATTERNS)))
+        self.pattern_names = list(patterns)
+        self.pattern_weights = [patterns[n] for n in self.pattern_names]
+        self.generators = {'uniform': self.uniform, 'producer-consumer': self.producer_consumer,
+                           'migratory': self.migratory, 'false-sharing': self.false_sharing,
+                           'conflict': self.conflict}
+        # Shared blocks come first in the address space, each processor's private working set follows.
+        self.private_base = shared_blocks * block_size
+
+    def shared_block(self, p):
+        # A shared block whose sharers, processors b % P to (b + sharing_degree - 1) % P, include p.
+        k = self.rng.randrange(self.sharing_degree)
+        groups = max(self.shared_blocks // self.no_processors, 1)
+        return ((p - k) % self.no_processors + self.no_processors * self.rng.randrange(groups)) % self.shared_blocks
+
+    def uniform(self, n):
+        rng = self.rng
+        ps = [rng.randrange(self.no_processors) for i in range(n)]
+        writes = [rng.random() < self.write_ratio for i in range(n)]
+        addresses = []
+        for p in ps:
+            if rng.random() < self.shared_fraction:
+                addresses.append(self.shared_block(p) * self.block_size + rng.randrange(self.block_size))
+            else:
+                addresses.append(self.private_base + p * self.working_set + rng.randrange(self.working_set))
+        return ps, writes, addresses
+
+    def producer_consumer(self, n):
+        ps, writes, addresses = [], [], []
+        while len(ps) < n:
+            producer = self.rng.randrange(self.no_processors)
+            base = self.shared_block(producer) * self.block_size
+            for c in range(self.sharing_degree):
+                for word in range(self.block_size):
+                    ps.append((producer + c) % self.no_processors)
+                    writes.append(c == 0)
+                    addresses.append(base + word)
+        return ps[:n], writes[:n], addresses[:n]
+
+    def migratory(self, n):
+        ps, writes, addresses = [], [], []
+        while len(ps) < n:
+            p = self.rng.randrange(self.no_processors)
+            address = self.shared_block(p) * self.block_size + self.rng.randrange(self.block_size)
+            for step in range(self.sharing_degree):
+                q = (p + step) % self.no_processors
+                ps += [q, q]
+                writes += [False, True]
+                addresses += [address, address]
+        return ps[:n], writes[:n], addresses[:n]
+
+    def false_sharing(self, n):
+        rng = self.rng
+        ps = [rng.randrange(self.no_processors) for i in range(n)]
+        block = rng.randrange(self.shared_blocks)
+        writes = [rng.random() < max(self.write_ratio, 0.5) for i in range(n)]
+        addresses = [block * self.block_size + p % self.block_size for p in ps]
+        return ps, writes, addresses
+
+    def conflict(self, n):
+        rng = self.rng
+        stride = self.no_cache_blocks * self.block_size
+        ps = [rng.randrange(self.no_processors) for i in range(n)]
+        writes = [rng.random() < self.write_ratio for i in range(n)]
+        offset = rng.randrange(stride)
+        addresses = [self.private_base + offset + rng.randrange(self.conflict_ways) * stride for i in range(n)]
+        return ps, writes, addresses
+
+    def chunk(self, n):
+        # n accesses as text lines.
+        lines = []
+        while len(lines) < n:
+            name = self.rng.choices(self.pattern_names, self.pattern_weights)[0]
+            ps, writes, addresses = self.generators[name](min(self.burst, n - len(lines)))
+            lines += ['P{} {} {}\n'.format(p, 'W' if w else 'R', a) for p, w, a in zip(ps, writes, addresses)]
+        return ''.join(lines)
+
+    def chunks(self, no_accesses, chunk_size=65536):
+        while no_accesses > 0:
+            n = min(chunk_size, no_accesses)
+            yield self.chunk(n)
+            no_accesses -= n
+
+    def write(self, f, no_accesses, chunk_size=65536):
+        for text in self.chunks(no_accesses, chunk_size):
+            f.write(text)
+
+
+def parse_pattern(text):
+    # 'migratory' or 'migratory:3' -> ('migratory', 3.0)
+    name, _, weight = text.partition(':')
+    return name, float(weight) if weight else 1.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a synthetic trace in the 'P<n> R|W <addr>' format.")
+    parser.add_argument('output', help="File to write, '-' for stdout. Plain names go into 'cache-traces'.")
+    parser.add_argument('--accesses', type=int, default=1000000)
+    parser.add_argument('--processors', type=int, default=4)
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--working-set', type=int, default=2048, help="Private words per processor.")
+    parser.add_argument('--shared-blocks', type=int, default=128)
+    parser.add_argument('--shared-fraction', type=float, default=0.1,
+                        help="Share of uniform accesses that go to shared blocks.")
+    parser.add_argument('--sharing-degree', type=int, default=2, help="Processors sharing each shared block.")
+    parser.add_argument('--pattern', type=parse_pattern, action='append',
+                        help="Pattern with optional weight, e.g. migratory:2. One of {}. Can be repeated.".format(
+                            ', '.join(PATTERNS)))
+    parser.add_argument('--conflict-ways', type=int, default=4,
+                        help="Number of blocks competing for an index in the conflict pattern.")
+    parser.add_argument('--block-size', type=int, default=4)
+    parser.add_argument('--cache-blocks', type=int, default=512)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = TraceGenerator(args.processors, args.write_ratio, args.working_set, args.shared_blocks,
+                               args.shared_fraction, args.sharing_degree,
+                               dict(args.pattern) if args.pattern else None, args.block_size, args.cache_blocks,
+                               args.conflict_ways, seed=args.seed)
+    if args.output == '-':
+        generator.write(sys.stdout, args.accesses)
+    else:
+        output = args.output if path.dirname(args.output) else path.join('./cache-traces', args.output)
+        with open(output, 'w') as f:
+            generator.write(f, args.accesses)
@@ -0,0 +1,208 @@
+from array import array
+from cache import decode_address
+from os import path
+import heapq
+import json
+import os
+
+# Posting lists are stored as one file of byte offsets per group plus a file of where each key's list starts.
+GROUPS = ['processor', 'index']
+# Postings buffered while building an index before they are spilled to disk, and the most spilled runs merged
+# at once, which bounds the files open together.
+FLUSH_EVERY = 1 << 20
+MERGE_RUNS = 64
+
+
+def index_path_for(trace_path):
+    return trace_path + '.idx'
+
+
+def write_postings(index_path, name, postings, no_keys):
+    starts = array('Q', [0])
+    with open(path.join(index_path, '{}.bin'.format(name)), 'wb') as f:
+        for key in range(no_keys):
+            offsets = postings.get(key, array('Q'))
+            offsets.tofile(f)
+            starts.append(starts[-1] + len(offsets))
+    with open(path.join(index_path, '{}.starts'.format(name)), 'wb') as f:
+        starts.tofile(f)
+    return starts
+
+
+def merge_runs(index_path, name, runs, no_keys):
+    # Concatenates every key's postings from runs spilled while building, oldest first, so that each list stays
+    # in trace order, and returns the starts of the result. Runs store their keys in order, so each is read front
+    # to back once. A run spilled before a key was first seen has no list for it.
+    starts = array('Q', [0])
+    files = [open(path.join(index_path, '{}.bin'.format(run)), 'rb') for run, _ in runs]
+    try:
+        with open(path.join(index_path, '{}.bin'.format(name)), 'wb') as out:
+            for key in range(no_keys):
+                count = 0
+                for f, (_, run_starts) in zip(files, runs):
+                    if key + 1 < len(run_starts):
+                        n = run_starts[key + 1] - run_starts[key]
+                        out.write(f.read(n * starts.itemsize))
+                        count += n
+                starts.append(starts[-1] + count)
+    finally:
+        for f in files:
+            f.close()
+    with open(path.join(index_path, '{}.starts'.format(name)), 'wb') as f:
+        starts.tofile(f)
+    for run, _ in runs:
+        os.remove(path.join(index_path, '{}.bin'.format(run)))
+        os.remove(path.join(index_path, '{}.starts'.format(run)))
+    return starts
+
+
+def merge_group(index_path, group, runs, no_keys):
+    # Merges a group's runs MERGE_RUNS at a time into bigger runs until one merge gives the final lists.
+    level = 0
+    while len(runs) > MERGE_RUNS:
+        merged = []
+        for i in range(0, len(runs), MERGE_RUNS):
+            run = '{}.merge{}-{}'.format(group, level, len(merged))
+            merged.append((run, merge_runs(index_path, run, runs[i:i + MERGE_RUNS], no_keys)))
+        runs = merged
+        level += 1
+    merge_runs(index_path, group, runs, no_keys)
+
+
+def build_index(trace_path, index_path=None, checkpoint_every=1024, block_size=4, no_cache_blocks=512,
+                flush_every=FLUSH_EVERY):
+    # One pass over the trace recording the byte offset of every checkpoint_every-th line, and for every
+    # processor and every cache index the byte offsets of the accesses that belong to it. Postings are spilled to
+    # disk every flush_every accesses and merged at the end, so memory does not grow with the trace.
+    if index_path is None:
+        index_path = index_path_for(trace_path)
+    os.makedirs(index_path, exist_ok=True)
+    checkpoints = array('Q')
+    postings = {'processor': {}, 'index': {}}
+    # Group -> (name, starts) of the spilled runs.
+    runs = {group: [] for group in GROUPS}
+    buffered = 0
+    no_processors = 0
+    offset = 0
+    line_no = 0
+
+    def spill():
+        for group in GROUPS:
+            run = '{}.run{}'.format(group, len(runs[group]))
+            no_keys = no_processors if group == 'processor' else no_cache_blocks
+            runs[group].append((run, write_postings(index_path, run, postings[group], no_keys)))
+            postings[group] = {}
+
+    with open(trace_path, 'rb') as f:
+        for line in f:
+            if line_no % checkpoint_every == 0:
+                checkpoints.append(offset)
+            parts = line.split()
+            if len(parts) == 3:
+                p_num = int(parts[0][1:])
+                no_processors = max(no_processors, p_num + 1)
+                _, index, _ = decode_address(int(parts[2]), block_size, no_cache_blocks)
+                for group, key in (('processor', p_num), ('index', index)):
+                    offsets = postings[group].get(key)
+                    if offsets is None:
+                        offsets = postings[group][key] = array('Q')
+                    offsets.append(offset)
+                buffered += 1
+                if buffered == flush_every:
+                    spill()
+                    buffered = 0
+            offset += len(line)
+            line_no += 1
+
+    with open(path.join(index_path, 'checkpoints.bin'), 'wb') as f:
+        checkpoints.tofile(f)
+    if runs['index']:
+        if buffered:
+            spill()
+        merge_group(index_path, 'processor', runs['processor'], no_processors)
+        merge_group(index_path, 'index', runs['index'], no_cache_blocks)
+    else:
+        write_postings(index_path, 'processor', postings['processor'], no_processors)
+        write_postings(index_path, 'index', postings['index'], no_cache_blocks)
+    st = os.stat(trace_path)
+    meta = {'trace_size': st.st_size, 'trace_mtime': st.st_mtime, 'lines': line_no,
+            'checkpoint_every': checkpoint_every, 'block_size': block_size, 'no_cache_blocks': no_cache_blocks,
+            'no_processors': no_processors}
+    with open(path.join(index_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return TraceIndex(trace_path, index_path)
+
+
+class TraceIndex:
+    # Read side of an index built by build_index. Only the small per-key start arrays are loaded up front,
+    # posting lists are read from disk for the keys asked for.
+    def __init__(self, trace_path, index_path=None):
+        self.trace_path = trace_path
+        self.index_path = index_path if index_path is not None else index_path_for(trace_path)
+        with open(path.join(self.index_path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.starts = {}
+        for group in GROUPS:
+            starts = array('Q')
+            with open(path.join(self.index_path, '{}.starts'.format(group)), 'rb') as f:
+                starts.frombytes(f.read())
+            self.starts[group] = starts
+
+    def is_current(self):
+        st = os.stat(self.trace_path)
+        return st.st_size == self.meta['trace_size'] and st.st_mtime == self.meta['trace_mtime']
+
+    def postings(self, group, key):
+        starts = self.starts[group]
+        offsets = array('Q')
+        if key < 0 or key >= len(starts) - 1:
+            return offsets
+        with open(path.join(self.index_path, '{}.bin'.format(group)), 'rb') as f:
+            f.seek(starts[key] * offsets.itemsize)
+            offsets.frombytes(f.read((starts[key + 1] - starts[key]) * offsets.itemsize))
+        return offsets
+
+    def offsets_for(self, group, keys):
+        # Byte offsets of all accesses belonging to any of the keys, in trace order.
+        return list(heapq.merge(*[self.postings(group, k) for k in sorted(set(keys))]))
+
+    def indexes_for_addresses(self, addresses):
+        return {decode_address(a, self.meta['block_size'], self.meta['no_cache_blocks'])[1] for a in addresses}
+
+    def line_offset(self, line_no):
+        # Byte offset of a 0-based line number: seek to the checkpoint before it and skip the remaining lines.
+        every = self.meta['checkpoint_every']
+        checkpoint = array('Q')
+        with open(path.join(self.index_path, 'checkpoints.bin'), 'rb') as f:
+            f.seek((line_no // every) * checkpoint.itemsize)
+            checkpoint.frombytes(f.read(checkpoint.itemsize))
+        with open(self.trace_path, 'rb') as f:
+            f.seek(checkpoint[0])
+            for i in range(line_no % every):
+                f.readline()
+            return f.tell()
+
+    def read_lines(self, offsets):
+        with open(self.trace_path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                yield f.readline().decode()
+
+    def read_line_range(self, start, end):
+        # Lines start (inclusive) to end (exclusive), 0-based.
+        with open(self.trace_path, 'rb') as f:
+            f.seek(self.line_offset(start))
+            for i in range(start, min(end, self.meta['lines'])):
+                yield f.readline().decode()
+
+
+def load_index(trace_path, block_size=4, no_cache_blocks=512):
+    # Loads the index next to the trace, building it first when it is missing, out of date or was built for
+    # another cache geometry.
+    index_path = index_path_for(trace_path)
+    if path.exists(path.join(index_path, 'meta.json')):
+        index = TraceIndex(trace_path, index_path)
+        if index.is_current() and index.meta['block_size'] == block_size and \
+                index.meta['no_cache_blocks'] == no_cache_blocks:
+            return index
+    return build_index(trace_path, index_path, block_size=block_size, no_cache_blocks=no_cache_blocks)
@@ -0,0 +1,74 @@
+# Protocol messages. Requests go from a processor to the directory, forwards from the directory to the cache that
+# supplies the data, data replies carry a block to the requester, invalidations go to the other copies on a write
+# (the one to the closest sharer doubling as its forward), acks answer invalidations, grant an upgrade or tell the
+# writer how many acks to expect, writebacks carry a modified block home and hints tell the home a clean copy was
+# replaced (with eviction notifications).
+MESSAGE_TYPES = ['request', 'forward', 'data', 'invalidation', 'ack', 'writeback', 'hint']
+DATA_MESSAGES = {'data', 'writeback'}
+# Bytes of a message header (type, address, source and destination) and of a word of data.
+HEADER_BYTES = 8
+WORD_BYTES = 4
+# Stands for the centralised directory in link names.
+DIRECTORY = 'D'
+
+
+class Traffic:
+    # Counts the messages the protocol sends and the bytes they put on every link. Processors talk to each other
+    # over the unidirectional ring the hop costs assume (link Pi->Pi+1), a centralised directory has a link to and
+    # from every processor, and a directory sliced across the processors is reached over the ring at the home node.
+    # A link carries link_width bytes a cycle, what the stats report its utilisation from. Cycles are not affected.
+    def __init__(self, stats, no_processors, block_size, centralised=True, link_width=16):
+        self.stats = stats
+        self.no_processors = no_processors
+        self.control_bytes = HEADER_BYTES
+        self.data_bytes = HEADER_BYTES + block_size * WORD_BYTES
+        self.link_width = link_width
+        # (src, dst) -> links crossed.
+        self.routes = {}
+        stats.link_width = link_width
+        stats.messages = {kind: 0 for kind in MESSAGE_TYPES}
+        stats.message_bytes = {kind: 0 for kind in MESSAGE_TYPES}
+        stats.messages_sent = [0] * no_processors
+        stats.bytes_sent = [0] * no_processors
+        stats.bytes_received = [0] * no_processors
+        links = []
+        if centralised:
+            for p in range(no_processors):
+                links += ['P{}->{}'.format(p, DIRECTORY), '{}->P{}'.format(DIRECTORY, p)]
+        links += ['P{}->P{}'.format(p, (p + 1) % no_processors) for p in range(no_processors)]
+        stats.link_bytes = {link: 0 for link in links}
+        stats.link_cycles = {link: 0 for link in links}
+
+    def route(self, src, dst):
+        if src == dst:
+            return []
+        if src == DIRECTORY:
+            return ['{}->P{}'.format(DIRECTORY, dst)]
+        if dst == DIRECTORY:
+            return ['P{}->{}'.format(src, DIRECTORY)]
+        n = self.no_processors
+        return ['P{}->P{}'.format(p % n, (p + 1) % n) for p in range(src, src + (dst - src) % n)]
+
+    def send(self, kind, src, dst, home=None):
+        # src and dst are processor numbers, None for the directory: the home node home of a sliced directory,
+        # else the centralised one.
+        stats = self.stats
+        if src is None:
+            src = DIRECTORY if home is None else home
+        if dst is None:
+            dst = DIRECTORY if home is None else home
+        size = self.data_bytes if kind in DATA_MESSAGES else self.control_bytes
+        stats.messages[kind] += 1
+        stats.message_bytes[kind] += size
+        links = self.routes.get((src, dst))
+        if links is None:
+            links = self.routes[(src, dst)] = self.route(src, dst)
+        cycles = -(-size // self.link_width)
+        for link in links:
+            stats.link_bytes[link] += size
+            stats.link_cycles[link] += cycles
+        if src != DIRECTORY:
+            stats.messages_sent[src] += 1
+            stats.bytes_sent[src] += size
+        if dst != DIRECTORY:
+            stats.bytes_received[dst] += size
@@ -0,0 +1,69 @@
+from cache import CacheLine, CacheState
+from flight_recorder import EventType
+
+
+class VictimCache:
+    # Small fully-associative buffer next to one private cache that catches the lines it replaces, dirty ones
+    # included, oldest first out. A miss whose block is here swaps it back with the line it maps to instead of
+    # going to the directory, a modified line coming back this way is a replacement write-back saved.
+    # The directory's entries only follow the cache itself, so it snoops the victim caches on every request
+    # (see Directory.snoop_victims).
+    def __init__(self, cache, entries=4, latency=1):
+        self.cache = cache
+        self.entries = entries
+        self.latency = latency
+        # Block number -> state, in insertion order.
+        self.lines = {}
+
+    def block_of(self, index, tag):
+        return tag * self.cache.no_sets + index // self.cache.ways
+
+    def insert(self, index, tag, state):
+        # Takes the valid line the cache is replacing at index.
+        if len(self.lines) >= self.entries:
+            block = next(iter(self.lines))
+            self.drop(block, self.lines.pop(block))
+        self.lines[self.block_of(index, tag)] = state
+
+    def drop(self, block, state):
+        cache = self.cache
+        index, tag = (block % cache.no_sets) * cache.ways, block // cache.no_sets
+        if state == CacheState.MODIFIED:
+            if cache.verbose:
+                print("REPLACEMENT WRITE-BACK: Line leaving the victim cache was in M state.")
+            cache.stats.replacement_writebacks += 1
+            cache.stats.record(EventType.REPLACEMENT_WRITEBACK, cache.p_num, index, tag)
+        else:
+            cache.stats.record(EventType.EVICTION, cache.p_num, index, tag)
+        cache.directory.replaced(index, tag, cache.p_num, state)
+
+    def swap(self, index, tag):
+        # Called on a tag miss at index. Returns True if the block was here and is now back in the cache.
+        cache = self.cache
+        state = self.lines.pop(self.block_of(index, tag), None)
+        if state is None:
+            return False
+        if cache.verbose:
+            print("Victim cache hit, block swapped back in {} state.".format(state))
+        cache.stats.victim_cache_access(self.latency)
+        cache.stats.victim_hits += 1
+        if state == CacheState.MODIFIED:
+            cache.stats.victim_saved_writebacks += 1
+        line = cache.cache_lines[index]
+        if line.state != CacheState.INVALID:
+            self.lines[self.block_of(index, line.tag)] = line.state
+        cache.cache_lines[index] = CacheLine(state, tag)
+        cache.directory.refill(cache.p_num, index, tag, state)
+        return True
+
+    def snoop(self, block, write):
+        # A request from another processor: a write invalidates the copy, a read leaves it in S. Returns the
+        # state the copy was in, None if there was none.
+        state = self.lines.get(block)
+        if state is None:
+            return None
+        if write:
+            del self.lines[block]
+        else:
+            self.lines[block] = CacheState.SHARED
+        return state